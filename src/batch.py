@@ -0,0 +1,175 @@
+# This Python file uses the following encoding: utf-8
+"""
+Headless batch runner. Solves every model JSON from the given files and
+directories on a process pool and writes the results with ResultsExport.
+
+    python src/batch.py src/data src/examples/dome_data.json -a nonlinear -o results
+"""
+import argparse
+import contextlib
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from structure.build_model import Truss2D, Truss3D
+from structure.solver import LinearSolver2D, LinearSolver3D, NonlinearForceSolver2D, NonlinearForceSolver3D, SPARSE_DOFS
+from data_exchange.export import ResultsExport, StepResultsWriter
+from data_exchange.model_import import ModelImport
+from data_exchange.container import EXTENSION
+
+PHASES = ("import", "build", "solve", "export")
+
+
+def model_paths(sources):
+    """Model files given directly or found in the given directories, sorted per directory"""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths += sorted(glob.glob(os.path.join(source, "*.json")) +
+                            glob.glob(os.path.join(source, "*"+EXTENSION)))
+        else:
+            paths.append(source)
+    return paths
+
+
+def analyse(truss, data, options, observers=None):
+    """Run the chosen analysis on a built model with the generic solvers"""
+    backend = "sparse" if truss.max_edof > SPARSE_DOFS else "dense"
+    if truss.ext != "Forces":
+        raise ValueError("Batch analyses need a model loaded by forces")
+
+    if options["analysis"] == "linear":
+        if data.structure_type == "2D":
+            return LinearSolver2D(truss.edof, truss.max_edof, truss.ex, truss.ey, data.ep, truss.e_num, truss.supports, truss.forces,
+                                  plan=truss.partition, geometry=truss.geometry, backend=backend)
+        return LinearSolver3D(truss.edof, truss.max_edof, truss.ex, truss.ey, truss.ez, data.ep, truss.e_num, truss.supports, truss.forces,
+                              plan=truss.partition, geometry=truss.geometry, backend=backend)
+
+    # Track the dof with the largest load, already in the solved numbering
+    dofTrack = int(np.argmax(np.abs(truss.forces)))
+    settings = dict(plan=truss.partition, geometry=truss.geometry, backend=backend,
+                    strategy=options["strategy"], adaptive=options["adaptive"], observers=observers)
+    if data.structure_type == "2D":
+        return NonlinearForceSolver2D(truss.edof, truss.max_edof, truss.ex, truss.ey, data.ep, truss.e_num, truss.supports, truss.forces,
+                                      options["increments"], options["max_iter"], options["res_norm"], options["dis_norm"], dofTrack, **settings)
+    return NonlinearForceSolver3D(truss.edof, truss.max_edof, truss.ex, truss.ey, truss.ez, data.ep, truss.e_num, truss.supports, truss.forces,
+                                  options["increments"], options["max_iter"], options["res_norm"], options["dis_norm"], dofTrack, **settings)
+
+
+def solve_model(path, options):
+    """
+    Import, build, solve and export one model in a worker process.
+    Return a report dict with the phase times, errors are reported instead of raised.
+    """
+    report = {"path": path, "error": None, "dofs": 0,
+              "times": dict.fromkeys(PHASES, 0.)}
+    times = report["times"]
+    log = sys.stdout if options["verbose"] else open(os.devnull, "w")
+    try:
+        with contextlib.redirect_stdout(log):
+            start = time.perf_counter()
+            data = ModelImport(path, stream=options["stream"], cache=options["cache"])
+            times["import"] = time.perf_counter()-start
+
+            start = time.perf_counter()
+            truss = Truss2D(data) if data.structure_type == "2D" else Truss3D(data)
+            truss.build_model(reorder=True)
+            report["dofs"] = truss.max_edof
+            times["build"] = time.perf_counter()-start
+
+            name = os.path.splitext(os.path.basename(path))[0]
+            observers = []
+            if options["steps"]:
+                observers.append(StepResultsWriter(data, os.path.join(
+                    options["output"], f"{name}_{options['analysis']}_steps.jsonl"), truss.dof_order))
+
+            start = time.perf_counter()
+            solve = analyse(truss, data, options, observers)
+            truss.original_numbering(solve)
+            times["solve"] = time.perf_counter()-start
+            if getattr(solve, "converged", True) is False:
+                report["error"] = "not converged"
+
+            start = time.perf_counter()
+            ResultsExport(data, solve, os.path.join(
+                options["output"], f"{name}_{options['analysis']}_results.json"))
+            times["export"] = time.perf_counter()-start
+    except Exception as error:
+        report["error"] = f"{type(error).__name__}: {error}"
+    finally:
+        if log is not sys.stdout:
+            log.close()
+    return report
+
+
+def summary(reports, wall):
+    """Print the per-model status and the throughput of the batch"""
+    failed = [r for r in reports if r["error"] is not None]
+    print('--------------------------------------')
+    for r in reports:
+        status = "ok" if r["error"] is None else r["error"]
+        total = sum(r["times"].values())
+        print(f"{r['path']}: {status}, dofs {r['dofs']}, {total:.3f} s")
+    print('--------------------------------------')
+    print(f"Models: {len(reports)}, failed: {len(failed)}, wall time: {wall:.3f} s, "
+          f"throughput: {len(reports)/wall:.2f} models/s")
+    for phase in PHASES:
+        total = sum(r["times"][phase] for r in reports)
+        print(f"{phase:>7}: {total:.3f} s total, {total/max(len(reports), 1):.4f} s per model")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Solve many truss models without the GUI")
+    parser.add_argument("models", nargs="+",
+                        help="model JSON files or directories with them")
+    parser.add_argument("-a", "--analysis", choices=("linear", "nonlinear"), default="linear")
+    parser.add_argument("-o", "--output", default="results",
+                        help="directory for the results JSON files")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes, all cores by default")
+    parser.add_argument("--increments", type=int, default=10)
+    parser.add_argument("--max-iter", type=int, default=50)
+    parser.add_argument("--res-norm", type=float, default=1e-6)
+    parser.add_argument("--dis-norm", type=float, default=1e-6)
+    parser.add_argument("--strategy", choices=NonlinearForceSolver2D.strategies, default="full")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="adaptive load stepping in nonlinear analyses")
+    parser.add_argument("--steps", action="store_true",
+                        help="stream every nonlinear step to a JSON Lines file")
+    parser.add_argument("--stream", action="store_true",
+                        help="parse JSON models incrementally, for very large files")
+    parser.add_argument("--no-cache", dest="cache", action="store_false",
+                        help="always parse JSON models, skip the per-user model cache")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="keep the solver printout")
+    args = parser.parse_args(argv)
+
+    paths = model_paths(args.models)
+    if not paths:
+        parser.error("no model files found")
+    os.makedirs(args.output, exist_ok=True)
+    options = dict(analysis=args.analysis, output=args.output, increments=args.increments,
+                   max_iter=args.max_iter, res_norm=args.res_norm, dis_norm=args.dis_norm,
+                   strategy=args.strategy, adaptive=args.adaptive, steps=args.steps,
+                   stream=args.stream, cache=args.cache, verbose=args.verbose)
+
+    start = time.perf_counter()
+    reports = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(solve_model, path, options) for path in paths]
+        for future in as_completed(futures):
+            reports.append(future.result())
+    wall = time.perf_counter()-start
+
+    reports.sort(key=lambda r: paths.index(r["path"]))
+    summary(reports, wall)
+    return 1 if any(r["error"] is not None for r in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import sys
+import numpy as np
+from data_exchange.container import EXTENSION, MODEL_ARRAYS, read_container, write_container
+
+# Cache of parsed JSON models, HerMES binary containers in a per-user cache folder:
+#   ~/.cache/hermes/<sha256 of the absolute model path>.cache.hmb
+# The folder is HERMES_CACHE_DIR when it is set. The header keeps the key of the parsed
+# file. The cache is used while the size and modification time match, or the content
+# hash when only the time changed (a copy or a checkout of the same file), the key is
+# then rewritten with the new time. Any other change of the JSON invalidates it.
+SUFFIX = ".cache"+EXTENSION
+# Bump when the parsed layout changes, older caches are rebuilt
+VERSION = 1
+BLOCK = 1 << 20
+
+
+def cache_dir():
+    """Per-user folder of the model caches"""
+    folder = os.environ.get("HERMES_CACHE_DIR")
+    if folder:
+        return folder
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+        return os.path.join(base, "HerMES", "cache")
+    if sys.platform == "darwin":
+        return os.path.join(os.path.expanduser("~"), "Library", "Caches", "HerMES")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "hermes")
+
+
+def cache_path(path):
+    """Cache file of the model, named after its absolute path"""
+    name = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir(), name+SUFFIX)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(path, digest=True):
+    """Identity of the file content, taken before it is parsed"""
+    stat = os.stat(path)
+    key = {"version": VERSION, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if digest:
+        key["sha256"] = file_hash(path)
+    return key
+
+
+def load_cached(path, mmap=True):
+    """Parsed model from the cache, None when it is missing or stale"""
+    try:
+        header, arrays = read_container(cache_path(path), mmap)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    cached = header.pop("cache", None)
+    key = cache_key(path, digest=False)
+    if cached is None or cached["version"] != key["version"] or cached["size"] != key["size"]:
+        return None
+    if cached["mtime"] != key["mtime"]:
+        if cached["sha256"] != file_hash(path):
+            return None
+        # The key takes the new time, later loads match it without hashing again
+        store_cached(path, dict(key, sha256=cached["sha256"]), dict(header, **arrays))
+
+    header.update(arrays)
+    return header
+
+
+def store_cached(path, key, json_data):
+    """
+    Write the parsed model to its cache file. The file is replaced atomically, so
+    parallel imports never read a partial cache. Models whose arrays do not map to
+    numeric arrays are left without a cache, as are all models when the cache
+    folder is not writable.
+    :param dict key: cache_key() taken before parsing
+    :param dict json_data: parsed model
+    """
+    header = {k: v for k, v in json_data.items() if k not in MODEL_ARRAYS}
+    arrays = {k: np.asarray(json_data[k]) for k in MODEL_ARRAYS if k in json_data}
+    if any(a.dtype.kind not in "biuf" for a in arrays.values()):
+        return False
+
+    cached = cache_path(path)
+    temp = f"{cached}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        write_container(temp, dict(header, cache=key), arrays)
+        os.replace(temp, cached)
+    except OSError:
+        if os.path.exists(temp):
+            os.remove(temp)
+        return False
+    return True
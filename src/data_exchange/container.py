@@ -0,0 +1,83 @@
+import json
+import struct
+import numpy as np
+
+# HerMES binary model container (.hmb):
+#   magic [8 bytes] | header length [uint64, little endian] | JSON header | arrays
+# The header keeps the scalar entries of the JSON model and, for every array,
+# its dtype, shape and offset. Arrays are raw C-order data aligned to ALIGN bytes,
+# so they are read as views of one memory map.
+MAGIC = b"HERMESB1"
+ALIGN = 64
+EXTENSION = ".hmb"
+# Entries of the JSON model schema stored as arrays, the rest goes to the header
+MODEL_ARRAYS = ("E", "A", "coords", "elems", "supports", "forces", "displacements")
+
+
+def is_container(path):
+    """True when the file starts with the container magic"""
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def padding(offset):
+    return -offset % ALIGN
+
+
+def write_container(path, header, arrays):
+    """
+    :param str path: output file
+    :param dict header: JSON-serializable scalar entries
+    :param dict arrays: name -> array, stored in the given order
+    """
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, a in arrays.items():
+        layout[name] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": offset}
+        offset += a.nbytes+padding(a.nbytes)
+
+    text = json.dumps(dict(header, arrays=layout)).encode("utf-8")
+    start = len(MAGIC)+8+len(text)
+    text += b" "*padding(start)
+
+    with open(path, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<Q", len(text)))
+        file.write(text)
+        for a in arrays.values():
+            file.write(a.tobytes())
+            file.write(b"\0"*padding(a.nbytes))
+
+
+def read_container(path, mmap=True):
+    """
+    Return (header, arrays). With mmap the arrays are copy-on-write views of the
+    memory-mapped file, they can be modified without changing the file.
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a HerMES binary model")
+        prefix = file.read(8)
+        size = struct.unpack("<Q", prefix)[0] if len(prefix) == 8 else -1
+        text = file.read(size) if size >= 0 else b""
+        if len(text) != size:
+            raise ValueError(f"{path} is truncated")
+        header = json.loads(text.decode("utf-8"))
+    start = len(MAGIC)+8+size
+
+    if mmap:
+        raw = np.memmap(path, dtype=np.uint8, mode="c")
+    else:
+        raw = np.fromfile(path, dtype=np.uint8)
+
+    arrays = {}
+    for name, entry in header.pop("arrays").items():
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        begin = start+entry["offset"]
+        count = int(np.prod(shape, dtype=np.int64))
+        if begin+count*dtype.itemsize > len(raw):
+            raise ValueError(f"{path} is truncated")
+        arrays[name] = raw[begin:begin+count*dtype.itemsize].view(dtype).reshape(shape)
+    return header, arrays
@@ -1,5 +1,7 @@
 import numpy as np
 import json
+import os
+from data_exchange.container import write_container, MODEL_ARRAYS
 
 
 class ModelExport(object):
@@ -24,8 +26,8 @@ class ModelExport(object):
             data = {}
             data["example"] = self.data.example
             data["structure_type"] = self.structure_type
-            data["E"] = self.data.E
-            data["A"] = self.data.A
+            data["E"] = np.asarray(self.data.E).tolist()
+            data["A"] = np.asarray(self.data.A).tolist()
             data["coords"] = self.coords
             data["elems"] = self.elems
             data["supports"] = self.supports
@@ -55,8 +57,8 @@ class ModelExport(object):
             data = {}
             data["example"] = self.data.example
             data["structure_type"] = self.structure_type
-            data["E"] = self.data.E
-            data["A"] = self.data.A
+            data["E"] = np.asarray(self.data.E).tolist()
+            data["A"] = np.asarray(self.data.A).tolist()
             data["coords"] = self.coords
             data["elems"] = self.elems
             data["supports"] = self.supports
@@ -66,6 +68,42 @@ class ModelExport(object):
             json.dump(data, file, indent=4)
             file.close()
 
+    def model(self):
+        """Entries of the JSON model schema in file order"""
+        data = {}
+        data["example"] = self.data.example
+        data["structure_type"] = self.data.structure_type
+        data["E"] = self.data.E
+        data["A"] = self.data.A
+        if self.data.example == "von Mises Truss":
+            for key in ("L", "H", "L0", "sb0", "P"):
+                data[key] = getattr(self.data, key)
+        data["coords"] = self.data.coords
+        data["elems"] = self.data.elems
+        data["supports"] = self.data.supports
+        for key in ("forces", "displacements"):
+            if hasattr(self.data, key):
+                data[key] = getattr(self.data, key)
+        return data
+
+    def toBinary(self):
+        """Model in the HerMES binary container, arrays keep their dtype"""
+        data = self.model()
+        arrays = {key: np.asarray(data.pop(key))
+                  for key in MODEL_ARRAYS if key in data}
+        write_container(self.path, data, arrays)
+
+    def toJSON(self):
+        """Model in the JSON schema, the inverse of toBinary()"""
+        data = self.model()
+        for key in MODEL_ARRAYS:
+            if key in data:
+                data[key] = np.asarray(data[key]).tolist()
+
+        file = open(self.path, "w")
+        json.dump(data, file, indent=4)
+        file.close()
+
 
 class ResultsExport(object):
     def __init__(self, data, results, path):
@@ -87,8 +125,8 @@ class ResultsExport(object):
         self.dis_coords = self.dis_coords.tolist()
 
         data = {}
-        data["E"] = self.data.E
-        data["A"] = self.data.A
+        data["E"] = np.asarray(self.data.E).tolist()
+        data["A"] = np.asarray(self.data.A).tolist()
         data["coords"] = self.coords
         data["elems"] = self.elems
         data["supports"] = self.supports
@@ -103,3 +141,72 @@ class ResultsExport(object):
         file = open(self.path, "w")
         json.dump(data, file, indent=4)
         file.close()
+
+
+class StepResultsWriter(object):
+    """
+    Nonlinear solver observer streaming every accepted step to a JSON Lines file.
+    Each line is written and flushed when the step completes, so an interrupted
+    run leaves its history up to the last step and nothing is kept in memory.
+    Lines: a header, one record per step and a closing record from finish().
+    """
+
+    def __init__(self, data, path, dof_order=None, sync=False):
+        """
+        :param data: imported model (ModelImport)
+        :param str path: output file, overwritten when the analysis starts
+        :param array dof_order: dof_order of a renumbered model, results are
+            written in the original numbering
+        :param bool sync: fsync after every step, survives a system crash too
+        """
+        self.data = data
+        self.path = path
+        self.dof_order = dof_order
+        self.sync = sync
+        self.dim = 2 if data.structure_type == "2D" else 3
+        self.file = None
+
+    def write(self, record):
+        self.file.write(json.dumps(record)+"\n")
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+    def original(self, v):
+        v = np.asarray(v, dtype=float).reshape(-1)
+        if self.dof_order is None:
+            return v
+        w = np.zeros(v.shape)
+        w[self.dof_order] = v
+        return w
+
+    def start(self, solver):
+        self.file = open(self.path, "w")
+        header = {}
+        header["record"] = "header"
+        header["example"] = self.data.example
+        header["structure_type"] = self.data.structure_type
+        header["model"] = self.data.path
+        header["solver"] = type(solver).__name__
+        self.write(header)
+
+    def step(self, solver, step, itr, converged):
+        record = {}
+        record["record"] = "step"
+        record["step"] = step
+        record["iterations"] = itr
+        record["converged"] = bool(converged)
+        if hasattr(solver, "load_factor"):
+            record["load_factor"] = float(solver.load_factor)
+        record["nodal_q"] = self.original(solver.q).reshape(-1, self.dim).tolist()
+        record["nodal_R"] = self.original(solver.R).reshape(-1, self.dim).tolist()
+        record["element_Ne"] = np.asarray(solver.Ne, dtype=float).reshape(-1).tolist()
+        self.write(record)
+
+    def finish(self, solver):
+        record = {}
+        record["record"] = "finish"
+        record["converged"] = bool(getattr(solver, "converged", True))
+        self.write(record)
+        self.file.close()
+        self.file = None
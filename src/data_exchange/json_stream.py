@@ -0,0 +1,197 @@
+import json
+import numpy as np
+
+# Bytes read from the file at once
+CHUNK = 1 << 20
+
+_WS = b" \t\r\n"
+_OPEN, _CLOSE, _COMMA, _SPACE = ord("["), ord("]"), ord(","), ord(" ")
+
+
+def _table(chars, value=True):
+    """Lookup table byte -> bool, indexed with the uint8 view of the text"""
+    table = np.full(256, not value)
+    table[list(chars)] = value
+    return table
+
+
+_FLOAT = _table(b".eE")
+_VALUE = _table(b"[], \t\r\n", False)
+
+
+class GrowableArray(object):
+    """Float buffer that doubles its capacity when it is full"""
+
+    def __init__(self, capacity=1024):
+        self.data = np.empty(capacity)
+        self.size = 0
+
+    def extend(self, values):
+        end = self.size+len(values)
+        if end > len(self.data):
+            data = np.empty(max(end, 2*len(self.data)))
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        self.data[self.size:end] = values
+        self.size = end
+
+    def array(self):
+        """Filled part, the spare capacity is released in place"""
+        self.data.resize(self.size, refcheck=False)
+        return self.data
+
+
+class JSONStream(object):
+    """
+    Incremental reader of a JSON model: one object whose values are scalars or
+    arrays of numbers nested at most twice (the model schema). Arrays are parsed
+    chunk by chunk straight into numpy buffers, the document never exists as
+    Python lists. Arrays without a float come out as int64, like np.array() of
+    the decoded lists.
+    """
+
+    def __init__(self, file, chunk_size=CHUNK):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = b""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, n):
+        """Make n bytes after pos available unless the file ends first"""
+        while len(self.buffer)-self.pos < n and not self.eof:
+            chunk = self.file.read(max(self.chunk_size, n))
+            if not chunk:
+                self.eof = True
+                break
+            self.buffer = self.buffer[self.pos:]+chunk
+            self.pos = 0
+
+    def peek(self):
+        """Next character after whitespace, b"" at the end of file"""
+        while True:
+            self.fill(1)
+            char = self.buffer[self.pos:self.pos+1]
+            if char == b"" or char not in _WS:
+                return char
+            self.pos += 1
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char.decode()} in {self.file.name}")
+        self.pos += 1
+
+    def scalar(self):
+        """String, number, literal or small object decoded by the json module"""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            self.fill(size)
+            text = self.buffer[self.pos:].decode("utf-8", errors="ignore")
+            try:
+                value, end = self.decoder.raw_decode(text)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(text) or self.eof:
+                    self.pos += len(text[:end].encode("utf-8"))
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            size *= 2
+
+    def array(self):
+        """Array of numbers [n] or of rows of numbers [n x width]"""
+        self.expect(b"[")
+        values = GrowableArray()
+        rows = 0
+        width = None
+        flat = False
+        floating = False
+
+        while True:
+            chunk = np.frombuffer(self.buffer, dtype=np.uint8, offset=self.pos)
+            opening = chunk == _OPEN
+            closing = chunk == _CLOSE
+            level = 1+np.cumsum(opening.view(np.int8)-closing.view(np.int8), dtype=np.int32)
+            closed = np.flatnonzero(level == 0)
+            if len(closed):
+                end = closed[0]
+            else:
+                # Parse up to the last separator between complete entries
+                cuts = np.flatnonzero((chunk == _COMMA) & (level == 1))
+                if len(cuts) == 0:
+                    if self.eof:
+                        raise ValueError(f"Unexpected end of {self.file.name} in an array")
+                    self.fill(len(chunk)+self.chunk_size)
+                    continue
+                end = cuts[-1]
+
+            segment = chunk[:end]
+            if end and level[:end].max() > 2:
+                raise ValueError("Arrays nested more than twice are not supported")
+            opens = int(np.count_nonzero(opening[:end]))
+            flat = flat or bool(_VALUE[segment[level[:end] == 1]].any())
+            if flat and (opens or rows):
+                raise ValueError("Arrays must hold only numbers or only rows of numbers")
+            floating = floating or bool(_FLOAT[segment].any())
+
+            text = segment.copy()
+            text[opening[:end] | closing[:end]] = _SPACE
+            text = text.tobytes()
+            if text.strip():
+                try:
+                    numbers = np.array(text.split(b","), dtype=float)
+                except ValueError:
+                    raise ValueError("Only numbers are supported in arrays") from None
+            elif opens or (len(closed) and not values.size and not rows):
+                numbers = np.empty(0)
+            else:
+                # Only an empty array may have no numbers, a chunk cut after a comma
+                # starts the next segment right before a missing entry
+                raise ValueError("Only numbers are supported in arrays")
+
+            if opens:
+                if len(numbers) % opens or width not in (None, len(numbers)//opens):
+                    raise ValueError("Rows of an array must have equal length")
+                width = len(numbers)//opens
+                rows += opens
+            values.extend(numbers)
+
+            self.pos += end+1
+            if len(closed):
+                break
+
+        array = values.array()
+        if rows:
+            array = array.reshape(rows, width)
+        if not floating and array.size:
+            array = array.astype(np.int64)
+        return array
+
+    def document(self):
+        """Top level object as a dict, arrays as numpy arrays"""
+        self.expect(b"{")
+        data = {}
+        if self.peek() == b"}":
+            self.pos += 1
+            return data
+        while True:
+            key = self.scalar()
+            self.expect(b":")
+            if self.peek() == b"[":
+                data[key] = self.array()
+            else:
+                data[key] = self.scalar()
+            char = self.peek()
+            self.pos += 1
+            if char == b"}":
+                return data
+            if char != b",":
+                raise ValueError(f"Expected , or }} in {self.file.name}")
+
+
+def stream_load(path, chunk_size=CHUNK):
+    """json.load() of a model file with the arrays parsed incrementally into numpy"""
+    with open(path, "rb") as file:
+        return JSONStream(file, chunk_size).document()
@@ -1,20 +1,44 @@
 import json
 import numpy as np
+from data_exchange.container import is_container, read_container
+from data_exchange.cache import cache_key, load_cached, store_cached
+from data_exchange.json_stream import stream_load
 
 
 class ModelImport(object):
-    def __init__(self, path):
+    def __init__(self, path, mmap=True, stream=False, cache=True):
+        """
+        :param str path: model file, JSON or HerMES binary (recognized by its content)
+        :param bool mmap: arrays of a binary model or cache are memory-mapped instead of read
+        :param bool stream: parse the arrays of a JSON model incrementally into numpy
+            buffers instead of decoding the whole document, for very large files
+        :param bool cache: read a JSON model from its cache of parsed arrays in the
+            per-user cache folder while the file is unchanged, and write the cache
+            after parsing
+        """
         self.path = path
-        json_file = open(self.path)
-        json_data = json.load(json_file)
-        json_file.close()
+        if is_container(self.path):
+            json_data, arrays = read_container(self.path, mmap)
+            json_data.update(arrays)
+        else:
+            json_data = load_cached(self.path, mmap) if cache else None
+            if json_data is None:
+                key = cache_key(self.path) if cache else None
+                if stream:
+                    json_data = stream_load(self.path)
+                else:
+                    json_file = open(self.path)
+                    json_data = json.load(json_file)
+                    json_file.close()
+                if cache:
+                    store_cached(self.path, key, json_data)
 
         self.example = json_data["example"]
         self.structure_type = json_data["structure_type"]
 
-        self.E = json_data["E"]
-        self.A = json_data["A"]
-        self.ep = np.array([self.E, self.A])
+        self.E = np.asarray(json_data["E"])
+        self.A = np.asarray(json_data["A"])
+        self.ep = np.vstack([self.E, self.A])
 
         if self.example == "von Mises Truss":
             self.L = json_data["L"]
@@ -23,18 +47,58 @@ class ModelImport(object):
             self.sb0 = json_data["sb0"]
             self.P = json_data["P"]
 
-        self.coords = np.array(json_data["coords"])
-        self.elems = np.array(json_data["elems"])
-        self.supports = np.array(json_data["supports"])
+        self.coords = np.asarray(json_data["coords"])
+        self.elems = np.asarray(json_data["elems"])
+        self.supports = np.asarray(json_data["supports"])
 
         try:
-            self.forces = np.array(json_data["forces"])
+            self.forces = np.asarray(json_data["forces"])
         except:
             print('')
 
         try:
-            self.displacements = np.array(json_data["displacements"])
+            self.displacements = np.asarray(json_data["displacements"])
         except:
             print('')
 
 
+class StepResultsImport(object):
+    """
+    Reader of the step history written by StepResultsWriter. A cut last line
+    of an interrupted run is skipped, complete is False when finish() was not reached.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = None
+        self.steps_num = 0
+        self.complete = False
+        self.converged = None
+
+        for record in self.records():
+            if record["record"] == "header":
+                self.header = record
+            elif record["record"] == "step":
+                self.steps_num += 1
+            elif record["record"] == "finish":
+                self.complete = True
+                self.converged = record["converged"]
+
+        self.example = self.header["example"]
+        self.structure_type = self.header["structure_type"]
+
+    def records(self):
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    return
+
+    def steps(self):
+        """Step records one at a time with the results as arrays"""
+        for record in self.records():
+            if record["record"] == "step":
+                for key in ("nodal_q", "nodal_R", "element_Ne"):
+                    record[key] = np.array(record[key])
+                yield record
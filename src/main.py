@@ -3,18 +3,71 @@ import sys
 import os
 
 from structure.build_model import Truss2D, Truss3D
-from structure.solver import LinearSolver2D, LinearSolver3D, NonlinearForceSolver2D, NonlinearForceSolver3D, NonlinearDisSolver2D, NonlinearDisSolver3D
+from structure.plotter import EquilibriumPathPlot
+from structure.solver import LinearSolver2D, LinearSolver3D, NonlinearForceSolver2D, NonlinearForceSolver3D, NonlinearDisSolver2D, NonlinearDisSolver3D, SPARSE_DOFS
 from data_exchange.export import ModelExport, ResultsExport
 from data_exchange.model_import import ModelImport
 
 from PySide2.QtWidgets import QApplication
 from PySide2.QtQml import QQmlApplicationEngine
-from PySide2.QtCore import QObject, Slot, Signal, QFileInfo
+from PySide2.QtCore import QObject, QThread, Slot, Signal, QFileInfo
+
+
+class SolverWorker(QObject):
+    """
+    Runs one analysis on a worker thread. It observes the solver and forwards
+    its events as signals, connected slots of the Backend run in the GUI thread.
+    """
+
+    analysisStarted = Signal()
+    pathPoint = Signal(float, float)
+    iterationDone = Signal(int, int, float, float)
+    stepDone = Signal(int, int, bool, str)
+    stepCut = Signal(int)
+    finished = Signal(object)
+    failed = Signal(str)
+
+    def __init__(self, job):
+        """
+        :param job: callable taking the list of solver observers and returning the solved model
+        """
+        super().__init__()
+        self.job = job
+
+    @Slot(None)
+    def run(self):
+        try:
+            solve = self.job([self])
+        except Exception as error:
+            self.failed.emit(f"{type(error).__name__}: {error}")
+            return
+        self.finished.emit(solve)
+
+    # Solver events
+    def start(self, solver):
+        self.analysisStarted.emit()
+
+    def path(self, solver, x, y):
+        self.pathPoint.emit(x, y)
+
+    def iteration(self, solver, step, itr, res_norm, dq_norm):
+        self.iterationDone.emit(step, itr, float(res_norm), float(dq_norm))
+
+    def step(self, solver, step, itr, converged):
+        partial = f"Step {step}\niter [{itr}]\n"
+        if hasattr(solver, 'load_factor'):
+            partial += f"Load factor: {solver.load_factor}\n"
+        partial += f"Displacements\n{solver.q}"
+        self.stepDone.emit(step, itr, bool(converged), partial)
+
+    def cutback(self, solver, step):
+        self.stepCut.emit(step)
 
 
 class Backend(QObject):
     def __init__(self):
         super().__init__()
+        self.solverThread = None
 
     # Signals
     readPath = Signal(str)
@@ -25,6 +78,9 @@ class Backend(QObject):
     isDataLoaded = Signal(str)
     isModelBuilt = Signal(str)
     isResultsReady = Signal(str)
+    readProgress = Signal(str)
+    readPartialResults = Signal(str)
+    solveProgress = Signal(int, int, float, float)
 
     # Import File
     @Slot(str)
@@ -103,6 +159,13 @@ class Backend(QObject):
         self.geomExport = ModelExport(self.data, self.path)
         self.geomExport.to3D()
 
+    # JSON -> binary model
+    @Slot(str)
+    def exportToBinary(self, filePath):
+        self.path = filePath[8:]
+        self.geomExport = ModelExport(self.data, self.path)
+        self.geomExport.toBinary()
+
     @Slot(str)
     def resultsExport(self, filePath):
         self.path = filePath[8:]
@@ -110,13 +173,17 @@ class Backend(QObject):
 
     @Slot(None)
     def buildModel(self):
+        # Example solvers track fixed dofs, only general models are renumbered
+        reorder = self.data.example == None or self.data.example == "Space Truss"
         if self.data.structure_type == "2D":
             self.truss = Truss2D(self.data)
-            self.truss.build_model()
+            self.truss.build_model(reorder)
 
         elif self.data.structure_type == "3D":
             self.truss = Truss3D(self.data)
-            self.truss.build_model()
+            self.truss.build_model(reorder)
+
+        self.backend = "sparse" if self.truss.max_edof > SPARSE_DOFS else "dense"
 
         info = f"Number of nodes: {self.truss.n_num}\n\nNumber of elements: {self.truss.e_num}\n\nTotal degrees of freedom: {self.truss.max_edof}\n\nYoung module in elements [N/m^2]:\n{self.truss.show_E}\n\nSection area in elements [m^2]:\n{self.truss.show_A}\n\nDegrees of freedom in elements:\n{self.truss.elem_edof}\n\nSupports: \n{self.truss.blocked_dir}\n\n"
 
@@ -135,104 +202,204 @@ class Backend(QObject):
         self.truss.print_model()
 
     # Solvers
+    # Analyses run on a worker thread, results are reported when the job finishes.
+    # The thread is kept until its finished signal, it must not be destroyed while running
+    def startJob(self, job, report, chart=None):
+        if self.solverThread is not None:
+            self.readProgress.emit("Solver is already running")
+            return
+
+        self.report = report
+        self.chart = chart
+        self.solverThread = QThread()
+        self.solverWorker = SolverWorker(job)
+        self.solverWorker.moveToThread(self.solverThread)
+
+        self.solverThread.started.connect(self.solverWorker.run)
+        self.solverWorker.analysisStarted.connect(self.onAnalysisStarted)
+        self.solverWorker.pathPoint.connect(self.onPathPoint)
+        self.solverWorker.iterationDone.connect(self.onIterationDone)
+        self.solverWorker.stepDone.connect(self.onStepDone)
+        self.solverWorker.stepCut.connect(self.onStepCut)
+        self.solverWorker.finished.connect(self.onJobFinished)
+        self.solverWorker.failed.connect(self.onJobFailed)
+        self.solverWorker.finished.connect(self.solverThread.quit)
+        self.solverWorker.failed.connect(self.solverThread.quit)
+        self.solverThread.finished.connect(self.solverWorker.deleteLater)
+        self.solverThread.finished.connect(self.solverThread.deleteLater)
+        self.solverThread.finished.connect(self.onThreadFinished)
+
+        self.readProgress.emit("Solving...")
+        self.solverThread.start()
+
+    @Slot(None)
+    def onAnalysisStarted(self):
+        if self.chart is not None:
+            self.chart.start(None)
+
+    @Slot(float, float)
+    def onPathPoint(self, x, y):
+        if self.chart is not None:
+            self.chart.path(None, x, y)
+
+    @Slot(int, int, float, float)
+    def onIterationDone(self, step, itr, res_norm, dq_norm):
+        self.solveProgress.emit(step, itr, res_norm, dq_norm)
+        self.readProgress.emit(
+            f"Step {step}, iteration {itr}, residual {res_norm:.3e}")
+
+    @Slot(int, int, bool, str)
+    def onStepDone(self, step, itr, converged, partial):
+        if self.chart is not None:
+            self.chart.step(None, step, itr, converged)
+        self.readPartialResults.emit(partial)
+
+    @Slot(int)
+    def onStepCut(self, step):
+        if self.chart is not None:
+            self.chart.cutback(None, step)
+        self.readProgress.emit(f"Step {step} did not converge, step reduced")
+
+    @Slot(object)
+    def onJobFinished(self, solve):
+        self.solve = solve
+        self.report()
+        if self.chart is not None:
+            self.chart.finish(solve)
+
+    @Slot(str)
+    def onJobFailed(self, error):
+        self.readProgress.emit("Solver failed")
+        self.readResults.emit(f"Analysis failed:\n{error}")
+
+    @Slot(None)
+    def onThreadFinished(self):
+        self.solverThread = None
+        self.solverWorker = None
+
     @Slot(None)
     def solveModelLinear(self):
-        if self.data.structure_type == "2D" and self.data.example == None:
-            self.solve = LinearSolver2D(self.truss.edof, self.truss.max_edof,
-                                        self.truss.ex, self.truss.ey, self.data.ep, self.truss.e_num, self.truss.supports, self.truss.forces)
+        # The worker reads the model while the GUI stays live, so a model
+        # imported or built during the solve must not reach the running job
+        truss, data, backend = self.truss, self.data, self.backend
 
-        elif self.data.structure_type == "3D" and self.data.example == None or self.data.example == "Space Truss":
-            self.solve = LinearSolver3D(self.truss.edof, self.truss.max_edof,
-                                        self.truss.ex, self.truss.ey, self.truss.ez, self.data.ep, self.truss.e_num, self.truss.supports, self.truss.forces)
+        def job(observers):
+            if data.structure_type == "2D" and data.example == None:
+                return LinearSolver2D(truss.edof, truss.max_edof,
+                                      truss.ex, truss.ey, data.ep, truss.e_num, truss.supports, truss.forces, plan=truss.partition, geometry=truss.geometry, backend=backend)
 
-        elif self.data.example == "von Mises Truss":
-            from structure.examples_solver import LinearVonMises
-            self.solve = LinearVonMises(self.truss.edof, self.truss.max_edof,
-                                        self.truss.ex, self.truss.ey, self.data.ep, self.truss.e_num, self.truss.supports, self.truss.forces, self.data.H)
+            elif data.structure_type == "3D" and data.example == None or data.example == "Space Truss":
+                return LinearSolver3D(truss.edof, truss.max_edof,
+                                      truss.ex, truss.ey, truss.ez, data.ep, truss.e_num, truss.supports, truss.forces, plan=truss.partition, geometry=truss.geometry, backend=backend)
 
-        elif self.data.example == "Dome":
-            from structure.examples_solver import LinearDome
-            self.solve = LinearDome(self.truss.edof, self.truss.max_edof,
-                                    self.truss.ex, self.truss.ey, self.truss.ez, self.data.ep, self.truss.e_num, self.truss.supports, self.truss.forces)
+            elif data.example == "von Mises Truss":
+                from structure.examples_solver import LinearVonMises
+                return LinearVonMises(truss.edof, truss.max_edof,
+                                      truss.ex, truss.ey, data.ep, truss.e_num, truss.supports, truss.forces, data.H)
 
-        if self.data.example == None or self.data.example == "Space Truss":
-            self.readResults.emit(f"Displacements:\n{self.solve.show_q}")
+            elif data.example == "Dome":
+                from structure.examples_solver import LinearDome
+                return LinearDome(truss.edof, truss.max_edof,
+                                  truss.ex, truss.ey, truss.ez, data.ep, truss.e_num, truss.supports, truss.forces)
 
-        elif self.data.example == "von Mises Truss":
-            self.readResults.emit(
-                f"Displacements:\n{self.solve.q}\nEta:\n{self.solve.eta}")
+        def report():
+            if data.example == None or data.example == "Space Truss":
+                truss.original_numbering(self.solve)
+                self.readResults.emit(f"Displacements:\n{self.solve.show_q}")
 
-        elif self.data.example == "Dome":
-            self.readResults.emit(
-                f"Displacements:\n{self.solve.q}")
+            elif data.example == "von Mises Truss":
+                self.readResults.emit(
+                    f"Displacements:\n{self.solve.q}\nEta:\n{self.solve.eta}")
 
-        self.isResultsReady.emit("Linear results ready")
+            elif data.example == "Dome":
+                self.readResults.emit(
+                    f"Displacements:\n{self.solve.q}")
+
+            self.isResultsReady.emit("Linear results ready")
+
+        self.startJob(job, report)
 
     @Slot(int, int, str, str, str)
     def solveModelForceNonlinear(self, incermentsNum, maxIter, resNorm, disNorm, dofTrack):
-        if self.data.structure_type == "2D" and self.data.example == None:
-            self.solve = NonlinearForceSolver2D(self.truss.edof, self.truss.max_edof,
-                                                self.truss.ex, self.truss.ey, self.data.ep, self.truss.e_num, self.truss.supports, self.truss.forces, incermentsNum, maxIter, float(resNorm), float(disNorm), int(dofTrack)-1)
+        truss, data, backend = self.truss, self.data, self.backend
+
+        def job(observers):
+            if data.structure_type == "2D" and data.example == None:
+                return NonlinearForceSolver2D(truss.edof, truss.max_edof,
+                                              truss.ex, truss.ey, data.ep, truss.e_num, truss.supports, truss.forces, incermentsNum, maxIter, float(resNorm), float(disNorm), truss.dof_index(int(dofTrack)-1), plan=truss.partition, geometry=truss.geometry, backend=backend, observers=observers)
 
-        elif self.data.structure_type == "3D" and self.data.example == None or self.data.example == "Space Truss":
-            self.solve = NonlinearForceSolver3D(self.truss.edof, self.truss.max_edof,
-                                                self.truss.ex, self.truss.ey, self.truss.ez, self.data.ep, self.truss.e_num, self.truss.supports, self.truss.forces, incermentsNum, maxIter, float(resNorm), float(disNorm), int(dofTrack)-1)
+            elif data.structure_type == "3D" and data.example == None or data.example == "Space Truss":
+                return NonlinearForceSolver3D(truss.edof, truss.max_edof,
+                                              truss.ex, truss.ey, truss.ez, data.ep, truss.e_num, truss.supports, truss.forces, incermentsNum, maxIter, float(resNorm), float(disNorm), truss.dof_index(int(dofTrack)-1), plan=truss.partition, geometry=truss.geometry, backend=backend, observers=observers)
 
-        elif self.data.example == "von Mises Truss":
-            from structure.examples_solver import NonlinearForceVonMises
-            self.solve = NonlinearForceVonMises(self.truss.edof, self.truss.max_edof,
-                                                self.truss.ex, self.truss.ey, self.data.ep, self.truss.e_num, self.truss.supports, self.truss.forces, self.data.H)
+            elif data.example == "von Mises Truss":
+                from structure.examples_solver import NonlinearForceVonMises
+                return NonlinearForceVonMises(truss.edof, truss.max_edof,
+                                              truss.ex, truss.ey, data.ep, truss.e_num, truss.supports, truss.forces, data.H, observers=observers)
 
-        elif self.data.example == "Dome":
-            from structure.examples_solver import NonlinearForceDome
-            self.solve = NonlinearForceDome(self.truss.edof, self.truss.max_edof,
-                                            self.truss.ex, self.truss.ey, self.truss.ez, self.data.ep, self.truss.e_num, self.truss.supports, self.truss.forces)
+            elif data.example == "Dome":
+                from structure.examples_solver import NonlinearForceDome
+                return NonlinearForceDome(truss.edof, truss.max_edof,
+                                          truss.ex, truss.ey, truss.ez, data.ep, truss.e_num, truss.supports, truss.forces, observers=observers)
 
-        if self.data.example == None or self.data.example == "Space Truss":
-            self.readResults.emit(f"Displacements:\n{self.solve.show_q}")
+        def report():
+            if data.example == None or data.example == "Space Truss":
+                truss.original_numbering(self.solve)
+                self.readResults.emit(f"Displacements:\n{self.solve.show_q}")
 
-        elif self.data.example == "von Mises Truss":
-            self.readResults.emit(
-                f"Step {self.solve.m}\nForce increment[{self.solve.deltaQ[self.solve.m]}]\nDisplacements\n{self.solve.q}\neta {self.solve.eta} \niter [{self.solve.itr}]")
+            elif data.example == "von Mises Truss":
+                self.readResults.emit(
+                    f"Step {self.solve.m}\nForce increment[{self.solve.deltaQ[self.solve.m]}]\nDisplacements\n{self.solve.q}\neta {self.solve.eta} \niter [{self.solve.itr}]")
 
-        elif self.data.example == "Dome":
-            self.readResults.emit(
-                f"Step {self.solve.m}\nForce increment[{self.solve.deltaQ[self.solve.m]}]\nDisplacements\n{self.solve.q}\niter [{self.solve.itr}]")
+            elif data.example == "Dome":
+                self.readResults.emit(
+                    f"Step {self.solve.m}\nForce increment[{self.solve.deltaQ[self.solve.m]}]\nDisplacements\n{self.solve.q}\niter [{self.solve.itr}]")
 
-        self.isResultsReady.emit("Nonlinear results ready")
+            self.isResultsReady.emit("Nonlinear results ready")
+
+        self.startJob(job, report, EquilibriumPathPlot(pause=None))
 
     @Slot(str, str, int, str, str, str)
     def solveModelDisNonlinear(self, incermentsValue, maxIter, resNorm, disNorm, dofTrack, dofControl):
-        if self.data.structure_type == "2D" and self.data.example == None:
-            self.solve = NonlinearDisSolver2D(self.truss.edof, self.truss.max_edof,
-                                              self.truss.ex, self.truss.ey, self.data.ep, self.truss.e_num, self.truss.supports, self.truss.forces, float(incermentsValue), maxIter, float(resNorm), float(disNorm), int(dofTrack)-1, int(dofControl)-1)
+        truss, data, backend = self.truss, self.data, self.backend
+
+        def job(observers):
+            if data.structure_type == "2D" and data.example == None:
+                # The control dof is prescribed on top of the supports, so the
+                # support partition does not apply and the full plan is assembled
+                return NonlinearDisSolver2D(truss.edof, truss.max_edof,
+                                            truss.ex, truss.ey, data.ep, truss.e_num, truss.supports, truss.forces, float(incermentsValue), maxIter, float(resNorm), float(disNorm), truss.dof_index(int(dofTrack)-1), truss.dof_index(int(dofControl)-1), plan=truss.plan, geometry=truss.geometry, backend=backend, observers=observers)
+
+            elif data.structure_type == "3D" and data.example == None or data.example == "Space Truss":
+                return NonlinearDisSolver3D(truss.edof, truss.max_edof,
+                                            truss.ex, truss.ey, truss.ez, data.ep, truss.e_num, truss.supports, truss.forces, float(incermentsValue), maxIter, float(resNorm), float(disNorm), truss.dof_index(int(dofTrack)-1), truss.dof_index(int(dofControl)-1))
 
-        elif self.data.structure_type == "3D" and self.data.example == None or self.data.example == "Space Truss":
-            self.solve = NonlinearDisSolver3D(self.truss.edof, self.truss.max_edof,
-                                              self.truss.ex, self.truss.ey, self.truss.ez, self.data.ep, self.truss.e_num, self.truss.supports, self.truss.forces, float(incermentsValue), maxIter, float(resNorm), float(disNorm), int(dofTrack)-1, int(dofControl)-1)
+            elif data.example == "von Mises Truss":
+                from structure.examples_solver import NonlinearDisVonMises
+                return NonlinearDisVonMises(truss.edof, truss.max_edof,
+                                            truss.ex, truss.ey, data.ep, truss.e_num, truss.supports, truss.forces, data.H, observers=observers)
 
-        elif self.data.example == "von Mises Truss":
-            from structure.examples_solver import NonlinearDisVonMises
-            self.solve = NonlinearDisVonMises(self.truss.edof, self.truss.max_edof,
-                                              self.truss.ex, self.truss.ey, self.data.ep, self.truss.e_num, self.truss.supports, self.truss.forces, self.data.H)
+            elif data.example == "Dome":
+                from structure.examples_solver import NonlinearDisDome
+                return NonlinearDisDome(truss.edof, truss.max_edof,
+                                        truss.ex, truss.ey, truss.ez, data.ep, truss.e_num, truss.supports, truss.forces, observers=observers)
 
-        elif self.data.example == "Dome":
-            from structure.examples_solver import NonlinearDisDome
-            self.solve = NonlinearDisDome(self.truss.edof, self.truss.max_edof,
-                                          self.truss.ex, self.truss.ey, self.truss.ez, self.data.ep, self.truss.e_num, self.truss.supports, self.truss.forces)
+        def report():
+            if data.example == None or data.example == "Space Truss":
+                truss.original_numbering(self.solve)
+                self.readResults.emit(f"Displacements:\n{self.solve.show_q}")
 
-        if self.data.example == None or self.data.example == "Space Truss":
-            self.readResults.emit(f"Displacements:\n{self.solve.show_q}")
+            elif data.example == "von Mises Truss":
+                self.readResults.emit(
+                    f"Step {self.solve.m}\nDisplacements\n{self.solve.q}\neta {self.solve.eta} \niter [{self.solve.itr}]")
 
-        elif self.data.example == "von Mises Truss":
-            self.readResults.emit(
-                f"Step {self.solve.m}\nDisplacements\n{self.solve.q}\neta {self.solve.eta} \niter [{self.solve.itr}]")
+            elif data.example == "Dome":
+                self.readResults.emit(
+                    f"Step {self.solve.m}\nDisplacements\n{self.solve.q}\niter [{self.solve.itr}]")
 
-        elif self.data.example == "Dome":
-            self.readResults.emit(
-                f"Step {self.solve.m}\nDisplacements\n{self.solve.q}\niter [{self.solve.itr}]")
+            self.isResultsReady.emit("Nonlinear results ready")
 
-        self.isResultsReady.emit("Nonlinear results ready")
+        self.startJob(job, report, EquilibriumPathPlot(pause=None))
 
 
 if __name__ == "__main__":
@@ -705,6 +705,11 @@ Window {
             resultsStatus.text = qsTr(resultsReady)
             resultsStatusBox.colorDisabled = "#12a51c"
         }
+
+        function onReadProgress(progress){
+            resultsStatus.text = qsTr(progress)
+            resultsStatusBox.colorDisabled = "#b08a03"
+        }
     }
 }
 
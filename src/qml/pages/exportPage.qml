@@ -34,6 +34,17 @@ Item {
             }
         }
 
+        FileDialog{
+            id: fileExportBinary
+            title: "Save data file"
+            selectMultiple: false
+            nameFilters: ["HerMES binary (*.hmb)"]
+            selectExisting: false
+            onAccepted: {
+                backend.exportToBinary(fileExportBinary.fileUrl)
+            }
+        }
+
         FileDialog{
             id: resultsExport
             title: "Save data file"
@@ -50,7 +61,7 @@ Item {
             id: columnLayout
             x: 0
             width: 250
-            height: 240
+            height: 280
             anchors.top: parent.top
             anchors.topMargin: 40
 
@@ -89,6 +100,19 @@ Item {
                 onClicked: fileExport3D.open()
             }
 
+            CustomButton {
+                id: toBinaryButton
+                colorPressed: "#ce4500"
+                colorMouseOver: "#b46843"
+                colorDefault: "#66707b"
+                text: qsTr("Binary")
+                Layout.preferredHeight: 30
+                Layout.preferredWidth: 100
+                Layout.alignment: Qt.AlignHCenter | Qt.AlignVCenter
+
+                onClicked: fileExportBinary.open()
+            }
+
             Text {
                 id: text2
                 color: "#ffffff"
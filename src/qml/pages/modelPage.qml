@@ -94,7 +94,7 @@ Item {
                             id: fileImport
                             title: "Choose data file"
                             selectMultiple: false
-                            nameFilters: ["JSON (*.json)"]
+                            nameFilters: ["JSON (*.json)", "HerMES binary (*.hmb)"]
                             onAccepted: {
                                 backend.importFile(fileImport.fileUrl)
                             }
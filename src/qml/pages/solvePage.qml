@@ -522,6 +522,10 @@ Item {
         function onReadResults(results){
             resultsField.text = results
         }
+
+        function onReadPartialResults(results){
+            resultsField.text = results
+        }
     }
 }
 
@@ -1,5 +1,64 @@
 import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import reverse_cuthill_mckee
 from structure.plotter import TrussPlot2D, TrussPlot3D
+from structure.truss_classes import AssemblyPlan, DofPartition, ElementGeometry2D, ElementGeometry3D
+
+
+def rcm_node_order(elems, n_num):
+    """
+    Reverse Cuthill-McKee order of the nodes of the element connectivity graph.
+    Return perm, perm[i] is the original index of the node placed at position i.
+    """
+    elems = np.asarray(elems, dtype=int)
+    graph = sparse.csr_matrix((np.ones(len(elems)), (elems[:, 0], elems[:, 1])),
+                              shape=(n_num, n_num))
+    return reverse_cuthill_mckee(graph, symmetric_mode=False)
+
+
+def bandwidth(edof):
+    """Half bandwidth of the stiffness matrix assembled with edof"""
+    return int(np.amax(np.ptp(edof, axis=1)))
+
+
+def original_numbering(solve, dof_order, n_num, dim):
+    """
+    Map displacements and reactions of solve from the reordered dofs back to
+    the original numbering, nodal results and show_q are rebuilt with the same
+    rounding as the solver results.
+    :param solve: solver with q and R [max_edof x n_cases]
+    :param array dof_order: dof_order[i] is the original index of the reordered dof i, None - no reordering
+    :param int n_num: number of nodes
+    :param int dim: degrees of freedom per node
+    """
+    if dof_order is None:
+        return solve
+    for name in ("q", "R"):
+        v = getattr(solve, name)
+        w = np.zeros_like(v)
+        w[dof_order] = v
+        setattr(solve, name, w)
+
+    if solve.q.shape[1] > 1:
+        # Load cases, results per case are not rounded
+        solve.nodal_q = np.asarray(solve.q).T.reshape(-1, n_num, dim)
+        solve.nodal_R = np.asarray(solve.R).T.reshape(-1, n_num, dim)
+        return solve
+
+    solve.nodal_q = np.around(solve.q.reshape(n_num, dim), 5)
+    solve.nodal_R = np.around(solve.R.reshape(n_num, dim), 5)
+
+    if hasattr(solve, "show_q"):
+        dis = []
+        for h in range(0, n_num):
+            dis.append(
+                [f"Node_{h+1}: " + str(solve.nodal_q[h])])
+        solve.show_q = str(np.array(dis).reshape(n_num, 1))
+        solve.show_q = solve.show_q.replace(",", "")
+        solve.show_q = solve.show_q.replace("[", "")
+        solve.show_q = solve.show_q.replace("]", "")
+        solve.show_q = solve.show_q.replace("'", "")
+    return solve
 
 
 class Truss2D:
@@ -26,6 +85,8 @@ class Truss2D:
         self.axis = [(self.min_coords), (self.max_coords),
                      (self.min_coords), (self.max_coords)]
         self.L = None
+        self.dof_order = None
+        self.dof_rank = None
 
     @property
     def n_num(self):
@@ -119,24 +180,66 @@ class Truss2D:
         bc = []
         for i in range(0, self.max_edof):
             if sup[i] == 1:
-                bc.append(i+1)
-        return np.array(bc)
+                bc.append(self.dof_index(i)+1)
+        return np.sort(np.array(bc, dtype=int))
 
     def forces(self):
         """Forces applied to degrees of freedom"""
-        return self.__forces.reshape(self.max_edof, 1)
+        forces = self.__forces.reshape(self.max_edof, 1)
+        if self.dof_order is not None:
+            forces = forces[self.dof_order]
+        return forces
 
     def displacements(self):
         """Displacements applied to degrees of freedom"""
-        return self.__displacements.reshape(self.max_edof, 1)
-
-    def build_model(self):
-        """Function that builds model and show info about it"""
+        displacements = self.__displacements.reshape(self.max_edof, 1)
+        if self.dof_order is not None:
+            displacements = displacements[self.dof_order]
+        return displacements
+
+    def rcm_dof_order(self):
+        """
+        Renumber nodes in reverse Cuthill-McKee order to reduce the bandwidth.
+        Return dof_order, dof_order[i] is the original index of the reordered dof i.
+        """
+        perm = rcm_node_order(self.__elems, self.n_num)
+        return (perm[:, None]*2 + np.arange(2)).ravel()
+
+    def dof_index(self, dof):
+        """Index of the original dof (numbered from 0) in the solved system, negative values pass through"""
+        if self.dof_order is None or dof < 0:
+            return dof
+        return int(self.dof_rank[dof])
+
+    def original_numbering(self, solve):
+        """Map displacements and reactions of solve back to the original dof numbering"""
+        return original_numbering(solve, self.dof_order, self.n_num, 2)
+
+    def build_model(self, reorder=False):
+        """
+        Function that builds model and show info about it
+        :param bool reorder: renumber dofs to reduce the bandwidth, solvers then work
+            in the reordered numbering and original_numbering() maps results back
+        """
         self.edof = self.edof().astype(int)
+        edof = self.edof
+        if reorder:
+            dof_order = self.rcm_dof_order()
+            dof_rank = np.argsort(dof_order)
+            # Keep the original numbering if it is already narrower
+            if bandwidth(dof_rank[edof-1]) < bandwidth(edof):
+                self.dof_order = dof_order
+                self.dof_rank = dof_rank
+                self.edof = dof_rank[edof-1]+1
+            print("Bandwidth: ", bandwidth(edof), "->", bandwidth(self.edof))
         self.ex = self.ex()
         self.ey = self.ey()
         self.max_edof = int(np.amax(self.edof))
+        self.plan = AssemblyPlan(self.edof, self.max_edof)
+        self.geometry = ElementGeometry2D(
+            self.ex, self.ey, np.multiply(self._E, self._A))
         self.supports = self.supports()
+        self.partition = DofPartition(self.edof, self.max_edof, self.supports)
         if self.ext == "Forces":
             self.forces = self.forces()
 
@@ -147,7 +250,7 @@ class Truss2D:
         print("Number of nodes: ", self.n_num)
         print("Number of elements: ", self.e_num)
         print("Total degrees of freedom: \n", self.max_edof)
-        print("Degrees of freedom matrix: \n", self.edof)
+        print("Degrees of freedom matrix: \n", edof)
         print("Supports: \n", self.supports)
         if self.ext == "Forces":
             print("Forces: \n", self.forces)
@@ -159,7 +262,7 @@ class Truss2D:
         elem_edof = []
         for i in range(0, self.e_num):
             elem_edof.append(
-                [f"Element-{i+1}:-", str(self.edof[i]).replace(" ", "-")])
+                [f"Element-{i+1}:-", str(edof[i]).replace(" ", "-")])
         self.elem_edof = str(np.array(elem_edof).reshape(self.e_num, 2))
         self.elem_edof = self.elem_edof.replace(",", "")
         self.elem_edof = self.elem_edof.replace("[", "")
@@ -267,6 +370,8 @@ class Truss3D:
         self.axis = [(self.min_coords), (self.max_coords),
                      (self.min_coords), (self.max_coords)]
         self.L = None
+        self.dof_order = None
+        self.dof_rank = None
 
     @property
     def n_num(self):
@@ -364,25 +469,67 @@ class Truss3D:
         bc = []
         for i in range(0, self.max_edof):
             if sup[i] == 1:
-                bc.append(i+1)
-        return np.array(bc)
+                bc.append(self.dof_index(i)+1)
+        return np.sort(np.array(bc, dtype=int))
 
     def forces(self):
         """Forces applied to degrees of freedom"""
-        return self.__forces.reshape(self.max_edof, 1)
+        forces = self.__forces.reshape(self.max_edof, 1)
+        if self.dof_order is not None:
+            forces = forces[self.dof_order]
+        return forces
 
     def displacements(self):
         """Displacements applied to degrees of freedom"""
-        return self.__displacements.reshape(self.max_edof, 1)
-
-    def build_model(self):
-        """Function that builds model and show info about it"""
+        displacements = self.__displacements.reshape(self.max_edof, 1)
+        if self.dof_order is not None:
+            displacements = displacements[self.dof_order]
+        return displacements
+
+    def rcm_dof_order(self):
+        """
+        Renumber nodes in reverse Cuthill-McKee order to reduce the bandwidth.
+        Return dof_order, dof_order[i] is the original index of the reordered dof i.
+        """
+        perm = rcm_node_order(self.__elems, self.n_num)
+        return (perm[:, None]*3 + np.arange(3)).ravel()
+
+    def dof_index(self, dof):
+        """Index of the original dof (numbered from 0) in the solved system, negative values pass through"""
+        if self.dof_order is None or dof < 0:
+            return dof
+        return int(self.dof_rank[dof])
+
+    def original_numbering(self, solve):
+        """Map displacements and reactions of solve back to the original dof numbering"""
+        return original_numbering(solve, self.dof_order, self.n_num, 3)
+
+    def build_model(self, reorder=False):
+        """
+        Function that builds model and show info about it
+        :param bool reorder: renumber dofs to reduce the bandwidth, solvers then work
+            in the reordered numbering and original_numbering() maps results back
+        """
         self.edof = self.edof().astype(int)
+        edof = self.edof
+        if reorder:
+            dof_order = self.rcm_dof_order()
+            dof_rank = np.argsort(dof_order)
+            # Keep the original numbering if it is already narrower
+            if bandwidth(dof_rank[edof-1]) < bandwidth(edof):
+                self.dof_order = dof_order
+                self.dof_rank = dof_rank
+                self.edof = dof_rank[edof-1]+1
+            print("Bandwidth: ", bandwidth(edof), "->", bandwidth(self.edof))
         self.ex = self.ex()
         self.ey = self.ey()
         self.ez = self.ez()
         self.max_edof = int(np.amax(self.edof))
+        self.plan = AssemblyPlan(self.edof, self.max_edof)
+        self.geometry = ElementGeometry3D(
+            self.ex, self.ey, self.ez, np.multiply(self._E, self._A))
         self.supports = self.supports()
+        self.partition = DofPartition(self.edof, self.max_edof, self.supports)
         if self.ext == "Forces":
             self.forces = self.forces()
 
@@ -392,7 +539,7 @@ class Truss3D:
         print("Number of nodes: ", self.n_num)
         print("Number of elements: ", self.e_num)
         print("Total degrees of freedom: \n", self.max_edof)
-        print("Degrees of freedom matrix: \n", self.edof)
+        print("Degrees of freedom matrix: \n", edof)
         print("Supports: \n", self.supports)
         if self.ext == "Forces":
             print("Forces: \n", self.forces)
@@ -404,7 +551,7 @@ class Truss3D:
         elem_edof = []
         for i in range(0, self.e_num):
             elem_edof.append(
-                [f"Element-{i+1}:-", str(self.edof[i]).replace(" ", "-")])
+                [f"Element-{i+1}:-", str(edof[i]).replace(" ", "-")])
         self.elem_edof = str(np.array(elem_edof).reshape(self.e_num, 2))
         self.elem_edof = self.elem_edof.replace(",", "")
         self.elem_edof = self.elem_edof.replace("[", "")
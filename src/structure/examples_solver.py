@@ -1,7 +1,7 @@
 import numpy as np
 import scipy.interpolate as inter
-import matplotlib.pyplot as plt
-from structure.truss_classes import Stiffness2D, Stiffness3D, Forces2D, Forces3D
+from structure.truss_classes import Stiffness2D, Stiffness3D, Forces2D, Forces3D, InternalState2D, InternalState3D
+from structure.solver import Observable, line_search as energy_line_search
 
 
 def solveq(K, f, bcPrescr, bcVal=None):
@@ -32,25 +32,19 @@ def solveq(K, f, bcPrescr, bcVal=None):
 
 
 def extractElext(edof, a):
+    """
+    Gather element displacements from the global vector a
+    as one array operation.
 
-    ed = None
+    Parameters:
+        edof        dof topology array [e_num x n] or [n]
+        a           global displacement vector [max_edof x 1]
 
-    if edof.ndim == 1:
-        nDofs = len(edof)
-        ed = np.zeros([nDofs])
-        idx = edof-1
-        ed[:] = a[np.ix_(idx)].T
-    else:
-        nElements = edof.shape[0]
-        nDofs = edof.shape[1]
-        ed = np.zeros([nElements, nDofs])
-        i = 0
-        for row in edof:
-            idx = row-1
-            ed[i, :] = a[np.ix_(idx)].T
-            i += 1
+    Output parameters:
+        ed          element displacements [e_num x n] or [n]
+    """
 
-    return ed
+    return np.asarray(a, dtype=float).reshape(-1)[edof-1]
 
 
 class LinearVonMises:
@@ -84,24 +78,16 @@ class LinearVonMises:
         self.nodal_Ne = np.repeat(self.Ne, 2).reshape(e_num, 2)
 
 
-class NonlinearForceVonMises:
-    def __init__(self, edof, max_edof, ex, ey, ep, e_num, supports, forces, H):
+class NonlinearForceVonMises(Observable):
+    def __init__(self, edof, max_edof, ex, ey, ep, e_num, supports, forces, H, line_search=False, observers=None):
+        self.observers = list(observers or [])
         self.Q = np.zeros((max_edof, 1))
         self.deltaQ = [0.1, 0.1, 0.1, 0.08]
         self.sumdQ = 0
 
-        chart_X = [0]
-        chart_Y = [0]
         interp_X = [0]
         interp_Y = [0]
-        eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                           linewidth=0.7, label='Equlibrium path')
-        plt.style.use('seaborn-ticks')
-        plt.title('Equlibrium path')
-        plt.xlabel('Displacements [m]')
-        plt.ylabel('Forces [N]')
-        plt.grid()
-        plt.pause(0.001)
+        self.notify('start')
 
         self.q = np.asmatrix(np.zeros((max_edof, 1)))
         self.Ne = np.zeros((e_num, 1))
@@ -120,54 +106,44 @@ class NonlinearForceVonMises:
             self.q += dq
             qe = extractElext(edof, self.q)
 
-            chart_X.append(abs(float(self.q[3])))
-            chart_Y.append(abs(float(self.Q[3])))
-            eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                               linewidth=0.7, label='Equlibrium path')
-            plt.pause(0.01)
+            self.notify('path', abs(float(self.q[3])), abs(float(self.Q[3])))
 
             while True:
                 self.itr += 1
-                Fc = Forces2D(edof, e_num, ex, ey, ep, qe)
-                self.Ne = Fc.compute_Ne()
-
-                K = Stiffness2D(edof, e_num, ex, ey, ep, qe, self.Ne)
-                KT = K.compute_ke_T()
-                Res = Fc.compute_Res(self.Q, self.R)
+                St = InternalState2D(edof, e_num, ex, ey, ep, qe)
+                self.Ne, F, KT = St.compute()
+                Res = self.Q+self.R-F
 
-                chart_X.append(abs(float(self.q[3])))
-                chart_Y.append(abs(float(self.Q[3])-float(Res[3])))
+                self.notify('path', abs(float(self.q[3])), abs(float(self.Q[3])-float(Res[3])))
                 interp_X.append(abs(float(self.q[3])))
                 interp_Y.append(abs(float(self.Q[3])-float(Res[3])))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.01)
 
                 Res_norm = np.linalg.norm(Res)
 
                 dq, dR = solveq(KT, Res, supports)
+                if line_search:
+                    def residual(s):
+                        qe = extractElext(edof, self.q+s*dq)
+                        return self.Q+self.R+s*dR-InternalState2D(
+                            edof, e_num, ex, ey, ep, qe).compute(tangent=False)[1]
+                    s = energy_line_search(residual, dq, Res)
+                    dq = s*dq
+                    dR = s*dR
                 self.R += dR
                 self.q += dq
                 dq_norm = np.linalg.norm(dq)
                 qe = extractElext(edof, self.q)
                 self.eta = self.q[3]/H
 
-                chart_X.append(abs(float(self.q[3])))
-                chart_Y.append(abs(float(self.Q[3])))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.01)
+                self.notify('path', abs(float(self.q[3])), abs(float(self.Q[3])))
+                self.notify('iteration', self.m+1, self.itr, Res_norm, dq_norm)
 
                 if (Res_norm < 1e-04 and dq_norm < 1e-04) or self.itr == 40:
 
                     interp_X.append(abs(float(self.q[3])))
                     interp_Y.append(abs(float(self.Q[3])))
-
-                    inc_range = plt.plot([0, abs(float(self.q[3]))], [abs(float(self.Q[3])), abs(
-                        float(self.Q[3]))], linestyle='--', color='#000000', label='Force increment range')
-                    inc_range = plt.plot([abs(float(self.q[3])), abs(float(self.q[3]))], [0, abs(
-                        float(self.Q[3]))], linestyle='--', color='#000000', label='Force increment range')
-                    plt.pause(0.01)
+                    self.notify('step', self.m+1, self.itr,
+                                Res_norm < 1e-04 and dq_norm < 1e-04)
 
                     self.q = np.around(self.q, 5)
                     self.eta = np.around(self.eta, 5)
@@ -180,13 +156,7 @@ class NonlinearForceVonMises:
 
         x = np.linspace(0, interp_X[-1])
         f = inter.interp1d(interp_X, interp_Y, kind='cubic')
-        y = f(x)
-        interp = plt.plot(x, y, color='#000000', linewidth=0.7,
-                          label='Equlibrium path interpoaltion')
-        plt.pause(0.01)
-        plt.legend(handles=[eq_path[0], inc_range[0], interp[0]],
-                   loc='lower right')
-        plt.show()
+        self.path_fit = (x, f(x))
 
         self.sigma = np.divide(self.Ne.reshape(
             e_num, 1), ep[1].reshape(e_num, 1))
@@ -197,11 +167,12 @@ class NonlinearForceVonMises:
         self.nodal_R = self.R.reshape(int(max_edof/2), 2)
         self.nodal_q = self.q.reshape(int(max_edof/2), 2)
         self.nodal_Ne = np.repeat(self.Ne, 2).reshape(e_num, 2)
+        self.notify('finish')
 
 
-class NonlinearDisVonMises:
-    def __init__(self, edof, max_edof, ex, ey, ep, e_num, supports, forces, H):
-
+class NonlinearDisVonMises(Observable):
+    def __init__(self, edof, max_edof, ex, ey, ep, e_num, supports, forces, H, line_search=False, observers=None):
+        self.observers = list(observers or [])
         self.Q = np.zeros((max_edof, 1))
         self.q = np.asmatrix(np.zeros((max_edof, 1)))
         self.Ne = np.zeros((e_num, 1))
@@ -218,16 +189,7 @@ class NonlinearDisVonMises:
                 self.bcDis = np.append(self.bcDis, [i+1])
                 self.bcVal = np.append(self.bcVal, [[stepVal]], axis=0)
 
-        chart_X = [0]
-        chart_Y = [0]
-        eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                           linewidth=0.7, label='Equlibrium path')
-        plt.style.use('seaborn-ticks')
-        plt.title('Equlibrium path')
-        plt.xlabel('Displacements [m]')
-        plt.ylabel('Forces [N]')
-        plt.grid()
-        plt.pause(0.01)
+        self.notify('start')
 
         for self.m in range(0, steps):
             self.itr = 0
@@ -239,49 +201,39 @@ class NonlinearDisVonMises:
             self.q += dq
             qe = extractElext(edof, self.q)
 
-            chart_X.append(-float(self.q[3]))
-            chart_Y.append(-float(self.R[3]))
-            eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                               linewidth=0.7, label='Equlibrium path')
-            plt.pause(0.01)
+            self.notify('path', -float(self.q[3]), -float(self.R[3]))
 
             while True:
                 self.itr += 1
-                Fc = Forces2D(edof, e_num, ex, ey, ep, qe)
-                self.Ne = Fc.compute_Ne()
+                St = InternalState2D(edof, e_num, ex, ey, ep, qe)
+                self.Ne, F, KT = St.compute()
+                Res = self.Q+self.R-F
 
-                K = Stiffness2D(edof, e_num, ex, ey, ep, qe, self.Ne)
-                KT = K.compute_ke_T()
-                Res = Fc.compute_Res(self.Q, self.R)
-
-                chart_X.append(-float(self.q[3]))
-                chart_Y.append(-float(self.R[3])-float(Res[3]))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.01)
+                self.notify('path', -float(self.q[3]), -float(self.R[3])-float(Res[3]))
 
                 Res_norm = np.linalg.norm(Res)
 
                 dq, dR = solveq(KT, Res, supports)
+                if line_search:
+                    def residual(s):
+                        qe = extractElext(edof, self.q+s*dq)
+                        return self.Q+self.R+s*dR-InternalState2D(
+                            edof, e_num, ex, ey, ep, qe).compute(tangent=False)[1]
+                    s = energy_line_search(residual, dq, Res)
+                    dq = s*dq
+                    dR = s*dR
                 self.R += dR
                 self.q += dq
                 dq_norm = np.linalg.norm(dq)
                 qe = extractElext(edof, self.q)
                 self.eta = self.q[3]/H
 
-                chart_X.append(-float(self.q[3]))
-                chart_Y.append(-float(self.R[3]))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.01)
+                self.notify('path', -float(self.q[3]), -float(self.R[3]))
+                self.notify('iteration', self.m+1, self.itr, Res_norm, dq_norm)
 
                 if (Res_norm < 1e-04 and dq_norm < 1e-04) or self.itr == 40:
-
-                    inc_range = plt.plot([0, -(float(self.q[3]))], [-(float(self.R[3])), -(
-                        float(self.R[3]))], linestyle='--', color='#000000', label='Force increment range')
-                    inc_range = plt.plot([-(float(self.q[3])), -(float(self.q[3]))], [0, -(
-                        float(self.R[3]))], linestyle='--', color='#000000', label='Force increment range')
-                    plt.pause(0.01)
+                    self.notify('step', self.m+1, self.itr,
+                                Res_norm < 1e-04 and dq_norm < 1e-04)
 
                     self.q = np.around(self.q, 5)
                     self.eta = np.around(self.eta, 5)
@@ -291,11 +243,6 @@ class NonlinearDisVonMises:
                     print('--------------------------------------')
                     break
 
-        plt.pause(0.01)
-        plt.legend(handles=[eq_path[0], inc_range[0]],
-                   loc='lower right')
-        plt.show()
-
         self.sigma = np.divide(self.Ne.reshape(
             e_num, 1), ep[1].reshape(e_num, 1))
         self.R = np.around(self.R, 4)
@@ -305,6 +252,7 @@ class NonlinearDisVonMises:
         self.nodal_R = self.R.reshape(int(max_edof/2), 2)
         self.nodal_q = self.q.reshape(int(max_edof/2), 2)
         self.nodal_Ne = np.repeat(self.Ne, 2).reshape(e_num, 2)
+        self.notify('finish')
 
 
 class LinearDome:
@@ -336,22 +284,14 @@ class LinearDome:
         self.nodal_Ne = np.repeat(self.Ne, 2).reshape(e_num, 2)
 
 
-class NonlinearForceDome:
-    def __init__(self, edof, max_edof, ex, ey, ez, ep, e_num, supports, forces):
+class NonlinearForceDome(Observable):
+    def __init__(self, edof, max_edof, ex, ey, ez, ep, e_num, supports, forces, line_search=False, observers=None):
+        self.observers = list(observers or [])
         self.Q = np.zeros((max_edof, 1))
         self.deltaQ = [0.1, 0.1, 0.1, 0.08]
         self.sumdQ = 0
 
-        chart_X = [0]
-        chart_Y = [0]
-        eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                           linewidth=0.7, label='Equlibrium path')
-        plt.style.use('seaborn-ticks')
-        plt.title('Equlibrium path')
-        plt.xlabel('Displacements [m]')
-        plt.ylabel('Forces [N]')
-        plt.grid()
-        plt.pause(0.01)
+        self.notify('start')
 
         self.q = np.asmatrix(np.zeros((max_edof, 1)))
         self.Ne = np.zeros((e_num, 1))
@@ -370,48 +310,38 @@ class NonlinearForceDome:
             self.q += dq
             qe = extractElext(edof, self.q)
 
-            chart_X.append(abs(float(self.q[2])))
-            chart_Y.append(abs(float(self.Q[2])))
-            eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                               linewidth=0.7, label='Equlibrium path')
-            plt.pause(0.01)
+            self.notify('path', abs(float(self.q[2])), abs(float(self.Q[2])))
 
             while True:
                 self.itr += 1
-                Fc = Forces3D(edof, e_num, ex, ey, ez, ep, qe)
-                self.Ne = Fc.compute_Ne()
+                St = InternalState3D(edof, e_num, ex, ey, ez, ep, qe)
+                self.Ne, F, KT = St.compute()
+                Res = self.Q+self.R-F
 
-                K = Stiffness3D(edof, e_num, ex, ey, ez, ep, qe, self.Ne)
-                KT = K.compute_ke_T()
-                Res = Fc.compute_Res(self.Q, self.R)
-
-                chart_X.append(abs(float(self.q[2])))
-                chart_Y.append(abs(float(self.Q[2])-float(Res[2])))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.01)
+                self.notify('path', abs(float(self.q[2])), abs(float(self.Q[2])-float(Res[2])))
 
                 Res_norm = np.linalg.norm(Res)
 
                 dq, dR = solveq(KT, Res, supports)
+                if line_search:
+                    def residual(s):
+                        qe = extractElext(edof, self.q+s*dq)
+                        return self.Q+self.R+s*dR-InternalState3D(
+                            edof, e_num, ex, ey, ez, ep, qe).compute(tangent=False)[1]
+                    s = energy_line_search(residual, dq, Res)
+                    dq = s*dq
+                    dR = s*dR
                 self.R += dR
                 self.q += dq
                 dq_norm = np.linalg.norm(dq)
                 qe = extractElext(edof, self.q)
 
-                chart_X.append(abs(float(self.q[2])))
-                chart_Y.append(abs(float(self.Q[2])))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.01)
+                self.notify('path', abs(float(self.q[2])), abs(float(self.Q[2])))
+                self.notify('iteration', self.m+1, self.itr, Res_norm, dq_norm)
 
                 if (Res_norm < 1e-04 and dq_norm < 1e-04) or self.itr == 40:
-
-                    inc_range = plt.plot([0, abs(float(self.q[2]))], [abs(float(self.Q[2])), abs(
-                        float(self.Q[2]))], linestyle='--', color='#000000', label='Force increment range')
-                    inc_range = plt.plot([abs(float(self.q[2])), abs(float(self.q[2]))], [0, abs(
-                        float(self.Q[2]))], linestyle='--', color='#000000', label='Force increment range')
-                    plt.pause(0.01)
+                    self.notify('step', self.m+1, self.itr,
+                                Res_norm < 1e-04 and dq_norm < 1e-04)
 
                     self.q = np.around(self.q, 5)
                     self.sumdQ = np.around(self.sumdQ, 3)
@@ -421,11 +351,6 @@ class NonlinearForceDome:
                     print('--------------------------------------')
                     break
 
-        plt.pause(0.01)
-        plt.legend(handles=[eq_path[0], inc_range[0]],
-                   loc='lower right')
-        plt.show()
-
         self.sigma = np.divide(self.Ne.reshape(
             e_num, 1), ep[1].reshape(e_num, 1))
         self.R = np.around(self.R, 4)
@@ -435,11 +360,12 @@ class NonlinearForceDome:
         self.nodal_R = self.R.reshape(int(max_edof/3), 3)
         self.nodal_q = self.q.reshape(int(max_edof/3), 3)
         self.nodal_Ne = np.repeat(self.Ne, 2).reshape(e_num, 2)
+        self.notify('finish')
 
 
-class NonlinearDisDome:
-    def __init__(self, edof, max_edof, ex, ey, ez, ep, e_num, supports, forces):
-
+class NonlinearDisDome(Observable):
+    def __init__(self, edof, max_edof, ex, ey, ez, ep, e_num, supports, forces, line_search=False, observers=None):
+        self.observers = list(observers or [])
         self.Q = np.zeros((max_edof, 1))
         self.q = np.asmatrix(np.zeros((max_edof, 1)))
         self.Ne = np.zeros((e_num, 1))
@@ -456,16 +382,7 @@ class NonlinearDisDome:
                 self.bcDis = np.append(self.bcDis, [i+1])
                 self.bcVal = np.append(self.bcVal, [[stepVal]], axis=0)
 
-        chart_X = [0]
-        chart_Y = [0]
-        eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                           linewidth=0.7, label='Equlibrium path')
-        plt.style.use('seaborn-ticks')
-        plt.title('Equlibrium path')
-        plt.xlabel('Displacements [m]')
-        plt.ylabel('Forces [N]')
-        plt.grid()
-        plt.pause(0.01)
+        self.notify('start')
 
         for self.m in range(0, steps):
             self.itr = 0
@@ -477,48 +394,38 @@ class NonlinearDisDome:
             self.q += dq
             qe = extractElext(edof, self.q)
 
-            chart_X.append(-float(self.q[2]))
-            chart_Y.append(-float(self.R[2]))
-            eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                               linewidth=0.7, label='Equlibrium path')
-            plt.pause(0.01)
+            self.notify('path', -float(self.q[2]), -float(self.R[2]))
 
             while True:
                 self.itr += 1
-                Fc = Forces3D(edof, e_num, ex, ey, ez, ep, qe)
-                self.Ne = Fc.compute_Ne()
-
-                K = Stiffness3D(edof, e_num, ex, ey, ez, ep, qe, self.Ne)
-                KT = K.compute_ke_T()
-                Res = Fc.compute_Res(self.Q, self.R)
+                St = InternalState3D(edof, e_num, ex, ey, ez, ep, qe)
+                self.Ne, F, KT = St.compute()
+                Res = self.Q+self.R-F
 
-                chart_X.append(-float(self.q[2]))
-                chart_Y.append(-float(self.R[2])-float(Res[2]))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.01)
+                self.notify('path', -float(self.q[2]), -float(self.R[2])-float(Res[2]))
 
                 Res_norm = np.linalg.norm(Res)
 
                 dq, dR = solveq(KT, Res, supports)
+                if line_search:
+                    def residual(s):
+                        qe = extractElext(edof, self.q+s*dq)
+                        return self.Q+self.R+s*dR-InternalState3D(
+                            edof, e_num, ex, ey, ez, ep, qe).compute(tangent=False)[1]
+                    s = energy_line_search(residual, dq, Res)
+                    dq = s*dq
+                    dR = s*dR
                 self.R += dR
                 self.q += dq
                 dq_norm = np.linalg.norm(dq)
                 qe = extractElext(edof, self.q)
 
-                chart_X.append(-float(self.q[2]))
-                chart_Y.append(-float(self.R[2]))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.01)
+                self.notify('path', -float(self.q[2]), -float(self.R[2]))
+                self.notify('iteration', self.m+1, self.itr, Res_norm, dq_norm)
 
                 if (Res_norm < 1e-04 and dq_norm < 1e-04) or self.itr == 40:
-
-                    inc_range = plt.plot([0, -(float(self.q[2]))], [-(float(self.R[2])), -(
-                        float(self.R[2]))], linestyle='--', color='#000000', label='Force increment range')
-                    inc_range = plt.plot([-(float(self.q[2])), -(float(self.q[2]))], [0, -(
-                        float(self.R[2]))], linestyle='--', color='#000000', label='Force increment range')
-                    plt.pause(0.01)
+                    self.notify('step', self.m+1, self.itr,
+                                Res_norm < 1e-04 and dq_norm < 1e-04)
 
                     self.q = np.around(self.q, 5)
                     print('--------------------------------------')
@@ -527,11 +434,6 @@ class NonlinearDisDome:
                     print('--------------------------------------')
                     break
 
-        plt.pause(0.01)
-        plt.legend(handles=[eq_path[0], inc_range[0]],
-                   loc='lower right')
-        plt.show()
-
         self.sigma = np.divide(self.Ne.reshape(
             e_num, 1), ep[1].reshape(e_num, 1))
         self.R = np.around(self.R, 4)
@@ -541,3 +443,4 @@ class NonlinearDisDome:
         self.nodal_R = self.R.reshape(int(max_edof/3), 3)
         self.nodal_q = self.q.reshape(int(max_edof/3), 3)
         self.nodal_Ne = np.repeat(self.Ne, 2).reshape(e_num, 2)
+        self.notify('finish')
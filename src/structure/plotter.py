@@ -109,3 +109,86 @@ class TrussPlot3D:
     #         sup_y = self.nodes_y[sup]
     #         sup_z = self.nodes_z[sup]
     #         plt.plot(sup_x, sup_y, sup_z, color='green', marker=6, markersize=11)
+
+
+class EquilibriumPathPlot:
+    """
+    Live equilibrium path chart, an observer of the nonlinear solvers.
+    The path line is updated in place, step() draws the increment range
+    of an accepted step and cutback() drops the points of a rejected one.
+    """
+
+    def __init__(self, ylabel='Forces [N]', increments=True, pause=0.0001):
+        """
+        :param str ylabel: label of the vertical axis
+        :param bool increments: draw the dashed increment range after every step
+        :param float pause: GUI event loop time after every redraw [s], None when the
+            chart is fed from a running Qt event loop, it then only schedules redraws
+            and finish() does not block
+        """
+        self.ylabel = ylabel
+        self.increments = increments
+        self.pause = pause
+
+    def start(self, solver):
+        self.x = [0]
+        self.y = [0]
+        self.step_start = 1
+        self.inc_range = None
+        self.eq_path = plt.plot(self.x, self.y, color='#f07200',
+                                linewidth=0.7, label='Equlibrium path')
+        plt.style.use('seaborn-ticks')
+        plt.title('Equlibrium path')
+        plt.xlabel('Displacements [m]')
+        plt.ylabel(self.ylabel)
+        plt.grid()
+        if self.pause is None:
+            plt.show(block=False)
+        self.redraw()
+
+    def path(self, solver, x, y):
+        self.x.append(x)
+        self.y.append(y)
+        self.draw()
+
+    def step(self, solver, step, itr, converged):
+        self.step_start = len(self.x)
+        if self.increments:
+            x, y = self.x[-1], self.y[-1]
+            self.inc_range = plt.plot([0, x], [y, y], linestyle='--',
+                                      color='#000000', label='Force increment range')
+            plt.plot([x, x], [0, y], linestyle='--',
+                     color='#000000', label='Force increment range')
+            self.redraw()
+
+    def cutback(self, solver, step):
+        del self.x[self.step_start:], self.y[self.step_start:]
+        self.draw()
+
+    def finish(self, solver):
+        """Legend, the fitted path of the example solvers if present, blocking show"""
+        handles = [self.eq_path[0]]
+        if self.inc_range is not None:
+            handles.append(self.inc_range[0])
+        fit = getattr(solver, 'path_fit', None)
+        if fit is not None:
+            interp = plt.plot(fit[0], fit[1], color='#000000', linewidth=0.7,
+                              label='Equlibrium path interpoaltion')
+            handles.append(interp[0])
+        plt.legend(handles=handles, loc='lower right')
+        self.redraw()
+        if self.pause is not None:
+            plt.show()
+
+    def draw(self):
+        line = self.eq_path[0]
+        line.set_data(self.x, self.y)
+        line.axes.relim()
+        line.axes.autoscale_view()
+        self.redraw()
+
+    def redraw(self):
+        if self.pause is None:
+            self.eq_path[0].figure.canvas.draw_idle()
+        else:
+            plt.pause(self.pause)
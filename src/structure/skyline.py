@@ -0,0 +1,118 @@
+import numpy as np
+from scipy import sparse
+
+
+class SkylineMatrix:
+    """
+    Symmetric matrix in skyline (profile) storage. Column j keeps the entries
+    from its first nonzero row down to the diagonal, so only the upper profile
+    is stored. factorize() overwrites it in place with the LDL^T factors.
+    """
+
+    def __init__(self, K):
+        """
+        :param K: symmetric matrix, dense or scipy.sparse, only the upper triangle is read
+        """
+        n = K.shape[0]
+        cols = np.arange(n)
+
+        if sparse.issparse(K):
+            U = sparse.triu(K, format='csc')
+            U.eliminate_zeros()
+            U.sort_indices()
+            filled = np.diff(U.indptr) > 0
+            self.first = cols.copy()
+            self.first[filled] = U.indices[U.indptr[:-1][filled]]
+        else:
+            U = np.triu(np.asarray(K, dtype=float))
+            nonzero = U != 0
+            self.first = np.where(nonzero.any(axis=0), nonzero.argmax(axis=0), cols)
+
+        heights = cols-self.first+1
+        self.n = n
+        self.ptr = np.zeros(n+1, dtype=int)
+        self.ptr[1:] = np.cumsum(heights)
+        self.values = np.zeros(self.ptr[-1])
+        self.D = None
+
+        if sparse.issparse(U):
+            col = np.repeat(cols, np.diff(U.indptr))
+            self.values[self.ptr[col]+U.indices-self.first[col]] = U.data
+        else:
+            col = np.repeat(cols, heights)
+            row = self.first[col]+np.arange(self.ptr[-1])-self.ptr[col]
+            self.values[:] = U[row, col]
+
+    @property
+    def profile(self):
+        """Number of stored entries"""
+        return int(self.ptr[-1])
+
+    def column(self, j):
+        """Stored part of column j, rows first[j]..j, the diagonal is the last entry"""
+        return self.values[self.ptr[j]:self.ptr[j+1]]
+
+    def factorize(self):
+        """
+        In-place LDL^T factorization (active column Crout scheme).
+        Column j then holds the multipliers l_ij above the diagonal and d_j on it.
+        """
+        v = self.values
+        first = self.first
+        ptr = self.ptr
+        D = np.zeros(self.n)
+
+        for j in range(0, self.n):
+            fj = first[j]
+            col = v[ptr[j]:ptr[j+1]]
+
+            # g_ij = k_ij - sum(l_mi*g_mj), rows of column i above i hold l_mi already
+            for i in range(fj+1, j):
+                fi = first[i]
+                m = max(fi, fj)
+                if m < i:
+                    col[i-fj] -= np.dot(v[ptr[i]+m-fi:ptr[i+1]-1], col[m-fj:i-fj])
+
+            g = col[:-1].copy()
+            col[:-1] = g/D[fj:j]
+            col[-1] -= np.dot(g, col[:-1])
+            if col[-1] == 0:
+                raise np.linalg.LinAlgError(f"Zero pivot in row {j+1}")
+            D[j] = col[-1]
+
+        self.D = D
+        return self
+
+    @property
+    def negative_pivots(self):
+        """Number of negative entries of D, equal to the number of negative eigenvalues"""
+        return int(np.sum(self.D < 0))
+
+    @property
+    def det_sign(self):
+        """Sign of the determinant"""
+        return -1 if self.negative_pivots % 2 else 1
+
+    def solve(self, b):
+        """
+        Forward and back substitution with the factors.
+        :param array b: right-hand side [n] or [n x n_cases]
+        """
+        v = self.values
+        first = self.first
+        ptr = self.ptr
+        x = np.array(b, dtype=float)
+
+        for j in range(0, self.n):
+            fj = first[j]
+            if fj < j:
+                x[j] -= v[ptr[j]:ptr[j+1]-1] @ x[fj:j]
+
+        x /= self.D.reshape((-1,) + (1,)*(x.ndim-1))
+
+        for j in range(self.n-1, -1, -1):
+            fj = first[j]
+            if fj < j:
+                x[fj:j] -= np.multiply.outer(v[ptr[j]:ptr[j+1]-1], x[j])
+
+        return x
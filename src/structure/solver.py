@@ -1,69 +1,290 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from structure.truss_classes import Stiffness2D, Stiffness3D, Forces2D, Forces3D
-
-
-def solveq(K, f, bcPrescr, bcVal=None):
-
-    nDofs = K.shape[0]
-    nPdofs = bcPrescr.shape[0]
-
-    if bcVal is None:
-        bcVal = np.zeros([nPdofs], 'd')
-
-    bc = np.ones(nDofs, 'bool')
-    bcDofs = np.arange(nDofs)
-
-    bc[np.ix_(bcPrescr-1)] = False
-    bcDofs = bcDofs[bc]
-
-    fsys = f[bcDofs]-K[np.ix_((bcDofs), (bcPrescr-1))] * \
-        np.asmatrix(bcVal).reshape(nPdofs, 1)
-    asys = np.linalg.solve(K[np.ix_((bcDofs), (bcDofs))], fsys)
-
-    a = np.zeros([nDofs, 1])
-    a[np.ix_(bcPrescr-1)] = np.asmatrix(bcVal).reshape(nPdofs, 1)
-    a[np.ix_(bcDofs)] = asys
-
-    R = K*np.asmatrix(a)-f
+from scipy import sparse
+from scipy.linalg import lu_factor, lu_solve
+from scipy.sparse.linalg import splu, spilu, cg, LinearOperator
+from structure.skyline import SkylineMatrix
+from structure.truss_classes import Stiffness2D, Stiffness3D, Forces2D, Forces3D, InternalState2D, InternalState3D, ElementGeometry2D, ElementGeometry3D, AssemblyPlan, DofPartition, PartitionedMatrix
+
+# Models with more degrees of freedom are solved with the sparse direct backend
+SPARSE_DOFS = 1000
+
+
+class Factorization:
+    """
+    Factorization of the free degrees of freedom block of a stiffness matrix.
+    Built once and reused for any number of right-hand sides.
+    """
+
+    def __init__(self, K, bcPrescr, backend=None, preconditioner='jacobi', tol=1e-10, maxiter=None, atol=0.):
+        """
+        :param K: global stiffness matrix, dense, scipy.sparse or PartitionedMatrix;
+            the blocks of a PartitionedMatrix are used directly when it is
+            partitioned by bcPrescr
+        :param array bcPrescr: prescribed degrees of freedom (numbered from 1)
+        :param str backend: 'dense' - LU of the dense free-dof block,
+            'sparse' - SuperLU factorization of the sparse free-dof block,
+            'pcg' - preconditioned conjugate gradient, no factorization of the block,
+            'skyline' - in-place LDL^T of the free-dof block in skyline storage,
+            None picks the backend from the storage of K
+        :param str preconditioner: 'pcg' preconditioner, 'jacobi' - diagonal,
+            'ic' - incomplete factorization, None - plain conjugate gradient
+        :param float tol: 'pcg' relative residual tolerance
+        :param int maxiter: 'pcg' iteration limit, None - 10 x number of free dofs
+        :param float atol: 'pcg' absolute residual tolerance, the run stops at the larger
+            of tol times the right-hand side norm and atol
+        """
+        if isinstance(K, PartitionedMatrix) and not K.partition.matches(bcPrescr):
+            K = K.tocsr()
+        if backend is None:
+            backend = 'dense' if isinstance(K, np.ndarray) else 'sparse'
+        self.backend = backend
+        self.nDofs = K.shape[0]
+        self.bcPrescr = np.asarray(bcPrescr, dtype=int).reshape(-1)
+        prescr = self.bcPrescr-1
+
+        if isinstance(K, PartitionedMatrix):
+            self.bcDofs = K.partition.free
+            Kff = K.Kff
+            self.Kpf = K.Kpf.copy()
+            self.Kpp = K.Kpp.copy()
+            self.Kfp = self.Kpf.T.tocsr()
+        else:
+            bc = np.ones(self.nDofs, 'bool')
+            bc[prescr] = False
+            self.bcDofs = np.arange(self.nDofs)[bc]
+
+            if sparse.issparse(K):
+                K = sparse.csr_matrix(K)
+                Ksys = K[self.bcDofs, :]
+                self.Kfp = Ksys[:, prescr]
+                Kff = Ksys[:, self.bcDofs]
+                Kp = K[prescr, :]
+                self.Kpf = Kp[:, self.bcDofs]
+                self.Kpp = Kp[:, prescr]
+            else:
+                K = np.asarray(K)
+                self.Kfp = K[np.ix_(self.bcDofs, prescr)]
+                Kff = K[np.ix_(self.bcDofs, self.bcDofs)]
+                self.Kpf = K[np.ix_(prescr, self.bcDofs)]
+                self.Kpp = K[np.ix_(prescr, prescr)]
+
+        if backend == 'sparse':
+            self._lu = splu(sparse.csc_matrix(Kff), permc_spec='MMD_AT_PLUS_A',
+                            diag_pivot_thresh=0.001, options=dict(SymmetricMode=True))
+        elif backend == 'dense':
+            if sparse.issparse(Kff):
+                Kff = Kff.toarray()
+            self._lu = lu_factor(Kff)
+        elif backend == 'skyline':
+            self._lu = SkylineMatrix(Kff).factorize()
+        elif backend == 'pcg':
+            self._Kff = sparse.csr_matrix(Kff, copy=True)
+            self.tol = tol
+            self.atol = atol
+            self.maxiter = maxiter
+            self.iterations = 0
+            if preconditioner == 'jacobi':
+                self._M = sparse.diags(1/self._Kff.diagonal())
+            elif preconditioner == 'ic':
+                # scipy has no incomplete Cholesky, threshold ILU of the SPD block is used instead
+                ilu = spilu(sparse.csc_matrix(self._Kff), drop_tol=1e-5,
+                            fill_factor=10, permc_spec='MMD_AT_PLUS_A',
+                            diag_pivot_thresh=0., options=dict(SymmetricMode=True))
+                self._M = LinearOperator(self._Kff.shape, ilu.solve)
+            elif preconditioner is None:
+                self._M = None
+            else:
+                raise ValueError(f"Unknown preconditioner: {preconditioner}")
+        else:
+            raise ValueError(f"Unknown solver backend: {backend}")
+
+    def solve_free(self, fsys, x0=None):
+        """
+        Solve the free-dof system for right-hand sides fsys [n_free x n_cases],
+        x0 is the 'pcg' starting guess and is ignored by the direct backends
+        """
+        if self.backend in ('sparse', 'skyline'):
+            return self._lu.solve(fsys)
+        if self.backend == 'pcg':
+            return self.solve_pcg(fsys, x0)
+        return lu_solve(self._lu, fsys)
+
+    def solve_pcg(self, fsys, x0=None):
+        """
+        Preconditioned conjugate gradient, one run per right-hand side.
+        Raise RuntimeError when a run does not converge, the nonlinear solvers
+        then treat the step as diverged.
+        """
+        def count(xk):
+            self.iterations += 1
+
+        fsys = np.asarray(fsys, dtype=float)
+        x = np.zeros(fsys.shape)
+        for c in range(0, fsys.shape[1]):
+            start = None if x0 is None else x0[:, c]
+            x[:, c], info = cg(self._Kff, fsys[:, c], x0=start, tol=self.tol,
+                               atol=self.atol, maxiter=self.maxiter, M=self._M, callback=count)
+            if info > 0:
+                raise RuntimeError(f'PCG did not converge in {info} iterations')
+            if info < 0:
+                raise RuntimeError('PCG breakdown')
+        return x
+
+    def solve(self, f, bcVal=None, x0=None):
+        """
+        Solve for a block of load vectors with one batched back-substitution.
+
+        Parameters:
+            f           global load vectors [max_edof x n_cases]
+            bcVal       values of prescribed degrees of freedom
+                        [n_prescribed x 1] or [n_prescribed x n_cases], zeros if None
+            x0          starting guess of the 'pcg' backend [max_edof x n_cases]
+
+        Output parameters:
+            a           global displacement vectors [max_edof x n_cases]
+            R           global reaction force vectors [max_edof x n_cases]
+        """
+        f = np.asarray(f, dtype=float).reshape(self.nDofs, -1)
+        a = np.zeros(f.shape)
+        fsys = f[self.bcDofs]
+
+        if bcVal is not None:
+            bcVal = np.asarray(bcVal, dtype=float).reshape(
+                len(self.bcPrescr), -1)
+            a[self.bcPrescr-1] = bcVal
+            fsys = fsys-self.Kfp @ bcVal
+
+        if x0 is not None:
+            x0 = np.asarray(x0, dtype=float).reshape(self.nDofs, -1)[self.bcDofs]
+        a[self.bcDofs] = self.solve_free(fsys, x0)
+
+        return (np.asmatrix(a), np.asmatrix(self.reactions(a, f)))
+
+    def reactions(self, a, f):
+        """
+        Reaction forces K*a-f, evaluated only at the prescribed dofs,
+        zero at the free dofs.
+        """
+        a = np.asarray(a, dtype=float).reshape(self.nDofs, -1)
+        f = np.asarray(f, dtype=float).reshape(self.nDofs, -1)
+        prescr = self.bcPrescr-1
+        R = np.zeros(f.shape)
+        R[prescr] = self.Kpf @ a[self.bcDofs] + self.Kpp @ a[prescr] - f[prescr]
+        return R
+
+
+def solveq(K, f, bcPrescr, bcVal=None, backend=None, preconditioner='jacobi', tol=1e-10, maxiter=None):
+    """
+    Solve static FE-equations considering boundary conditions.
+
+    Parameters:
+        K           global stiffness matrix, dense or scipy.sparse
+        f           global load vector [max_edof x 1]
+        bcPrescr    prescribed degrees of freedom (numbered from 1)
+        bcVal       values of prescribed degrees of freedom, zeros if None
+        backend     'dense' - LU of the dense free-dof block,
+                    'sparse' - SuperLU factorization of the sparse free-dof block,
+                    'pcg' - preconditioned conjugate gradient,
+                    'skyline' - LDL^T of the free-dof block in skyline storage,
+                    None picks the backend from the storage of K
+        preconditioner, tol, maxiter
+                    'pcg' options, see Factorization
+
+    Output parameters:
+        a           global displacement vector [max_edof x 1]
+        R           global reaction force vector [max_edof x 1]
+    """
+
+    return Factorization(K, bcPrescr, backend, preconditioner, tol, maxiter).solve(f, bcVal)
+
+
+def line_search(residual, dq, Res, maxIter=5, tol=0.5, s_min=0.1):
+    """
+    Energy line search on a Newton correction (Crisfield 1991).
+    The step length s along dq is corrected by regula falsi until the
+    out-of-balance energy dq*r(s) drops below tol times its initial value.
+
+    Parameters:
+        residual    function of s returning the out-of-balance forces at q+s*dq
+        dq          correction [max_edof x 1]
+        Res         out-of-balance forces at q [max_edof x 1]
+        maxIter     maximum number of residual evaluations
+        tol         accepted ratio of the final to the initial energy
+        s_min       smallest step length
+
+    Output parameters:
+        s           step length in the interval [s_min, 1]
+    """
+
+    dq = np.asarray(dq).ravel()
+    g0 = dq @ np.asarray(Res).ravel()
+    if not g0 > 0:
+        return 1.
+
+    # Full step accepted unless it overshoots the energy minimum
+    s_hi = 1.
+    g_hi = dq @ np.asarray(residual(s_hi)).ravel()
+    if g_hi >= -tol*g0:
+        return 1.
+
+    s = s_hi
+    s_lo, g_lo = 0., g0
+    for i in range(1, maxIter):
+        if np.isfinite(g_hi):
+            s = max(s_lo-g_lo*(s_hi-s_lo)/(g_hi-g_lo), s_min)
+        else:
+            s = max(0.5*(s_lo+s_hi), s_min)
+        g = dq @ np.asarray(residual(s)).ravel()
+        if abs(g) <= tol*g0:
+            break
+        if g > 0:
+            s_lo, g_lo = s, g
+        else:
+            s_hi, g_hi = s, g
 
-    return (np.asmatrix(a), R)
+    return s
 
 
 def extractElext(edof, a):
+    """
+    Gather element displacements from the global vector a
+    as one array operation.
 
-    ed = None
+    Parameters:
+        edof        dof topology array [e_num x n] or [n]
+        a           global displacement vector [max_edof x 1]
+                    or vectors of several load cases [max_edof x n_cases]
 
-    if edof.ndim == 1:
-        nDofs = len(edof)
-        ed = np.zeros([nDofs])
-        idx = edof-1
-        ed[:] = a[np.ix_(idx)].T
-    else:
-        nElements = edof.shape[0]
-        nDofs = edof.shape[1]
-        ed = np.zeros([nElements, nDofs])
-        i = 0
-        for row in edof:
-            idx = row-1
-            ed[i, :] = a[np.ix_(idx)].T
-            i += 1
+    Output parameters:
+        ed          element displacements [e_num x n] or [n],
+                    [e_num x n x n_cases] for several load cases
+    """
 
-    return ed
+    a = np.asarray(a, dtype=float)
+    if a.ndim == 2 and a.shape[1] == 1:
+        a = a[:, 0]
+
+    return a[edof-1]
 
 
 class LinearSolver2D:
-    def __init__(self, edof, max_edof, ex, ey, ep, e_num, supports, forces):
+    def __init__(self, edof, max_edof, ex, ey, ep, e_num, supports, forces, plan=None, geometry=None, backend='dense', preconditioner='jacobi', tol=1e-10, maxiter=None):
+        if plan is None:
+            plan = DofPartition(edof, max_edof, supports)
+        if geometry is None:
+            geometry = ElementGeometry2D(ex, ey, ep[0]*ep[1])
+
         self.q = np.asmatrix(np.zeros((max_edof, 1)))
         self.Ne = np.zeros((e_num, 1))
 
         Q = forces
         qe = extractElext(edof, self.q)
-        K = Stiffness2D(edof, e_num, ex, ey, ep, qe, self.Ne)
+        K = Stiffness2D(edof, e_num, ex, ey, ep, qe, self.Ne, plan, geometry)
         K0 = K.compute_ke_0()
-        self.q, self.R = solveq(K0, Q, supports)
+        self.q, self.R = solveq(K0, Q, supports, backend=backend, preconditioner=preconditioner,
+                                tol=tol, maxiter=maxiter)
         qe = extractElext(edof, self.q)
-        Fe = Forces2D(edof, e_num, ex, ey, ep, qe)
+        Fe = Forces2D(edof, e_num, ex, ey, ep, qe, geometry=geometry)
         self.Ne = Fe.compute_Ne_lin()
 
         self.sigma = np.divide(self.Ne.reshape(
@@ -98,17 +319,23 @@ class LinearSolver2D:
 
 
 class LinearSolver3D:
-    def __init__(self, edof, max_edof, ex, ey, ez, ep, e_num, supports, forces):
+    def __init__(self, edof, max_edof, ex, ey, ez, ep, e_num, supports, forces, plan=None, geometry=None, backend='dense', preconditioner='jacobi', tol=1e-10, maxiter=None):
+        if plan is None:
+            plan = DofPartition(edof, max_edof, supports)
+        if geometry is None:
+            geometry = ElementGeometry3D(ex, ey, ez, ep[0]*ep[1])
+
         self.q = np.asmatrix(np.zeros((max_edof, 1)))
         Ne = np.zeros((e_num, 1))
 
         Q = forces
         qe = extractElext(edof, self.q)
-        K = Stiffness3D(edof, e_num, ex, ey, ez, ep, qe, Ne)
+        K = Stiffness3D(edof, e_num, ex, ey, ez, ep, qe, Ne, plan, geometry)
         K0 = K.compute_ke_0()
-        self.q, self.R = solveq(K0, Q, supports)
+        self.q, self.R = solveq(K0, Q, supports, backend=backend, preconditioner=preconditioner,
+                                tol=tol, maxiter=maxiter)
         qe = extractElext(edof, self.q)
-        Fe = Forces3D(edof, e_num, ex, ey, ez, ep, qe)
+        Fe = Forces3D(edof, e_num, ex, ey, ez, ep, qe, geometry=geometry)
         self.Ne = Fe.compute_Ne_lin()
         self.sigma = np.divide(self.Ne.reshape(
             e_num, 1), ep[1].reshape(e_num, 1))
@@ -141,98 +368,322 @@ class LinearSolver3D:
         self.show_q = self.show_q.replace("'", "")
 
 
-class NonlinearForceSolver2D:
-    def __init__(self, edof, max_edof, ex, ey, ep, e_num, supports, forces, incermentsNum, maxIter, resNorm, disNorm, dofTrack):
-        self.Q = np.zeros((max_edof, 1))
-        deltaQ = 1/incermentsNum
+class LoadCasesSolver2D:
+    """Linear analysis of one structure under many load cases with a single factorization"""
 
-        self.q = np.asmatrix(np.zeros((max_edof, 1)))
-        self.Ne = np.zeros((e_num, 1))
-        self.R = np.asmatrix(np.zeros((max_edof, 1)))
+    def __init__(self, edof, max_edof, ex, ey, ep, e_num, supports, forces, plan=None, geometry=None, backend='dense', bcVal=None):
+        """
+        :param array forces: load vectors of all cases [max_edof x n_cases]
+        :param array bcVal: values of the prescribed degrees of freedom
+            [n_prescribed x 1] or [n_prescribed x n_cases], zeros if None
+        """
+        if plan is None:
+            plan = DofPartition(edof, max_edof, supports)
+        if geometry is None:
+            geometry = ElementGeometry2D(ex, ey, ep[0]*ep[1])
 
-        chart_X = [0]
-        chart_Y = [0]
-        eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                           linewidth=0.7, label='Equlibrium path')
-        plt.style.use('seaborn-ticks')
-        plt.title('Equlibrium path')
-        plt.xlabel('Displacements [m]')
-        plt.ylabel('Forces [N]')
-        plt.grid()
-        plt.pause(0.0001)
-
-        for m in range(0, incermentsNum):
-            itr = 0
-            dQ = deltaQ*forces
-            self.Q += dQ
-            qe = extractElext(edof, self.q)
-            K = Stiffness2D(edof, e_num, ex, ey, ep, qe, self.Ne)
-            KT = K.compute_ke_T()
-            dq, dR = solveq(KT, dQ, supports)
-            self.R += dR
-            self.q += dq
-            qe = extractElext(edof, self.q)
+        Q = np.asarray(forces, dtype=float).reshape(max_edof, -1)
+        n_cases = Q.shape[1]
 
-            chart_X.append(abs(float(self.q[dofTrack])))
-            chart_Y.append(abs(float(self.Q[dofTrack])))
-            eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                               linewidth=0.7, label='Equlibrium path')
-            plt.pause(0.0001)
+        K = Stiffness2D(edof, e_num, ex, ey, ep, plan=plan, geometry=geometry)
+        self.factorization = Factorization(K.compute_ke_0(), supports, backend)
+        self.q, self.R = self.factorization.solve(Q, bcVal)
 
-            while True:
-                itr += 1
-                Fc = Forces2D(edof, e_num, ex, ey, ep, qe)
-                self.Ne = Fc.compute_Ne()
+        qe = extractElext(edof, self.q)
+        self.Ne = np.zeros((e_num, n_cases))
+        for c in range(0, n_cases):
+            Fe = Forces2D(edof, e_num, ex, ey, ep, qe[:, :, c], geometry=geometry)
+            self.Ne[:, c] = Fe.compute_Ne_lin().ravel()
 
-                K = Stiffness2D(edof, e_num, ex, ey, ep, qe, self.Ne)
-                KT = K.compute_ke_T()
-                Res = Fc.compute_Res(self.Q, self.R)
+        self.sigma = self.Ne/ep[1].reshape(e_num, 1)
 
-                chart_X.append(abs(float(self.q[dofTrack])))
-                chart_Y.append(
-                    abs(float(self.Q[dofTrack])-float(Res[dofTrack])))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.0001)
+        # Results per load case: [n_cases x n_num x 2]
+        self.nodal_q = np.asarray(self.q).T.reshape(n_cases, int(max_edof/2), 2)
+        self.nodal_R = np.asarray(self.R).T.reshape(n_cases, int(max_edof/2), 2)
+        self.nodal_Ne = np.repeat(self.Ne.T, 2).reshape(n_cases, e_num, 2)
 
-                Res_norm = np.linalg.norm(Res)
 
-                dq, dR = solveq(KT, Res, supports)
-                self.R += dR
-                self.q += dq
-                dq_norm = np.linalg.norm(dq)
-                qe = extractElext(edof, self.q)
+class LoadCasesSolver3D:
+    """Linear analysis of one structure under many load cases with a single factorization"""
 
-                chart_X.append(abs(float(self.q[dofTrack])))
-                chart_Y.append(abs(float(self.Q[dofTrack])))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.0001)
+    def __init__(self, edof, max_edof, ex, ey, ez, ep, e_num, supports, forces, plan=None, geometry=None, backend='dense', bcVal=None):
+        """
+        :param array forces: load vectors of all cases [max_edof x n_cases]
+        :param array bcVal: values of the prescribed degrees of freedom
+            [n_prescribed x 1] or [n_prescribed x n_cases], zeros if None
+        """
+        if plan is None:
+            plan = DofPartition(edof, max_edof, supports)
+        if geometry is None:
+            geometry = ElementGeometry3D(ex, ey, ez, ep[0]*ep[1])
 
-                if (Res_norm < resNorm and dq_norm < disNorm) or itr == maxIter:
+        Q = np.asarray(forces, dtype=float).reshape(max_edof, -1)
+        n_cases = Q.shape[1]
 
-                    inc_range = plt.plot([0, abs(float(self.q[dofTrack]))], [abs(float(self.Q[dofTrack])), abs(
-                        float(self.Q[dofTrack]))], linestyle='--', color='#000000', label='Force increment range')
-                    inc_range = plt.plot([abs(float(self.q[dofTrack])), abs(float(self.q[dofTrack]))], [0, abs(
-                        float(self.Q[dofTrack]))], linestyle='--', color='#000000', label='Force increment range')
-                    plt.pause(0.01)
+        K = Stiffness3D(edof, e_num, ex, ey, ez, ep,
+                        plan=plan, geometry=geometry)
+        self.factorization = Factorization(K.compute_ke_0(), supports, backend)
+        self.q, self.R = self.factorization.solve(Q, bcVal)
 
-                    print('--------------------------------------')
-                    print(
-                        f'Step {m+1} \n\ndisplacements\n {self.q} \n\niter [{itr}]')
-                    print('--------------------------------------')
+        qe = extractElext(edof, self.q)
+        self.Ne = np.zeros((e_num, n_cases))
+        for c in range(0, n_cases):
+            Fe = Forces3D(edof, e_num, ex, ey, ez, ep,
+                          qe[:, :, c], geometry=geometry)
+            self.Ne[:, c] = Fe.compute_Ne_lin().ravel()
+
+        self.sigma = self.Ne/ep[1].reshape(e_num, 1)
+
+        # Results per load case: [n_cases x n_num x 3]
+        self.nodal_q = np.asarray(self.q).T.reshape(n_cases, int(max_edof/3), 3)
+        self.nodal_R = np.asarray(self.R).T.reshape(n_cases, int(max_edof/3), 3)
+        self.nodal_Ne = np.repeat(self.Ne.T, 2).reshape(n_cases, e_num, 2)
+
+
+class BFGSUpdate:
+    """
+    Quasi-Newton iteration on a fixed factorization. The inverse stiffness is
+    corrected with BFGS rank-two updates built from successive residuals
+    (Matthies, Strang 1979), so no new assembly or factorization is needed.
+    """
+
+    def __init__(self, factorization, max_pairs=20):
+        """
+        :param Factorization factorization: tangent factorized at the start of the increment
+        :param int max_pairs: number of stored update pairs
+        """
+        self.factorization = factorization
+        self.max_pairs = max_pairs
+        self.s = []
+        self.y = []
+        self.rho = []
+        self._res = None
+        self._dq = None
+
+    def solve(self, Res):
+        """
+        Compute the correction for residual Res [max_edof x 1].
+        Return (dq, dR) like Factorization.solve, dR is nonzero only at supports.
+        """
+        K = self.factorization
+        free = K.bcDofs
+        Res = np.asarray(Res, dtype=float).reshape(K.nDofs, 1)
+        r = Res[free, 0]
+
+        if self._res is not None:
+            y = self._res-r
+            s = self._dq
+            ys = y @ s
+            if ys > 1e-12*np.linalg.norm(y)*np.linalg.norm(s):
+                self.s.append(s)
+                self.y.append(y)
+                self.rho.append(1/ys)
+                if len(self.s) > self.max_pairs:
+                    del self.s[0], self.y[0], self.rho[0]
+
+        d = r.copy()
+        alpha = []
+        for s, y, rho in zip(reversed(self.s), reversed(self.y), reversed(self.rho)):
+            a = rho*(s @ d)
+            d -= a*y
+            alpha.append(a)
+        d = K.solve_free(d.reshape(-1, 1))[:, 0]
+        for s, y, rho, a in zip(self.s, self.y, self.rho, reversed(alpha)):
+            b = rho*(y @ d)
+            d += (a-b)*s
+
+        self._res = r
+        self._dq = d
+
+        dq = np.zeros((K.nDofs, 1))
+        dq[free, 0] = d
+
+        return (np.asmatrix(dq), np.asmatrix(K.reactions(dq, Res)))
+
+    def scale_step(self, s):
+        """Record that only s times the last correction was applied"""
+        self._dq = s*self._dq
+
+
+class Observable:
+    """
+    Event source of the nonlinear solvers, the numerics never draw or wait.
+    Observers implement any of these methods, missing ones and plain
+    attributes of the same name are skipped:
+        start(solver)
+        path(solver, x, y)                              point of the equilibrium path
+        iteration(solver, step, itr, res_norm, dq_norm) equilibrium iteration done
+        step(solver, step, itr, converged)              step accepted, state in solver.q, R, Ne
+        cutback(solver, step)                           step rejected, last state restored
+        finish(solver)                                  results computed
+    """
+
+    observers = ()
+
+    def notify(self, event, *args):
+        for observer in self.observers:
+            handler = getattr(observer, event, None)
+            if callable(handler):
+                handler(self, *args)
+
+
+class NonlinearForceSolver(Observable):
+    """
+    Newton-Raphson load control shared by the 2D and 3D force solvers.
+    Subclasses provide the element classes through stiffness() and state().
+    """
+
+    dim = 2
+    strategies = ('full', 'modified', 'initial', 'bfgs')
+    predictors = ('tangent', 'secant')
+    # Adaptive load stepping: iterations of a fast step, step growth limit, bisections per step
+    # and per analysis, regrowth of slower steps towards the first step, steps kept at the
+    # reduced size after a cutback, smallest step as a fraction of the first
+    fast_iterations = 4
+    growth = 1.5
+    max_cutbacks = 8
+    max_total_cutbacks = 16
+    recovery = 1.25
+    hold_steps = 3
+    min_step = 1e-2
+    # Absolute 'pcg' tolerance as a fraction of resNorm, the right-hand sides of the last
+    # equilibrium iterations are close to resNorm and a relative tolerance alone fails there
+    pcg_atol = 1e-2
+
+    def factorize(self, K, supports, backend):
+        """Factorize the free-dof block of K and count the factorizations"""
+        self.factorizations += 1
+        return Factorization(K, supports, backend, **self._solver_options)
+
+    def run(self, max_edof, ep, e_num, supports, forces, incermentsNum, maxIter, resNorm, disNorm, dofTrack, strategy, backend, adaptive=False, predictor='tangent'):
+        """
+        :param str strategy: 'full' - full Newton, tangent refactorized in every iteration,
+            'modified' - modified Newton, tangent refactorized at the start of each increment,
+            'initial' - initial stiffness, K0 factorized once for the whole analysis,
+            'bfgs' - tangent factorized at the start of each increment and
+            corrected with BFGS updates in the iterations
+        :param bool adaptive: incermentsNum only sets the first load step, the step grows
+            after steps faster than fast_iterations, recovers towards the first step after
+            slower ones and is bisected and retried from the last converged state when the
+            iterations diverge or reach maxIter. After a cutback the reduced step is kept
+            for hold_steps steps. The analysis stops when the step falls below min_step
+            times the first step, or after max_cutbacks bisections of one step or
+            max_total_cutbacks bisections in total
+        :param str predictor: 'tangent' - solve the tangent system for the load increment,
+            'secant' - extrapolate the increment from the last two accepted states,
+            the tangent is then first assembled at the extrapolated state
+            ('full', 'modified', 'bfgs') or not at all ('initial')
+        Corrections are damped by line_search() when the solver was created
+        with line_search=True.
+        """
+        if strategy not in self.strategies:
+            raise ValueError(f"Unknown iteration strategy: {strategy}")
+        if predictor not in self.predictors:
+            raise ValueError(f"Unknown predictor: {predictor}")
+        self.strategy = strategy
+        self._solver_options = dict(self._solver_options, atol=self.pcg_atol*resNorm)
+        self.iterations = []
+        self.factorizations = 0
+        self.converged = True
+        self.load_factor = 0.
+
+        self.Q = np.zeros((max_edof, 1))
+        deltaQ = 1/incermentsNum
+        first_step = deltaQ
+
+        self.q = np.asmatrix(np.zeros((max_edof, 1)))
+        self.Ne = np.zeros((e_num, 1))
+        self.R = np.asmatrix(np.zeros((max_edof, 1)))
+
+        self._dq_pred = None
+        self._history = [(0., self.q.copy(), self.R.copy())]
+        if strategy == 'initial':
+            self._K0 = self.factorize(self.stiffness().compute_ke_0(),
+                                      supports, backend)
+
+        self.notify('start')
+
+        m = 0
+        cutbacks = 0
+        total_cutbacks = 0
+        hold = 0
+        while self.load_factor < 1:
+            last = adaptive and deltaQ >= 1-self.load_factor-1e-12
+            if last:
+                deltaQ = 1-self.load_factor
+            self.step = m+1
+            state = (self.Q.copy(), self.q.copy(), self.R.copy(), self.Ne.copy(),
+                     self._dq_pred)
+
+            prediction = None
+            if predictor == 'secant' and len(self._history) == 2:
+                prediction = self.extrapolate(deltaQ)
+
+            converged, itr = self.increment(deltaQ*forces, supports, backend,
+                                            maxIter, resNorm, disNorm, dofTrack,
+                                            prediction)
+
+            if not converged and adaptive:
+                self.Q, self.q, self.R, self.Ne, self._dq_pred = state
+                self.notify('cutback', m+1)
+                if cutbacks == self.max_cutbacks or total_cutbacks == self.max_total_cutbacks:
+                    self.converged = False
+                    print(f'Step {m+1} did not converge after {cutbacks} cutbacks '
+                          f'({total_cutbacks} in total), analysis stopped at load factor '
+                          f'{self.load_factor}')
+                    break
+                cutbacks += 1
+                total_cutbacks += 1
+                hold = self.hold_steps
+                deltaQ /= 2
+                if deltaQ < self.min_step*first_step:
+                    self.converged = False
+                    print(f'Step {m+1} did not converge, load step {deltaQ} is below the '
+                          f'minimum, analysis stopped at load factor {self.load_factor}')
                     break
+                print(f'Step {m+1} did not converge, load step reduced to {deltaQ}')
+                continue
 
-        plt.pause(0.0001)
-        plt.legend(handles=[eq_path[0], inc_range[0]],
-                   loc='lower right')
-        plt.show()
+            if not converged:
+                self.converged = False
+                print(f'Step {m+1} did not converge in {maxIter} iterations')
 
+            m += 1
+            cutbacks = 0
+            if not adaptive:
+                self.load_factor = m/incermentsNum
+            else:
+                self.load_factor = 1. if last else self.load_factor+deltaQ
+                if hold:
+                    hold -= 1
+                elif itr < self.fast_iterations:
+                    deltaQ *= min(self.growth, (self.fast_iterations/itr)**0.5)
+                elif deltaQ < first_step:
+                    deltaQ = min(first_step, deltaQ*self.recovery)
+            self._history = self._history[-1:] + \
+                [(self.load_factor, self.q.copy(), self.R.copy())]
+
+            self.iterations.append(itr)
+            self.notify('step', m, itr, converged)
+            print('--------------------------------------')
+            print(
+                f'Step {m} \n\ndisplacements\n {self.q} \n\niter [{itr}]')
+            print('--------------------------------------')
+
+        print(f'Strategy: {strategy}, iterations: {sum(self.iterations)}, '
+              f'factorizations: {self.factorizations}')
+
+        self.results(max_edof, ep, e_num)
+        self.notify('finish')
+
+    def results(self, max_edof, ep, e_num):
+        """Stresses, nodal results and the rounded printout of the final state"""
+        dim = self.dim
         self.sigma = np.divide(self.Ne.reshape(
             e_num, 1), ep[1].reshape(e_num, 1))
 
-        self.nodal_R = self.R.reshape(int(max_edof/2), 2)
-        self.nodal_q = self.q.reshape(int(max_edof/2), 2)
+        self.nodal_R = self.R.reshape(int(max_edof/dim), dim)
+        self.nodal_q = self.q.reshape(int(max_edof/dim), dim)
         self.nodal_Ne = np.repeat(self.Ne, 2).reshape(e_num, 2)
 
         self.q = np.around(self.q, 5)
@@ -243,18 +694,153 @@ class NonlinearForceSolver2D:
         self.sigma = np.around(self.sigma, 5)
 
         dis = []
-        for h in range(0, int(max_edof/2)):
+        for h in range(0, int(max_edof/dim)):
             dis.append(
                 [f"Node_{h+1}: " + str(self.nodal_q[h])])
-        self.show_q = str(np.array(dis).reshape(int(max_edof/2), 1))
+        self.show_q = str(np.array(dis).reshape(int(max_edof/dim), 1))
         self.show_q = self.show_q.replace(",", "")
         self.show_q = self.show_q.replace("[", "")
         self.show_q = self.show_q.replace("]", "")
         self.show_q = self.show_q.replace("'", "")
 
+    def extrapolate(self, deltaQ):
+        """
+        Secant predictor, the last accepted increment of q and R scaled
+        to the load step deltaQ. None when the last step did not advance the load.
+        """
+        (lf0, q0, R0), (lf1, q1, R1) = self._history
+        if lf1 == lf0:
+            return None
+        ratio = deltaQ/(lf1-lf0)
+        return ratio*(q1-q0), ratio*(R1-R0)
+
+    def residual(self, dq, dR, s):
+        """Out-of-balance forces after applying s times the correction dq, dR"""
+        qe = extractElext(self._edof, self.q+s*dq)
+        Ne, F, _ = self.state(qe).compute(tangent=False)
+        return self.Q+self.R+s*dR-F
+
+    def increment(self, dQ, supports, backend, maxIter, resNorm, disNorm, dofTrack, prediction=None):
+        """
+        Apply load increment dQ with a predictor and equilibrium iterations.
+        Return (converged, number of iterations); diverging iterations and
+        singular tangents end the increment as not converged.
+        :param tuple prediction: extrapolated (dq, dR) used instead of the tangent predictor
+        """
+        strategy = self.strategy
+        itr = 0
+        try:
+            self.Q += dQ
+            qe = extractElext(self._edof, self.q)
+            if strategy == 'initial':
+                KT = self._K0
+            elif prediction is None:
+                K = self.stiffness(qe, self.Ne)
+                KT = self.factorize(K.compute_ke_T(), supports, backend)
+            else:
+                KT = None
+            if prediction is None:
+                dq, dR = KT.solve(dQ, x0=self._dq_pred)
+            else:
+                dq, dR = prediction
+            self._dq_pred = dq
+            self.R += dR
+            self.q += dq
+            qe = extractElext(self._edof, self.q)
+            if strategy == 'bfgs' and KT is not None:
+                KT = BFGSUpdate(KT)
+            self.notify('path', abs(float(self.q[dofTrack])), abs(float(self.Q[dofTrack])))
+
+            while True:
+                itr += 1
+                St = self.state(qe)
+                if strategy == 'full' or KT is None:
+                    self.Ne, F, K = St.compute()
+                    KT = self.factorize(K, supports, backend)
+                    if strategy == 'bfgs':
+                        KT = BFGSUpdate(KT)
+                else:
+                    self.Ne, F, _ = St.compute(tangent=False)
+                Res = self.Q+self.R-F
+                self.notify('path', abs(float(self.q[dofTrack])),
+                            abs(float(self.Q[dofTrack])-float(Res[dofTrack])))
 
-class NonlinearDisSolver2D:
-    def __init__(self, edof, max_edof, ex, ey, ep, e_num, supports, forces, incermentsVal, maxIter, resNorm, disNorm, dofTrack, dofControl):
+                Res_norm = np.linalg.norm(Res)
+                if not np.isfinite(Res_norm):
+                    return False, itr
+
+                # No 'pcg' starting guess here, unlike the predictor: the corrections
+                # shrink from one iteration to the next and starting from the last one
+                # takes more CG iterations than starting from zero
+                dq, dR = KT.solve(Res)
+                if self._line_search:
+                    s = line_search(lambda s: self.residual(dq, dR, s), dq, Res)
+                    if s != 1:
+                        dq = s*dq
+                        dR = s*dR
+                        if strategy == 'bfgs':
+                            KT.scale_step(s)
+                self.R += dR
+                self.q += dq
+                dq_norm = np.linalg.norm(dq)
+                qe = extractElext(self._edof, self.q)
+                self.notify('path', abs(float(self.q[dofTrack])), abs(float(self.Q[dofTrack])))
+                self.notify('iteration', self.step, itr, Res_norm, dq_norm)
+
+                if Res_norm < resNorm and dq_norm < disNorm:
+                    return True, itr
+                if itr == maxIter:
+                    return False, itr
+        except (np.linalg.LinAlgError, RuntimeError) as error:
+            print(f'Equilibrium iterations failed: {error}')
+            return False, itr
+
+
+class NonlinearForceSolver2D(NonlinearForceSolver):
+    dim = 2
+
+    def __init__(self, edof, max_edof, ex, ey, ep, e_num, supports, forces, incermentsNum, maxIter, resNorm, disNorm, dofTrack, plan=None, geometry=None, backend='dense', strategy='full', preconditioner='jacobi', tol=1e-10, maxiter=None, adaptive=False, line_search=False, predictor='tangent', observers=None):
+        self.setup(edof, max_edof, ex, ey, ep, e_num, supports, plan, geometry, observers)
+        self._solver_options = dict(
+            preconditioner=preconditioner, tol=tol, maxiter=maxiter)
+        self._line_search = line_search
+
+        self.run(max_edof, ep, e_num, supports, forces, incermentsNum,
+                 maxIter, resNorm, disNorm, dofTrack, strategy, backend, adaptive,
+                 predictor)
+
+    def setup(self, edof, max_edof, ex, ey, ep, e_num, supports, plan, geometry, observers):
+        """Keep the model, its dof partition and element geometry for the element classes"""
+        if plan is None:
+            plan = DofPartition(edof, max_edof, supports)
+        if geometry is None:
+            geometry = ElementGeometry2D(ex, ey, ep[0]*ep[1])
+
+        self._edof = edof
+        self._e_num = e_num
+        self._ex = ex
+        self._ey = ey
+        self._ep = ep
+        self._plan = plan
+        self._geometry = geometry
+        self.observers = list(observers or [])
+
+    def stiffness(self, qe=None, Ne=None):
+        return Stiffness2D(self._edof, self._e_num, self._ex, self._ey, self._ep,
+                           qe, Ne, self._plan, self._geometry)
+
+    def state(self, qe):
+        return InternalState2D(self._edof, self._e_num, self._ex, self._ey, self._ep,
+                               qe, self._plan, self._geometry)
+
+
+class NonlinearDisSolver2D(Observable):
+    def __init__(self, edof, max_edof, ex, ey, ep, e_num, supports, forces, incermentsVal, maxIter, resNorm, disNorm, dofTrack, dofControl, plan=None, geometry=None, backend='dense', observers=None):
+        self.observers = list(observers or [])
+        if plan is None and backend in ('sparse', 'pcg'):
+            plan = AssemblyPlan(edof, max_edof)
+        if geometry is None:
+            geometry = ElementGeometry2D(ex, ey, ep[0]*ep[1])
 
         m = 0
 
@@ -295,16 +881,7 @@ class NonlinearDisSolver2D:
             #         f"There is no force in {dofControl+1} degree of freedom. Pick another dof.")
             print(self.bcVal)
 
-        chart_X = [0]
-        chart_Y = [0]
-        eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                           linewidth=0.7, label='Equlibrium path')
-        plt.style.use('seaborn-ticks')
-        plt.title('Equlibrium path')
-        plt.xlabel('Displacements [m]')
-        plt.ylabel('Forces [N]')
-        plt.grid()
-        plt.pause(0.01)
+        self.notify('start')
 
         print("FIRST SEQUENCE - DONE")
 
@@ -312,61 +889,39 @@ class NonlinearDisSolver2D:
             m += 1
             itr = 0
             qe = extractElext(edof, self.q)
-            K = Stiffness2D(edof, e_num, ex, ey, ep, qe, self.Ne)
+            K = Stiffness2D(edof, e_num, ex, ey, ep, qe, self.Ne, plan, geometry)
             KT = K.compute_ke_T()
-            dq, dR = solveq(KT, self.Q, self.bcDis, self.bcVal)
+            dq, dR = solveq(KT, self.Q, self.bcDis, self.bcVal, backend=backend)
             self.R += dR
             self.q += dq
             qe = extractElext(edof, self.q)
-
-            chart_X.append(-(float(self.q[dofTrack])))
-            chart_Y.append(-(float(self.R[dofTrack])))
-            eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                               linewidth=0.7, label='Equlibrium path')
-            plt.pause(0.01)
+            self.notify('path', -float(self.q[dofTrack]), -float(self.R[dofTrack]))
 
             print("SECOND SEQUENCE - DONE")
 
             while True:
                 itr += 1
-                Fc = Forces2D(edof, e_num, ex, ey, ep, qe)
-                self.Ne = Fc.compute_Ne()
-
-                K = Stiffness2D(edof, e_num, ex, ey, ep, qe, self.Ne)
-                KT = K.compute_ke_T()
-                Res = Fc.compute_Res(self.Q, self.R)
-
-                chart_X.append(-(float(self.q[dofTrack])))
-                chart_Y.append(
-                    -(float(self.R[dofTrack])-float(Res[dofTrack])))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.01)
+                St = InternalState2D(edof, e_num, ex, ey, ep, qe, plan, geometry)
+                self.Ne, F, KT = St.compute()
+                Res = self.Q+self.R-F
+                self.notify('path', -float(self.q[dofTrack]),
+                            -(float(self.R[dofTrack])-float(Res[dofTrack])))
 
                 Res_norm = np.linalg.norm(Res)
 
-                dq, dR = solveq(KT, Res, supports)
+                dq, dR = solveq(KT, Res, supports, backend=backend)
                 self.R += dR
                 self.q += dq
                 dq_norm = np.linalg.norm(dq)
                 qe = extractElext(edof, self.q)
-
-                chart_X.append(-(float(self.q[dofTrack])))
-                chart_Y.append(-(float(self.R[dofTrack])))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.01)
+                self.notify('path', -float(self.q[dofTrack]), -float(self.R[dofTrack]))
+                self.notify('iteration', m, itr, Res_norm, dq_norm)
 
                 print(f"THIRD SEQUENCE - DONE itr {itr}")
                 print(f"MAX iter {maxIter}")
 
                 if (Res_norm < resNorm and dq_norm < disNorm) or itr == maxIter:
-
-                    inc_range = plt.plot([0, -(float(self.q[dofTrack]))], [-(float(self.R[dofTrack])), -(
-                        float(self.R[dofTrack]))], linestyle='--', color='#000000', label='Force increment range')
-                    inc_range = plt.plot([-(float(self.q[dofTrack])), -(float(self.q[dofTrack]))], [0, -(
-                        float(self.R[dofTrack]))], linestyle='--', color='#000000', label='Force increment range')
-                    plt.pause(0.01)
+                    self.notify('step', m, itr, Res_norm < resNorm and dq_norm < disNorm)
 
                     print('--------------------------------------')
                     print(
@@ -383,11 +938,6 @@ class NonlinearDisSolver2D:
                 print("FIFTH SEQUENCE - DONE")
                 break
 
-        plt.pause(0.01)
-        plt.legend(handles=[eq_path[0], inc_range[0]],
-                   loc='lower right')
-        plt.show()
-
         self.sigma = np.divide(self.Ne.reshape(
             e_num, 1), ep[1].reshape(e_num, 1))
 
@@ -401,118 +951,265 @@ class NonlinearDisSolver2D:
         self.Ne = np.around(self.Ne, 5)
         self.nodal_Ne = np.around(self.nodal_Ne, 5)
         self.sigma = np.around(self.sigma, 5)
+        self.notify('finish')
 
 
-class NonlinearForceSolver3D:
-    def __init__(self, edof, max_edof, ex, ey, ez, ep, e_num, supports, forces, incermentsNum, maxIter, resNorm, disNorm, dofTrack):
-        self.Q = np.zeros((max_edof, 1))
-        deltaQ = 1/incermentsNum
+class NonlinearForceSolver3D(NonlinearForceSolver):
+    dim = 3
+
+    def __init__(self, edof, max_edof, ex, ey, ez, ep, e_num, supports, forces, incermentsNum, maxIter, resNorm, disNorm, dofTrack, plan=None, geometry=None, backend='dense', strategy='full', preconditioner='jacobi', tol=1e-10, maxiter=None, adaptive=False, line_search=False, predictor='tangent', observers=None):
+        self.setup(edof, max_edof, ex, ey, ez, ep, e_num, supports, plan, geometry, observers)
+        self._solver_options = dict(
+            preconditioner=preconditioner, tol=tol, maxiter=maxiter)
+        self._line_search = line_search
+
+        self.run(max_edof, ep, e_num, supports, forces, incermentsNum,
+                 maxIter, resNorm, disNorm, dofTrack, strategy, backend, adaptive,
+                 predictor)
+
+    def setup(self, edof, max_edof, ex, ey, ez, ep, e_num, supports, plan, geometry, observers):
+        """Keep the model, its dof partition and element geometry for the element classes"""
+        if plan is None:
+            plan = DofPartition(edof, max_edof, supports)
+        if geometry is None:
+            geometry = ElementGeometry3D(ex, ey, ez, ep[0]*ep[1])
+
+        self._edof = edof
+        self._e_num = e_num
+        self._ex = ex
+        self._ey = ey
+        self._ez = ez
+        self._ep = ep
+        self._plan = plan
+        self._geometry = geometry
+        self.observers = list(observers or [])
+
+    def stiffness(self, qe=None, Ne=None):
+        return Stiffness3D(self._edof, self._e_num, self._ex, self._ey, self._ez, self._ep,
+                           qe, Ne, self._plan, self._geometry)
+
+    def state(self, qe):
+        return InternalState3D(self._edof, self._e_num, self._ex, self._ey, self._ez, self._ep,
+                               qe, self._plan, self._geometry)
+
+
+class NonlinearDisSolver3D:
+    pass
+
 
+class ArcLengthSolver(NonlinearForceSolver):
+    """
+    Arc-length path following (Crisfield cylindrical constraint) shared by the
+    2D and 3D solvers. The load factor is an unknown, so limit points and
+    snap-backs are passed. Each iteration solves the tangent for the residual
+    and the reference load at once (bordered solve with two right-hand sides).
+    """
+
+    # Arc length control: desired iterations per step, limits of the length change
+    desired_iterations = 4
+    min_scale = 0.25
+    max_scale = 2.
+
+    def trace(self, max_edof, ep, e_num, supports, forces, arcLength, stepsNum, maxIter, resNorm, disNorm, dofTrack, maxLoad, backend, adaptive):
+        """
+        :param float arcLength: length of the first step in the displacement space
+        :param int stepsNum: maximum number of steps
+        :param float maxLoad: the analysis ends when the load factor reaches maxLoad,
+            a step whose arc passes maxLoad is repeated under load control to end exactly at it
+        :param bool adaptive: the arc length grows by sqrt(desired_iterations/iterations),
+            at most max_scale times, after steps faster than desired_iterations, slower
+            steps shrink it by the same rule, at most min_scale times, but not below
+            arcLength and steps shorter than arcLength recover towards it. A failed step
+            is halved and retried from the last converged state, the reduced length is
+            kept for hold_steps steps. The analysis stops when the arc length of a
+            retried step falls below min_step times arcLength
+        """
+        self.strategy = 'full'
+        self._solver_options = dict(self._solver_options, atol=self.pcg_atol*resNorm)
+        self.iterations = []
+        self.factorizations = 0
+        self.converged = True
+        self.load_factor = 0.
+        self.path_q = [0.]
+        self.path_load = [0.]
+
+        forces = np.asarray(forces, dtype=float).reshape(max_edof, 1)
+        self.Q = np.zeros((max_edof, 1))
         self.q = np.asmatrix(np.zeros((max_edof, 1)))
         self.Ne = np.zeros((e_num, 1))
         self.R = np.asmatrix(np.zeros((max_edof, 1)))
 
-        chart_X = [0]
-        chart_Y = [0]
-        eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                           linewidth=0.7, label='Equlibrium path')
-        plt.style.use('seaborn-ticks')
-        plt.title('Equlibrium path')
-        plt.xlabel('Displacements [m]')
-        plt.ylabel('Forces [N]')
-        plt.grid()
-        plt.pause(0.0001)
-
-        for m in range(0,  incermentsNum):
-            itr = 0
-            dQ = deltaQ*forces
-            self.Q += dQ
-            qe = extractElext(edof, self.q)
-            K = Stiffness3D(edof, e_num, ex, ey, ez, ep, qe, self.Ne)
-            KT = K.compute_ke_T()
-            dq, dR = solveq(KT, dQ, supports)
-            self.R += dR
-            self.q += dq
-            qe = extractElext(edof, self.q)
+        self.notify('start')
+
+        dl = arcLength
+        last = None
+        cutbacks = 0
+        hold = 0
+        m = 0
+        while m < stepsNum and self.load_factor < maxLoad:
+            self.step = m+1
+            state = (self.q.copy(), self.R.copy(), self.Ne.copy(), self.load_factor)
+            converged, itr, Dq = self.arc_step(
+                forces, dl, last, supports, backend, maxIter, resNorm, disNorm)
+            if converged and self.load_factor > maxLoad:
+                self.q, self.R, self.Ne, self.load_factor = state
+                converged, itr, Dq = self.arc_step(
+                    forces, dl, last, supports, backend, maxIter, resNorm, disNorm, maxLoad)
+
+            if not converged:
+                self.q, self.R, self.Ne, self.load_factor = state
+                self.Q = self.load_factor*forces
+                if not adaptive or cutbacks == self.max_cutbacks:
+                    self.converged = False
+                    print(f'Step {m+1} did not converge, analysis stopped '
+                          f'at load factor {self.load_factor}')
+                    break
+                cutbacks += 1
+                hold = self.hold_steps
+                dl /= 2
+                if dl < self.min_step*arcLength:
+                    self.converged = False
+                    print(f'Step {m+1} did not converge, arc length {dl} is below the '
+                          f'minimum, analysis stopped at load factor {self.load_factor}')
+                    break
+                self.notify('cutback', m+1)
+                print(f'Step {m+1} did not converge, arc length reduced to {dl}')
+                continue
 
-            chart_X.append(abs(float(self.q[dofTrack])))
-            chart_Y.append(abs(float(self.Q[dofTrack])))
-            eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                               linewidth=0.7, label='Equlibrium path')
-            plt.pause(0.0001)
+            m += 1
+            cutbacks = 0
+            last = (Dq, self.load_factor-state[3])
+            self.iterations.append(itr)
+            if adaptive:
+                scale = (self.desired_iterations/max(itr, 1))**0.5
+                if hold:
+                    hold -= 1
+                elif scale > 1:
+                    dl *= min(self.max_scale, scale)
+                elif dl > arcLength:
+                    dl = max(arcLength, dl*max(self.min_scale, scale))
+                elif dl < arcLength:
+                    dl = min(arcLength, dl*self.recovery)
+
+            self.path_q.append(self.q[dofTrack].item())
+            self.path_load.append(self.load_factor)
+            self.notify('path', abs(self.path_q[-1]), self.load_factor)
+            self.notify('step', m, itr, converged)
+
+            print('--------------------------------------')
+            print(
+                f'Step {m} \n\nload factor {self.load_factor}\n\ndisplacements\n {self.q} \n\niter [{itr}]')
+            print('--------------------------------------')
+
+        print(f'Arc-length steps: {m}, iterations: {sum(self.iterations)}, '
+              f'factorizations: {self.factorizations}')
+
+        self.results(max_edof, ep, e_num)
+        self.notify('finish')
+
+    def arc_step(self, forces, dl, last, supports, backend, maxIter, resNorm, disNorm, load=None):
+        """
+        One arc-length step of length dl from the current converged state.
+        Return (converged, number of iterations, step displacement Dq).
+        :param tuple last: (Dq, Dlam) of the previous converged step, None in the first step
+        :param float load: end the step at this load factor instead, the load factor
+            is then fixed in the iterations and dl is not used
+        """
+        try:
+            qe = extractElext(self._edof, self.q)
+            KT = self.factorize(self.stiffness(qe, self.Ne).compute_ke_T(),
+                                supports, backend)
+            dq_F, dR_F = KT.solve(forces)
+            dq_F = np.asarray(dq_F)
+
+            if load is None and last is None:
+                # Load factor scale of the predictor direction, the linear displacement
+                # under the reference load
+                self._load_scale = np.vdot(dq_F, dq_F)
+
+            if load is not None:
+                dlam = load-self.load_factor
+            else:
+                # Predictor (dq_F, 1) keeps the direction of the previous converged
+                # increment (Dq, Dlam), the load factor weighted by _load_scale
+                sign = 1.
+                if last is not None:
+                    Dq_last, Dlam_last = last
+                    if np.vdot(dq_F, Dq_last)+self._load_scale*Dlam_last < 0:
+                        sign = -1.
+                dlam = sign*dl/np.linalg.norm(dq_F)
+            Dq = dlam*dq_F
+            self.q += Dq
+            self.R += dlam*dR_F
+            self.load_factor += dlam
 
+            itr = 0
             while True:
                 itr += 1
-                Fc = Forces3D(edof, e_num, ex, ey, ez, ep, qe)
-                self.Ne = Fc.compute_Ne()
-
-                K = Stiffness3D(edof, e_num, ex, ey, ez, ep, qe, self.Ne)
-                KT = K.compute_ke_T()
-                Res = Fc.compute_Res(self.Q, self.R)
-
-                chart_X.append(abs(float(self.q[dofTrack])))
-                chart_Y.append(
-                    abs(float(self.Q[dofTrack])-float(Res[dofTrack])))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.0001)
-
+                self.Q = self.load_factor*forces
+                St = self.state(extractElext(self._edof, self.q))
+                self.Ne, F, K = St.compute()
+                Res = self.Q+self.R-F
                 Res_norm = np.linalg.norm(Res)
-                dq, dR = solveq(KT, Res, supports)
-                self.R += dR
+                if not np.isfinite(Res_norm):
+                    return False, itr, Dq
+
+                KT = self.factorize(K, supports, backend)
+                dq, dR = KT.solve(np.hstack([Res, forces]))
+                dq = np.asarray(dq)
+                dq_R, dq_F = dq[:, [0]], dq[:, [1]]
+
+                if load is not None:
+                    dlam = 0.
+                else:
+                    # Constraint |Dq + dq_R + dlam*dq_F| = dl
+                    u = Dq+dq_R
+                    a = np.vdot(dq_F, dq_F)
+                    b = 2*np.vdot(dq_F, u)
+                    c = np.vdot(u, u)-dl**2
+                    disc = b**2-4*a*c
+                    if disc < 0:
+                        return False, itr, Dq
+                    roots = ((-b+disc**0.5)/(2*a), (-b-disc**0.5)/(2*a))
+                    # Crisfield's angle criterion: the root whose step displacement makes
+                    # the smallest angle with the one before the iteration, both have length dl
+                    dlam = max(roots, key=lambda r: np.vdot(u+r*dq_F, Dq)/dl**2)
+
+                dq = dq_R+dlam*dq_F
                 self.q += dq
+                self.R += dR[:, 0]+dlam*dR[:, 1]
+                self.load_factor += dlam
+                Dq = Dq+dq
                 dq_norm = np.linalg.norm(dq)
-                qe = extractElext(edof, self.q)
+                self.notify('iteration', self.step, itr, Res_norm, dq_norm)
 
-                chart_X.append(abs(float(self.q[dofTrack])))
-                chart_Y.append(abs(float(self.Q[dofTrack])))
-                eq_path = plt.plot(chart_X, chart_Y, color='#f07200',
-                                   linewidth=0.7, label='Equlibrium path')
-                plt.pause(0.0001)
+                if Res_norm < resNorm and dq_norm < disNorm:
+                    self.Q = self.load_factor*forces
+                    return True, itr, Dq
+                if itr == maxIter:
+                    return False, itr, Dq
+        except (np.linalg.LinAlgError, RuntimeError) as error:
+            print(f'Equilibrium iterations failed: {error}')
+            return False, 0, None
 
-                if (Res_norm < resNorm and dq_norm < disNorm) or itr == maxIter:
 
-                    inc_range = plt.plot([0, abs(float(self.q[dofTrack]))], [abs(float(self.Q[dofTrack])), abs(
-                        float(self.Q[dofTrack]))], linestyle='--', color='#000000', label='Force increment range')
-                    inc_range = plt.plot([abs(float(self.q[dofTrack])), abs(float(self.q[dofTrack]))], [0, abs(
-                        float(self.Q[dofTrack]))], linestyle='--', color='#000000', label='Force increment range')
-                    plt.pause(0.0001)
+class ArcLengthSolver2D(ArcLengthSolver, NonlinearForceSolver2D):
+    dim = 2
 
-                    print('--------------------------------------')
-                    print(
-                        f'Step {m+1} \n\ndisplacements\n {self.q} \n\niter [{itr}]')
-                    print('--------------------------------------')
-                    break
+    def __init__(self, edof, max_edof, ex, ey, ep, e_num, supports, forces, arcLength, stepsNum, maxIter, resNorm, disNorm, dofTrack, maxLoad=1., plan=None, geometry=None, backend='dense', adaptive=True, observers=None):
+        self.setup(edof, max_edof, ex, ey, ep, e_num, supports, plan, geometry, observers)
+        self._solver_options = {}
 
-        plt.pause(0.0001)
-        plt.legend(handles=[eq_path[0], inc_range[0]],
-                   loc='lower right')
-        plt.show()
+        self.trace(max_edof, ep, e_num, supports, forces, arcLength, stepsNum, maxIter,
+                   resNorm, disNorm, dofTrack, maxLoad, backend, adaptive)
 
-        self.sigma = np.divide(self.Ne.reshape(
-            e_num, 1), ep[1].reshape(e_num, 1))
 
-        self.nodal_R = self.R.reshape(int(max_edof/3), 3)
-        self.nodal_q = self.q.reshape(int(max_edof/3), 3)
-        self.nodal_Ne = np.repeat(self.Ne, 2).reshape(e_num, 2)
-
-        self.q = np.around(self.q, 5)
-        self.nodal_q = np.around(self.nodal_q, 5)
-        self.nodal_R = np.around(self.nodal_R, 5)
-        self.Ne = np.around(self.Ne, 5)
-        self.nodal_Ne = np.around(self.nodal_Ne, 5)
-        self.sigma = np.around(self.sigma, 5)
-
-        dis = []
-        for h in range(0, int(max_edof/3)):
-            dis.append(
-                [f"Node_{h+1}: " + str(self.nodal_q[h])])
-        self.show_q = str(np.array(dis).reshape(int(max_edof/3), 1))
-        self.show_q = self.show_q.replace(",", "")
-        self.show_q = self.show_q.replace("[", "")
-        self.show_q = self.show_q.replace("]", "")
-        self.show_q = self.show_q.replace("'", "")
+class ArcLengthSolver3D(ArcLengthSolver, NonlinearForceSolver3D):
+    dim = 3
 
+    def __init__(self, edof, max_edof, ex, ey, ez, ep, e_num, supports, forces, arcLength, stepsNum, maxIter, resNorm, disNorm, dofTrack, maxLoad=1., plan=None, geometry=None, backend='dense', adaptive=True, observers=None):
+        self.setup(edof, max_edof, ex, ey, ez, ep, e_num, supports, plan, geometry, observers)
+        self._solver_options = {}
 
-class NonlinearDisSolver3D:
-    pass
+        self.trace(max_edof, ep, e_num, supports, forces, arcLength, stepsNum, maxIter,
+                   resNorm, disNorm, dofTrack, maxLoad, backend, adaptive)
@@ -1,16 +1,18 @@
 import numpy as np
+from scipy import sparse
 
 
 class Element_parameters2D:
     """Parent class that contains all element parameters needed to compute stiffness and forces"""
 
-    def __init__(self, edof, e_num, ex_global, ey_global, ep, qe=None, Ne=None):
+    def __init__(self, edof, e_num, ex_global, ey_global, ep, qe=None, Ne=None, geometry=None):
         """
         :param list ex: element x coordinates [x1, x2]
         :param list ey: element y coordinates [y1, y2]
         :param list ep: [E, A]: E - Young's modulus, A - Cross section area
         :param list qe: element global displacements [q1, q2, q3, q4]
         :param list Ne: element normal force [Ne]
+        :param ElementGeometry2D geometry: precomputed element geometry
         """
         self._edof = edof
         self._max_edof = np.amax(edof)
@@ -20,6 +22,7 @@ class Element_parameters2D:
         self._EA = ep[0]*ep[1]
         self._qe = qe
         self._Ne = Ne
+        self._geometry = geometry
 
     def length(self, ex, ey):
         """Element length"""
@@ -47,20 +50,214 @@ class Element_parameters2D:
         ])
         return G
 
+    @property
+    def geometry(self):
+        """Undeformed element geometry, shared when passed to the constructor"""
+        if self._geometry is None:
+            self._geometry = ElementGeometry2D(
+                self._ex, self._ey, self._EA)
+        return self._geometry
+
+    def batch_length(self):
+        """Lengths of all elements, [e_num]"""
+        return self.geometry.L
+
+    def batch_transformation_matrix(self):
+        """Transformation matrices G of all elements, [e_num x 4 x 4]"""
+        return self.geometry.G
+
+
+class ElementGeometry2D:
+    """Undeformed geometry of all elements: lengths, direction cosines and EA/L.
+    Computed once per model and shared by Stiffness2D and Forces2D."""
+
+    def __init__(self, ex, ey, EA):
+        """
+        :param array ex: elements x coordinates [e_num x 2]
+        :param array ey: elements y coordinates [e_num x 2]
+        :param array EA: elements axial stiffness [e_num]
+        """
+        dx = ex[:, 1]-ex[:, 0]
+        dy = ey[:, 1]-ey[:, 0]
+        self.L = np.sqrt(dx**2 + dy**2)
+        self.n = np.column_stack((dx/self.L, dy/self.L))
+        self.EA = EA
+        self.EA_L = EA/self.L
+        self.Ke_0 = None
+
+        c, s = self.n[:, 0], self.n[:, 1]
+        z = np.zeros(len(self.L))
+        G = np.array([
+            [c,  s,  z,  z],
+            [-s, c,  z,  z],
+            [z,  z,  c,  s],
+            [z,  z, -s,  c]
+        ])
+        self.G = G.transpose(2, 0, 1)
+
+
+def sparsity_pattern(rows, cols, shape):
+    """
+    CSR pattern of a matrix with entries at (rows, cols), duplicates summed.
+    Return (order, starts, indices, indptr), order sorts the entries by their
+    nonzero and starts[k] is the position of the first entry of nonzero k.
+    """
+    keys, scatter = np.unique(rows*shape[1] + cols, return_inverse=True)
+    scatter = scatter.ravel()
+    order = np.argsort(scatter, kind='stable')
+    starts = np.zeros(len(keys), dtype=np.intp)
+    np.cumsum(np.bincount(scatter, minlength=len(keys))[:-1], out=starts[1:])
+    indices = (keys % shape[1]).astype(np.int32)
+    indptr = np.zeros(shape[0]+1, dtype=np.int32)
+    np.cumsum(np.bincount(keys // shape[1], minlength=shape[0]),
+              out=indptr[1:])
+    return order, starts, indices, indptr
+
+
+def scatter_add(values, order, starts, scratch, out):
+    """
+    Sum entries into their nonzeros in place: values are gathered by order
+    into scratch and reduced between starts into out, nothing is allocated.
+    """
+    if len(out):
+        np.take(values, order, out=scratch)
+        np.add.reduceat(scratch, starts, out=out)
+    return out
+
+
+class AssemblyPlan:
+    """Sparsity pattern of the global stiffness matrix and element-to-nonzero scatter map.
+    Built once per model, reused by every assembly of the same topology."""
+
+    def __init__(self, edof, max_edof):
+        """
+        :param array edof: dof topology array [e_num x n]
+        :param int max_edof: total number of degrees of freedom
+        """
+        n = edof.shape[1]
+        idx = edof-1
+        rows = np.repeat(idx, n, axis=1).ravel()
+        cols = np.tile(idx, (1, n)).ravel()
+
+        self.shape = (max_edof, max_edof)
+        self.order, self.starts, self.indices, self.indptr = sparsity_pattern(
+            rows, cols, self.shape)
+        self.nnz = self.indices.shape[0]
+        self.data = np.zeros(self.nnz)
+        self._scratch = np.empty(len(self.order))
+
+    def assemble(self, Ke):
+        """
+        Refill the value array of the global matrix from element matrices Ke.
+        The returned CSR matrix shares its value array with the plan and is
+        overwritten by the next call.
+
+        :param array Ke: element matrices [e_num x n x n]
+        :return: the global matrix (scipy.sparse CSR)
+        """
+        scatter_add(Ke.ravel(), self.order, self.starts, self._scratch, self.data)
+        return sparse.csr_matrix((self.data, self.indices, self.indptr),
+                                 shape=self.shape, copy=False)
+
+
+class DofPartition:
+    """Free/prescribed split of the degrees of freedom, built once per model.
+    Element matrices are scattered straight into the free-free, prescribed-free
+    and prescribed-prescribed blocks, the full global matrix is never formed."""
+
+    def __init__(self, edof, max_edof, bcPrescr):
+        """
+        :param array edof: dof topology array [e_num x n]
+        :param int max_edof: total number of degrees of freedom
+        :param array bcPrescr: prescribed degrees of freedom (numbered from 1)
+        """
+        self.max_edof = max_edof
+        self.bcPrescr = np.asarray(bcPrescr, dtype=int).reshape(-1)
+        is_free = np.ones(max_edof, 'bool')
+        is_free[self.bcPrescr-1] = False
+        self.free = np.flatnonzero(is_free)
+        self.prescribed = self.bcPrescr-1
+
+        # Position of every dof inside its own block
+        index = np.zeros(max_edof, dtype=int)
+        index[self.free] = np.arange(len(self.free))
+        index[self.prescribed] = np.arange(len(self.prescribed))
+
+        n = edof.shape[1]
+        idx = edof-1
+        rows = np.repeat(idx, n, axis=1).ravel()
+        cols = np.tile(idx, (1, n)).ravel()
+        sizes = {True: len(self.free), False: len(self.prescribed)}
+
+        self._blocks = []
+        for row_free, col_free in ((True, True), (False, True), (False, False)):
+            entries = np.flatnonzero((is_free[rows] == row_free) &
+                                     (is_free[cols] == col_free))
+            shape = (sizes[row_free], sizes[col_free])
+            order, starts, indices, indptr = sparsity_pattern(
+                index[rows[entries]], index[cols[entries]], shape)
+            # Value array of the block and the gather buffer, reused by every assembly
+            buffers = (np.zeros(indices.shape[0]), np.empty(len(entries)))
+            self._blocks.append((entries[order], starts, buffers, indices, indptr, shape))
+
+    def matches(self, bcPrescr):
+        """True if bcPrescr are the prescribed dofs of this partition, in the same order"""
+        return np.array_equal(np.asarray(bcPrescr, dtype=int).reshape(-1), self.bcPrescr)
+
+    def assemble(self, Ke):
+        """
+        Assemble the blocks of the global matrix from element matrices Ke.
+        The blocks share their value arrays with the partition and are
+        overwritten by the next call.
+
+        :param array Ke: element matrices [e_num x n x n]
+        :return: PartitionedMatrix with scipy.sparse CSR blocks
+        """
+        Ke = Ke.ravel()
+        blocks = []
+        for order, starts, (data, scratch), indices, indptr, shape in self._blocks:
+            scatter_add(Ke, order, starts, scratch, data)
+            blocks.append(sparse.csr_matrix((data, indices, indptr),
+                                            shape=shape, copy=False))
+        return PartitionedMatrix(self, *blocks)
+
+
+class PartitionedMatrix:
+    """Global matrix stored as the blocks of a DofPartition"""
+
+    def __init__(self, partition, Kff, Kpf, Kpp):
+        self.partition = partition
+        self.Kff = Kff
+        self.Kpf = Kpf
+        self.Kpp = Kpp
+        self.shape = (partition.max_edof, partition.max_edof)
+
+    def tocsr(self):
+        """Full global matrix in the original dof order"""
+        K = sparse.bmat([[self.Kff, self.Kpf.T], [self.Kpf, self.Kpp]],
+                        format='csr')
+        order = np.argsort(np.concatenate(
+            [self.partition.free, self.partition.prescribed]))
+        return K[order][:, order]
+
 
 class Stiffness2D(Element_parameters2D):
     """Class that contains stifness matrices for each element"""
 
-    def __init__(self, edof, e_num, ex_global, ey_global, ep, qe=None, Ne=None):
+    def __init__(self, edof, e_num, ex_global, ey_global, ep, qe=None, Ne=None, plan=None, geometry=None):
         """
         :param list ex: element x coordinates [x1, x2]
         :param list ey: element y coordinates [y1, y2]
         :param list ep: [E, A]: E - Young's modulus, A - Cross section area
         :param list qe: element global displacements [q1, q2, q3, q4]
         :param list Ne: element normal force [Ne]
+        :param AssemblyPlan plan: cached sparsity pattern, global matrices
+            are then assembled as scipy.sparse CSR through the plan
+        :param ElementGeometry2D geometry: precomputed element geometry
         """
+        self._plan = plan
         Element_parameters2D.__init__(
-            self, edof, e_num, ex_global, ey_global, ep, qe, Ne)
+            self, edof, e_num, ex_global, ey_global, ep, qe, Ne, geometry)
 
     def bar2d_ke_0(self, ex, ey, EA):
         """
@@ -120,6 +317,77 @@ class Stiffness2D(Element_parameters2D):
 
         return G.T*Ke_sigma*G
 
+    def batch_ke_0(self):
+        """
+        Compute stiffness matrices of all elements at once in global coord. system.
+        Batched counterpart of bar2d_ke_0.
+        Element matrices do not depend on displacements and are cached in geometry.
+        Return array Ke_0: stiffness matrices [e_num x 4 x 4]
+        """
+        geometry = self.geometry
+        if geometry.Ke_0 is not None:
+            return geometry.Ke_0
+
+        G = geometry.G
+        k = np.array([[1., 0., -1., 0.],
+                      [0., 0.,  0., 0.],
+                      [-1., 0., 1., 0.],
+                      [0.,  0.,  0., 0.]
+                      ])
+        Ke_0 = geometry.EA_L[:, None, None]*k
+
+        geometry.Ke_0 = np.einsum('eji,ejk,ekl->eil', G, Ke_0, G)
+
+        return geometry.Ke_0
+
+    def batch_ke_u(self):
+        """
+        Compute displacement matrices of all elements at once in global coord. system.
+        Batched counterpart of bar2d_ke_u.
+        Return array Ke_u: displacement matrices [e_num x 4 x 4]
+        """
+        L = self.batch_length()
+        G = self.batch_transformation_matrix()
+        qeloc = np.einsum('eij,ej->ei', G, self._qe)
+
+        du = qeloc[:, 2] - qeloc[:, 0]
+        dv = qeloc[:, 3] - qeloc[:, 1]
+        z = np.zeros(self._e_num)
+
+        Ke_1 = np.array([[2*du, dv, -2*du, -dv],
+                         [dv,    z,  -dv,    z],
+                         [-2*du, -dv, 2*du, dv],
+                         [-dv,   z,   dv,    z]
+                         ]).transpose(2, 0, 1)
+
+        Ke_2 = np.array([[du**2, du*dv, -du**2, -du*dv],
+                         [du*dv, dv**2, -du*dv, -dv**2],
+                         [-du**2, -du*dv, du**2, du*dv],
+                         [-du*dv, -dv**2, du*dv, dv**2]
+                         ]).transpose(2, 0, 1)
+
+        Ke_u = (self._EA/L**2)[:, None, None]*Ke_1 + \
+            (self._EA/L**3)[:, None, None]*Ke_2
+
+        return np.einsum('eji,ejk,ekl->eil', G, Ke_u, G)
+
+    def batch_ke_sigma(self):
+        """
+        Compute stress matrices of all elements at once in global coord. system.
+        Batched counterpart of bar2d_ke_sigma.
+        Return array Ke_sigma: stress matrices [e_num x 4 x 4]
+        """
+        L = self.batch_length()
+        G = self.batch_transformation_matrix()
+        k = np.array([
+            [1, 0, -1, 0],
+            [0, 1, 0, -1],
+            [-1, 0, 1, 0],
+            [0, -1, 0, 1]])
+        Ke_sigma = (np.ravel(self._Ne)/L)[:, None, None]*k
+
+        return np.einsum('eji,ejk,ekl->eil', G, Ke_sigma, G)
+
     def assem_K(self, edof, K, Ke):
         """
         Assemble element matrices Ke into the global
@@ -148,72 +416,125 @@ class Stiffness2D(Element_parameters2D):
 
         return K
 
-    def compute_ke_0(self):
+    def assem_K_sparse(self, edof, Ke):
         """
-        Compute global stiffnes matrix for two dimensional bar elements.
-        Return mat K_0: tangent matrix [4 x 4]
+        Assemble element matrices Ke of all elements into the sparse global
+        stiffness matrix K according to the topology matrix edof.
+        Entries are collected in COO format and duplicates are summed
+        during conversion, so memory scales with the number of elements.
+
+        Parameters:
+
+            edof        dof topology array [e_num x n]
+            Ke          element stiffness matrices [e_num x n x n]
+
+        Output parameters:
+
+            K           the global stiffness matrix (scipy.sparse CSR)
+        """
+        n = edof.shape[1]
+        idx = edof-1
+        rows = np.repeat(idx, n, axis=1).ravel()
+        cols = np.tile(idx, (1, n)).ravel()
+
+        K = sparse.coo_matrix((Ke.ravel(), (rows, cols)),
+                              shape=(self._max_edof, self._max_edof))
+        return K.tocsr()
+
+    def assemble(self, Ke, sparse=False):
+        """
+        Assemble element matrices Ke of all elements into the global matrix,
+        through the assembly plan when one was given.
+        :param array Ke: element matrices [e_num x n x n]
+        :param bool sparse: assemble into a scipy.sparse CSR matrix
         """
-        Ke_0 = np.zeros((self._e_num, 4, 4))
+        if self._plan is not None:
+            return self._plan.assemble(Ke)
 
-        K_0 = np.zeros((self._max_edof, self._max_edof))
+        if sparse:
+            return self.assem_K_sparse(self._edof, Ke)
 
+        K = np.zeros((self._max_edof, self._max_edof))
         for i in range(0, self._e_num):
-            Ke_0[i] = self.bar2d_ke_0(self._ex[i], self._ey[i], self._EA[i])
-            K_0 = self.assem_K(self._edof[i, :], K_0, Ke_0[i])
+            K = self.assem_K(self._edof[i, :], K, Ke[i])
 
-        return K_0
+        return K
 
-    def compute_ke_T(self):
+    def compute_ke_0(self, batched=True, sparse=False):
         """
-        Compute global tangent matrix for two dimensional bar elements.
-        Return mat K_T: tangent matrix [4 x 4]
+        Compute global stiffnes matrix for two dimensional bar elements.
+        :param bool batched: evaluate all element matrices at once,
+            False uses per-element bar2d_ke_0 (reference implementation)
+        :param bool sparse: assemble into a scipy.sparse CSR matrix
+        Return mat K_0: tangent matrix [4 x 4]
         """
-        Ke_0 = np.zeros((self._e_num, 4, 4))
-        Ke_u = np.zeros((self._e_num, 4, 4))
-        Ke_sigma = np.zeros((self._e_num, 4, 4))
+        if batched:
+            Ke_0 = self.batch_ke_0()
+        else:
+            Ke_0 = np.zeros((self._e_num, 4, 4))
+            for i in range(0, self._e_num):
+                Ke_0[i] = self.bar2d_ke_0(
+                    self._ex[i], self._ey[i], self._EA[i])
 
-        K_T = np.zeros((self._max_edof, self._max_edof))
+        return self.assemble(Ke_0, sparse)
 
-        for i in range(0, self._e_num):
-            Ke_0[i] = self.bar2d_ke_0(self._ex[i], self._ey[i], self._EA[i])
-            Ke_u[i] = self.bar2d_ke_u(
-                self._ex[i], self._ey[i], self._EA[i], self._qe[i])
-            Ke_sigma[i] = self.bar2d_ke_sigma(
-                self._ex[i], self._ey[i], self._Ne[i])
+    def compute_ke_T(self, batched=True, sparse=False):
+        """
+        Compute global tangent matrix for two dimensional bar elements.
+        :param bool batched: evaluate all element matrices at once,
+            False uses per-element bar2d_ke_* (reference implementation)
+        :param bool sparse: assemble into a scipy.sparse CSR matrix
+        Return mat K_T: tangent matrix [4 x 4]
+        """
+        if batched:
+            Ke_T = self.batch_ke_0()+self.batch_ke_u()+self.batch_ke_sigma()
+        else:
+            Ke_0 = np.zeros((self._e_num, 4, 4))
+            Ke_u = np.zeros((self._e_num, 4, 4))
+            Ke_sigma = np.zeros((self._e_num, 4, 4))
 
-        Ke_T = Ke_0+Ke_u+Ke_sigma
+            for i in range(0, self._e_num):
+                Ke_0[i] = self.bar2d_ke_0(
+                    self._ex[i], self._ey[i], self._EA[i])
+                Ke_u[i] = self.bar2d_ke_u(
+                    self._ex[i], self._ey[i], self._EA[i], self._qe[i])
+                Ke_sigma[i] = self.bar2d_ke_sigma(
+                    self._ex[i], self._ey[i], self._Ne[i])
 
-        for j in range(0, self._e_num):
-            K_T = self.assem_K(self._edof[j, :], K_T, Ke_T[j])
+            Ke_T = Ke_0+Ke_u+Ke_sigma
 
-        return K_T
+        return self.assemble(Ke_T, sparse)
 
 
 class Forces2D(Element_parameters2D):
     """Class that computes internal forces in elements"""
 
-    def __init__(self, edof, e_num, ex_global, ey_global, ep, qe=None):
+    def __init__(self, edof, e_num, ex_global, ey_global, ep, qe=None, geometry=None):
         """
         :param list ex: element x coordinates [x1, x2]
         :param list ey: element y coordinates [y1, y2]
         :param list ep: [E, A]: E - Young's modulus, A - Cross section area
         :param list qe: element global displacements [q1, q2, q3, q4]
         :param list Ne: element normal force [Ne]
+        :param ElementGeometry2D geometry: precomputed element geometry
         """
         Element_parameters2D.__init__(
-            self, edof, e_num, ex_global, ey_global, ep, qe)
+            self, edof, e_num, ex_global, ey_global, ep, qe, geometry=geometry)
 
-    def bar2d_Ne(self, ex, ey, EA, qe):
+    def bar2d_Ne(self, ex, ey, EA, qe, L=None, G=None):
         """
         Compute the normal force for two dimensional bar element. (10-33)
 
         :param list ex: element x coordinates [x1, x2]
         :param list ey: element y coordinates [y1, y2]
         :param list ep: [E, A]: E - Young's modulus, A - Cross section area
+        :param float L, mat G: cached element length and transformation matrix
         :return normal force
         """
-        L = self.length(ex, ey)
-        G = self.transfromation_matrix(ex, ey)
+        if L is None:
+            L = self.length(ex, ey)
+        if G is None:
+            G = self.transfromation_matrix(ex, ey)
         qeloc = np.matmul(G, qe.reshape(4, 1))
 
         B0 = np.array([-1, 0, 1, 0])/L
@@ -230,17 +551,20 @@ class Forces2D(Element_parameters2D):
         N = EA*np.matmul(B, qeloc)
         return N
 
-    def bar2d_Ne_lin(self, ex, ey, EA, qe):
+    def bar2d_Ne_lin(self, ex, ey, EA, qe, L=None, G=None):
         """
         Compute the normal force for two dimensional bar element. (10-33)
 
         :param list ex: element x coordinates [x1, x2]
         :param list ey: element y coordinates [y1, y2]
         :param list ep: [E, A]: E - Young's modulus, A - Cross section area
+        :param float L, mat G: cached element length and transformation matrix
         :return normal force
         """
-        L = self.length(ex, ey)
-        G = self.transfromation_matrix(ex, ey)
+        if L is None:
+            L = self.length(ex, ey)
+        if G is None:
+            G = self.transfromation_matrix(ex, ey)
         qeloc = np.matmul(G, qe.reshape(4, 1))
 
         B = np.array([-1, 0, 1, 0])/L
@@ -248,7 +572,7 @@ class Forces2D(Element_parameters2D):
         N = EA*np.matmul(B, qeloc)
         return N
 
-    def bar2d_Fe(self, ex, ey, qe, Ne):
+    def bar2d_Fe(self, ex, ey, qe, Ne, L=None, G=None):
         """
         Compute the Fe matrix for two dimensional bar element. (10-43c)
 
@@ -256,10 +580,13 @@ class Forces2D(Element_parameters2D):
         :param list ey: element y coordinates [y1, y2]
         :param list qe: element global displacements [q1, q2, q3, q4]
         :param list Ne: element normal force [Ne]
+        :param float L, mat G: cached element length and transformation matrix
         :return mat Fe: [4 x 1]
         """
-        L = self.length(ex, ey)
-        G = self.transfromation_matrix(ex, ey)
+        if L is None:
+            L = self.length(ex, ey)
+        if G is None:
+            G = self.transfromation_matrix(ex, ey)
         qeloc = np.matmul(G, qe.reshape(4, 1))
 
         du = qeloc[2, 0] - qeloc[0, 0]
@@ -274,6 +601,61 @@ class Forces2D(Element_parameters2D):
 
         return np.matmul(G.T, Ne.item()*Fe)
 
+    def assem_F_batch(self, edof, Fe):
+        """
+        Assemble element force vectors Fe of all elements into the global
+        force vector F with one unbuffered scatter-add (bincount).
+
+        Parameters:
+            edof        dof topology array [e_num x 4]
+            Fe          element force vectors [e_num x 4]
+
+        Output parameters:
+            F           the global force vector [max_edof x 1]
+        """
+        F = np.bincount((edof-1).ravel(), weights=np.ravel(Fe),
+                        minlength=self._max_edof)
+        return F.reshape(self._max_edof, 1)
+
+    def batch_elongation(self):
+        """Differences of local end displacements of all elements, [e_num x 2]"""
+        qeloc = np.einsum('eij,ej->ei', self.batch_transformation_matrix(),
+                          self._qe)
+        return qeloc[:, 2:] - qeloc[:, :2]
+
+    def batch_Ne(self):
+        """
+        Compute normal forces of all elements at once. (10-33)
+        Batched counterpart of bar2d_Ne.
+        Return array Ne: normal forces [e_num]
+        """
+        L = self.batch_length()
+        d = self.batch_elongation()
+        return self._EA*(d[:, 0]/L + 0.5*np.sum(d**2, axis=1)/L**2)
+
+    def batch_Ne_lin(self):
+        """
+        Compute linear normal forces of all elements at once. (10-33)
+        Batched counterpart of bar2d_Ne_lin.
+        Return array Ne: normal forces [e_num]
+        """
+        L = self.batch_length()
+        d = self.batch_elongation()
+        return self._EA*d[:, 0]/L
+
+    def batch_Fe(self, Ne):
+        """
+        Compute internal force vectors of all elements at once in global coord. system. (10-43c)
+        Batched counterpart of bar2d_Fe.
+        :param array Ne: element normal forces [e_num]
+        Return array Fe: [e_num x 4]
+        """
+        L = self.batch_length()
+        b = self.batch_elongation()/L[:, None]
+        b[:, 0] += 1
+        Fe = np.ravel(Ne)[:, None]*np.hstack((-b, b))
+        return np.einsum('eji,ej->ei', self.batch_transformation_matrix(), Fe)
+
     def assem_F(self, edof, F, Fe):
         """
         Assemble element matrices and fe into the global force vector F
@@ -300,45 +682,68 @@ class Forces2D(Element_parameters2D):
 
         return F
 
-    def compute_Ne(self):
+    def compute_Ne(self, batched=True):
         """
         Compute global normal force for two dimensional bar elements.
-        Return mat K_0: tangent matrix [4 x 4]
+        :param bool batched: evaluate all elements at once,
+            False uses per-element bar2d_Ne (reference implementation)
+        Return array Ne: normal forces [e_num x 1]
         """
+        if batched:
+            self.Ne = self.batch_Ne().reshape(self._e_num, 1)
+            return self.Ne
+
         Ne = np.zeros((self._e_num, 1))
+        L = self.batch_length()
+        G = self.batch_transformation_matrix()
 
         for i in range(0, self._e_num):
             Ne[i] = self.bar2d_Ne(self._ex[i], self._ey[i],
-                                  self._EA[i], self._qe[i])
+                                  self._EA[i], self._qe[i], L[i], G[i])
         self.Ne = Ne
 
         return Ne
 
-    def compute_Ne_lin(self):
+    def compute_Ne_lin(self, batched=True):
         """
-        Compute global normal force for two dimensional bar elements.
-        Return mat K_0: tangent matrix [4 x 4]
+        Compute global linear normal force for two dimensional bar elements.
+        :param bool batched: evaluate all elements at once,
+            False uses per-element bar2d_Ne_lin (reference implementation)
+        Return array Ne: normal forces [e_num x 1]
         """
+        if batched:
+            self.Ne = self.batch_Ne_lin().reshape(self._e_num, 1)
+            return self.Ne
+
         Ne = np.zeros((self._e_num, 1))
-        print("debug", self._ex, self._ey, self._EA, self._qe)
+        L = self.batch_length()
+        G = self.batch_transformation_matrix()
+
         for i in range(0, self._e_num):
             Ne[i] = self.bar2d_Ne_lin(
-                self._ex[i], self._ey[i], self._EA[i], self._qe[i])
+                self._ex[i], self._ey[i], self._EA[i], self._qe[i], L[i], G[i])
         self.Ne = Ne
 
         return Ne
 
-    def compute_F(self):
+    def compute_F(self, batched=True):
         """
         Compute global internal forces for two dimensional bar elements.
-        Return mat K_0: tangent matrix [4 x 4]
+        :param bool batched: evaluate and scatter all elements at once,
+            False uses per-element bar2d_Fe and assem_F (reference implementation)
+        Return array F: internal forces [max_edof x 1]
         """
+        if batched:
+            return self.assem_F_batch(self._edof, self.batch_Fe(self.Ne))
+
         Fe = np.zeros((self._e_num, 4, 1))
         F = np.zeros((self._max_edof, 1))
+        L = self.batch_length()
+        G = self.batch_transformation_matrix()
 
         for i in range(0, self._e_num):
             Fe[i] = self.bar2d_Fe(
-                self._ex[i], self._ey[i], self._qe[i], self.Ne[i])
+                self._ex[i], self._ey[i], self._qe[i], self.Ne[i], L[i], G[i])
             F = self.assem_F(self._edof[i, :], F, Fe[i])
 
         return F
@@ -348,16 +753,89 @@ class Forces2D(Element_parameters2D):
         return Q+R-self.compute_F()
 
 
+class InternalState2D(Stiffness2D):
+    """Class that computes normal forces, internal forces and tangent matrix in one pass"""
+
+    def __init__(self, edof, e_num, ex_global, ey_global, ep, qe, plan=None, geometry=None):
+        """
+        :param list ex: element x coordinates [x1, x2]
+        :param list ey: element y coordinates [y1, y2]
+        :param list ep: [E, A]: E - Young's modulus, A - Cross section area
+        :param list qe: element global displacements [q1, q2, q3, q4]
+        :param AssemblyPlan plan: cached sparsity pattern
+        :param ElementGeometry2D geometry: precomputed element geometry
+        """
+        Stiffness2D.__init__(self, edof, e_num, ex_global, ey_global,
+                             ep, qe, None, plan, geometry)
+
+    def compute(self, sparse=False, tangent=True):
+        """
+        Transform element displacements to local coord. system once and evaluate
+        normal forces (10-33), internal forces (10-43c) and tangent matrices (10-36)
+        of all elements from them.
+        :param bool sparse: assemble K_T into a scipy.sparse CSR matrix
+        :param bool tangent: False skips the tangent matrix, K_T is then None
+        Return (Ne [e_num x 1], F [max_edof x 1], K_T [max_edof x max_edof])
+        """
+        geometry = self.geometry
+        L = geometry.L
+        EA = geometry.EA
+        G = geometry.G
+        qeloc = np.einsum('eij,ej->ei', G, self._qe)
+
+        du = qeloc[:, 2] - qeloc[:, 0]
+        dv = qeloc[:, 3] - qeloc[:, 1]
+        z = np.zeros(self._e_num)
+
+        Ne = EA*(du/L + 0.5*(du**2 + dv**2)/L**2)
+
+        Fe = Ne*np.array([-1-du/L, -dv/L, 1+du/L, dv/L])
+        Fe = np.einsum('eji,je->ei', G, Fe)
+        F = np.bincount((self._edof-1).ravel(), weights=Fe.ravel(),
+                        minlength=self._max_edof).reshape(self._max_edof, 1)
+
+        if not tangent:
+            return Ne.reshape(self._e_num, 1), F, None
+
+        Ke_0 = np.array([[1., 0., -1., 0.],
+                         [0., 0.,  0., 0.],
+                         [-1., 0., 1., 0.],
+                         [0.,  0.,  0., 0.]
+                         ])
+        Ke_sigma = np.array([
+            [1, 0, -1, 0],
+            [0, 1, 0, -1],
+            [-1, 0, 1, 0],
+            [0, -1, 0, 1]])
+        Ke_1 = np.array([[2*du, dv, -2*du, -dv],
+                         [dv,    z,  -dv,    z],
+                         [-2*du, -dv, 2*du, dv],
+                         [-dv,   z,   dv,    z]
+                         ]).transpose(2, 0, 1)
+        Ke_2 = np.array([[du**2, du*dv, -du**2, -du*dv],
+                         [du*dv, dv**2, -du*dv, -dv**2],
+                         [-du**2, -du*dv, du**2, du*dv],
+                         [-du*dv, -dv**2, du*dv, dv**2]
+                         ]).transpose(2, 0, 1)
+
+        Ke_T = (EA/L)[:, None, None]*Ke_0 + (Ne/L)[:, None, None]*Ke_sigma + \
+            (EA/L**2)[:, None, None]*Ke_1 + (EA/L**3)[:, None, None]*Ke_2
+        Ke_T = np.einsum('eji,ejk,ekl->eil', G, Ke_T, G)
+
+        return Ne.reshape(self._e_num, 1), F, self.assemble(Ke_T, sparse)
+
+
 class Element_parameters3D:
     """Parent class that contains all element parameters needed to compute stiffness and forces"""
 
-    def __init__(self, edof, e_num, ex_global, ey_global, ez_global, ep, qe=None, Ne=None):
+    def __init__(self, edof, e_num, ex_global, ey_global, ez_global, ep, qe=None, Ne=None, geometry=None):
         """
         :param list ex: element x coordinates [x1, x2]
         :param list ey: element y coordinates [y1, y2]
         :param list ep: [E, A]: E - Young's modulus, A - Cross section area
         :param list qe: element global displacements [q1, q2, q3, q4]
         :param list Ne: element normal force [Ne]
+        :param ElementGeometry3D geometry: precomputed element geometry
         """
         self._edof = edof
         self._max_edof = np.amax(edof)
@@ -368,6 +846,7 @@ class Element_parameters3D:
         self._EA = ep[0]*ep[1]
         self._qe = qe
         self._Ne = Ne
+        self._geometry = geometry
 
     def length(self, ex, ey, ez):
         """Element length"""
@@ -399,19 +878,72 @@ class Element_parameters3D:
         ])
         return G
 
+    @property
+    def geometry(self):
+        """Undeformed element geometry, shared when passed to the constructor"""
+        if self._geometry is None:
+            self._geometry = ElementGeometry3D(
+                self._ex, self._ey, self._ez, self._EA)
+        return self._geometry
+
+    def batch_length(self):
+        """Lengths of all elements, [e_num]"""
+        return self.geometry.L
+
+    def batch_transformation_matrix(self):
+        """Transformation matrices G of all elements, [e_num x 6 x 6]"""
+        return self.geometry.G
+
+
+class ElementGeometry3D:
+    """Undeformed geometry of all elements: lengths, direction cosines and EA/L.
+    Computed once per model and shared by Stiffness3D and Forces3D."""
+
+    def __init__(self, ex, ey, ez, EA):
+        """
+        :param array ex: elements x coordinates [e_num x 2]
+        :param array ey: elements y coordinates [e_num x 2]
+        :param array ez: elements z coordinates [e_num x 2]
+        :param array EA: elements axial stiffness [e_num]
+        """
+        dx = ex[:, 1]-ex[:, 0]
+        dy = ey[:, 1]-ey[:, 0]
+        dz = ez[:, 1]-ez[:, 0]
+        self.L = np.sqrt(dx**2 + dy**2 + dz**2)
+        self.n = np.column_stack((dx/self.L, dy/self.L, dz/self.L))
+        self.EA = EA
+        self.EA_L = EA/self.L
+        self.Ke_0 = None
+
+        n0, n1, n2 = self.n[:, 0], self.n[:, 1], self.n[:, 2]
+        z = np.zeros(len(self.L))
+        G = np.array([
+            [n0,  n1, n2,  z,   z,  z],
+            [-n1, n0, n2,  z,   z,  z],
+            [n2,  n1, n0,  z,   z,  z],
+            [z,   z,  z,   n0,  n1, n2],
+            [z,   z,  z,  -n1,  n0, n2],
+            [z,   z,  z,   n2,  n1, n0]
+        ])
+        self.G = G.transpose(2, 0, 1)
+
 
 class Stiffness3D(Element_parameters3D):
     """Class that contains stifness matrices for each element"""
 
-    def __init__(self, edof, e_num, ex_global, ey_global, ez_global, ep, qe=None, Ne=None):
+    def __init__(self, edof, e_num, ex_global, ey_global, ez_global, ep, qe=None, Ne=None, plan=None, geometry=None):
         """
         :param list ex: element x coordinates [x1, x2]
         :param list ey: element y coordinates [y1, y2]
         :param list ep: [E, A]: E - Young's modulus, A - Cross section area
         :param list qe: element global displacements [q1, q2, q3, q4]
         :param list Ne: element normal force [Ne]
+        :param AssemblyPlan plan: cached sparsity pattern, global matrices
+            are then assembled as scipy.sparse CSR through the plan
+        :param ElementGeometry3D geometry: precomputed element geometry
         """
-        Element_parameters3D.__init__(self, edof, e_num, ex_global, ey_global, ez_global, ep, qe, Ne)
+        self._plan = plan
+        Element_parameters3D.__init__(self, edof, e_num, ex_global, ey_global, ez_global, ep, qe, Ne, geometry)
 
     def bar3d_ke_0(self, ex, ey, ez, EA):
         """
@@ -453,10 +985,10 @@ class Stiffness3D(Element_parameters3D):
 
         Ke_2 = (3/2)*(EA/L**3)*np.mat([[du**2, du*dv, du*dw, -du**2, -du*dv, -du*dw],
                                        [du*dv, dv**2, dv*dw, -du*dv, -dv**2, -dv*dw],
-                                       [dw*du, dw*dv, dw*2,  -dw*du, -dw*dv,  -dw*2],
+                                       [dw*du, dw*dv, dw**2, -dw*du, -dw*dv, -dw**2],
                                        [-du**2, -du*dv, -du*dw, du**2, du*dv, du*dw],
                                        [-du*dv, -dv**2, -dv*dw, du*dv, dv**2, dv*dw],
-                                       [-dw*du, -dw*dv, -dw*2,  dw*du, dw*dv,  dw*2]
+                                       [-dw*du, -dw*dv, -dw**2, dw*du, dw*dv, dw**2]
                                        ])
 
         Ke_u = (2/3)*Ke_1 + (2/3)*Ke_2
@@ -481,6 +1013,87 @@ class Stiffness3D(Element_parameters3D):
 
         return G.T*Ke_sigma*G
 
+    def batch_ke_0(self):
+        """
+        Compute stiffness matrices of all elements at once in global coord. system.
+        Batched counterpart of bar3d_ke_0.
+        Element matrices do not depend on displacements and are cached in geometry.
+        Return array Ke_0: stiffness matrices [e_num x 6 x 6]
+        """
+        geometry = self.geometry
+        if geometry.Ke_0 is not None:
+            return geometry.Ke_0
+
+        G = geometry.G
+        k = np.array([[1., 0., 0., -1., 0., 0.],
+                      [0., 0., 0.,  0., 0., 0.],
+                      [0., 0., 0.,  0., 0., 0.],
+                      [-1., 0., 0., 1., 0., 0.],
+                      [0.,  0., 0.,  0., 0., 0.],
+                      [0., 0., 0.,  0., 0., 0.]
+                      ])
+        Ke_0 = geometry.EA_L[:, None, None]*k
+
+        geometry.Ke_0 = np.einsum('eji,ejk,ekl->eil', G, Ke_0, G)
+
+        return geometry.Ke_0
+
+    def batch_ke_u(self):
+        """
+        Compute displacement matrices of all elements at once in global coord. system.
+        Batched counterpart of bar3d_ke_u.
+        Return array Ke_u: displacement matrices [e_num x 6 x 6]
+        """
+        L = self.batch_length()
+        G = self.batch_transformation_matrix()
+        qeloc = np.einsum('eij,ej->ei', G, self._qe)
+
+        du = qeloc[:, 3] - qeloc[:, 0]
+        dv = qeloc[:, 4] - qeloc[:, 1]
+        dw = qeloc[:, 5] - qeloc[:, 2]
+        z = np.zeros(self._e_num)
+
+        Ke_1 = np.array([[2*du, dv, dw, -2*du, -dv, -dw],
+                         [dv,    z,  z,  -dv,    z,  z],
+                         [dw,    z,  z,  -dw,    z,  z],
+                         [-2*du, -dv, -dw, 2*du, dv, dw],
+                         [-dv,   z,  z,   dv,    z,  z],
+                         [-dw,   z,  z,   dw,    z,  z]
+                         ]).transpose(2, 0, 1)
+
+        Ke_2 = np.array([[du**2, du*dv, du*dw, -du**2, -du*dv, -du*dw],
+                         [du*dv, dv**2, dv*dw, -du*dv, -dv**2, -dv*dw],
+                         [dw*du, dw*dv, dw**2, -dw*du, -dw*dv, -dw**2],
+                         [-du**2, -du*dv, -du*dw, du**2, du*dv, du*dw],
+                         [-du*dv, -dv**2, -dv*dw, du*dv, dv**2, dv*dw],
+                         [-dw*du, -dw*dv, -dw**2, dw*du, dw*dv, dw**2]
+                         ]).transpose(2, 0, 1)
+
+        Ke_u = (self._EA/L**2)[:, None, None]*Ke_1 + \
+            (self._EA/L**3)[:, None, None]*Ke_2
+
+        return np.einsum('eji,ejk,ekl->eil', G, Ke_u, G)
+
+    def batch_ke_sigma(self):
+        """
+        Compute stress matrices of all elements at once in global coord. system.
+        Batched counterpart of bar3d_ke_sigma.
+        Return array Ke_sigma: stress matrices [e_num x 6 x 6]
+        """
+        L = self.batch_length()
+        G = self.batch_transformation_matrix()
+        k = np.array([
+            [1, 0, 0, -1, 0, 0],
+            [0, 1, 0, 0, -1, 0],
+            [0, 0, 1, 0, 0, -1],
+            [-1, 0, 0, 1, 0, 0],
+            [0, -1, 0, 0, 1, 0],
+            [0, 0, -1, 0, 0, 1]
+        ])
+        Ke_sigma = (np.ravel(self._Ne)/L)[:, None, None]*k
+
+        return np.einsum('eji,ejk,ekl->eil', G, Ke_sigma, G)
+
     def assem_K(self, edof, K, Ke):
         """
         Assemble element matrices Ke into the global
@@ -509,73 +1122,124 @@ class Stiffness3D(Element_parameters3D):
 
         return K
 
-    def compute_ke_0(self):
+    def assem_K_sparse(self, edof, Ke):
         """
-        Compute global stiffnes matrix for two dimensional bar elements.
-        Return mat K_0: tangent matrix [4 x 4]
+        Assemble element matrices Ke of all elements into the sparse global
+        stiffness matrix K according to the topology matrix edof.
+        Entries are collected in COO format and duplicates are summed
+        during conversion, so memory scales with the number of elements.
+
+        Parameters:
+
+            edof        dof topology array [e_num x n]
+            Ke          element stiffness matrices [e_num x n x n]
+
+        Output parameters:
+
+            K           the global stiffness matrix (scipy.sparse CSR)
         """
-        Ke_0 = np.zeros((self._e_num, 6, 6))
+        n = edof.shape[1]
+        idx = edof-1
+        rows = np.repeat(idx, n, axis=1).ravel()
+        cols = np.tile(idx, (1, n)).ravel()
 
-        K_0 = np.zeros((self._max_edof, self._max_edof))
+        K = sparse.coo_matrix((Ke.ravel(), (rows, cols)),
+                              shape=(self._max_edof, self._max_edof))
+        return K.tocsr()
 
+    def assemble(self, Ke, sparse=False):
+        """
+        Assemble element matrices Ke of all elements into the global matrix,
+        through the assembly plan when one was given.
+        :param array Ke: element matrices [e_num x n x n]
+        :param bool sparse: assemble into a scipy.sparse CSR matrix
+        """
+        if self._plan is not None:
+            return self._plan.assemble(Ke)
+
+        if sparse:
+            return self.assem_K_sparse(self._edof, Ke)
+
+        K = np.zeros((self._max_edof, self._max_edof))
         for i in range(0, self._e_num):
-            Ke_0[i] = self.bar3d_ke_0(
-                self._ex[i], self._ey[i], self._ez[i], self._EA[i])
-            K_0 = self.assem_K(self._edof[i, :], K_0, Ke_0[i])
+            K = self.assem_K(self._edof[i, :], K, Ke[i])
 
-        return K_0
+        return K
 
-    def compute_ke_T(self):
+    def compute_ke_0(self, batched=True, sparse=False):
         """
-        Compute global tangent matrix for two dimensional bar elements.
-        Return mat K_T: tangent matrix [4 x 4]
+        Compute global stiffnes matrix for three dimensional bar elements.
+        :param bool batched: evaluate all element matrices at once,
+            False uses per-element bar3d_ke_0 (reference implementation)
+        :param bool sparse: assemble into a scipy.sparse CSR matrix
+        Return mat K_0: tangent matrix [6 x 6]
         """
-        Ke_0 = np.zeros((self._e_num, 6, 6))
-        Ke_u = np.zeros((self._e_num, 6, 6))
-        Ke_sigma = np.zeros((self._e_num, 6, 6))
+        if batched:
+            Ke_0 = self.batch_ke_0()
+        else:
+            Ke_0 = np.zeros((self._e_num, 6, 6))
+            for i in range(0, self._e_num):
+                Ke_0[i] = self.bar3d_ke_0(
+                    self._ex[i], self._ey[i], self._ez[i], self._EA[i])
 
-        K_T = np.zeros((self._max_edof, self._max_edof))
+        return self.assemble(Ke_0, sparse)
 
-        for i in range(0, self._e_num):
-            Ke_0[i] = self.bar3d_ke_0(
-                self._ex[i], self._ey[i], self._ez[i], self._EA[i])
-            Ke_u[i] = self.bar3d_ke_u(
-                self._ex[i], self._ey[i], self._ez[i], self._EA[i], self._qe[i])
-            Ke_sigma[i] = self.bar3d_ke_sigma(
-                self._ex[i], self._ey[i], self._ez[i], self._Ne[i])
+    def compute_ke_T(self, batched=True, sparse=False):
+        """
+        Compute global tangent matrix for three dimensional bar elements.
+        :param bool batched: evaluate all element matrices at once,
+            False uses per-element bar3d_ke_* (reference implementation)
+        :param bool sparse: assemble into a scipy.sparse CSR matrix
+        Return mat K_T: tangent matrix [6 x 6]
+        """
+        if batched:
+            Ke_T = self.batch_ke_0()+self.batch_ke_u()+self.batch_ke_sigma()
+        else:
+            Ke_0 = np.zeros((self._e_num, 6, 6))
+            Ke_u = np.zeros((self._e_num, 6, 6))
+            Ke_sigma = np.zeros((self._e_num, 6, 6))
 
-        Ke_T = Ke_0+Ke_u+Ke_sigma
+            for i in range(0, self._e_num):
+                Ke_0[i] = self.bar3d_ke_0(
+                    self._ex[i], self._ey[i], self._ez[i], self._EA[i])
+                Ke_u[i] = self.bar3d_ke_u(
+                    self._ex[i], self._ey[i], self._ez[i], self._EA[i], self._qe[i])
+                Ke_sigma[i] = self.bar3d_ke_sigma(
+                    self._ex[i], self._ey[i], self._ez[i], self._Ne[i])
 
-        for j in range(0, self._e_num):
-            K_T = self.assem_K(self._edof[j, :], K_T, Ke_T[j])
+            Ke_T = Ke_0+Ke_u+Ke_sigma
 
-        return K_T
+        return self.assemble(Ke_T, sparse)
 
 
 class Forces3D(Element_parameters3D):
     """Class that computes internal forces in elements"""
 
-    def __init__(self, edof, e_num, ex_global, ey_global, ez_global, ep, qe=None):
+    def __init__(self, edof, e_num, ex_global, ey_global, ez_global, ep, qe=None, geometry=None):
         """
         :param list ex: element x coordinates [x1, x2]
         :param list ey: element y coordinates [y1, y2]
         :param list ep: [E, A]: E - Young's modulus, A - Cross section area
         :param list qe: element global displacements [q1, q2, q3, q4]
         :param list Ne: element normal force [Ne]
+        :param ElementGeometry3D geometry: precomputed element geometry
         """
-        Element_parameters3D.__init__(self, edof, e_num, ex_global, ey_global, ez_global, ep, qe)
+        Element_parameters3D.__init__(self, edof, e_num, ex_global, ey_global, ez_global, ep, qe, geometry=geometry)
 
-    def bar3d_Ne(self, ex, ey, ez, EA, qe):
+    def bar3d_Ne(self, ex, ey, ez, EA, qe, L=None, G=None):
         """
         Compute the normal force for two dimensional bar element. (10-33)
 
         :param list ex: element x coordinates [x1, x2]
         :param list ey: element y coordinates [y1, y2]
         :param list ep: [E, A]: E - Young's modulus, A - Cross section area
+        :param float L, mat G: cached element length and transformation matrix
         :return normal force
         """
-        L = self.length(ex, ey, ez)
-        G = self.transfromation_matrix(ex, ey, ez)
+        if L is None:
+            L = self.length(ex, ey, ez)
+        if G is None:
+            G = self.transfromation_matrix(ex, ey, ez)
         qeloc = np.matmul(G, qe.reshape(6, 1))
 
         B0 = np.array([-1., 0., 0., 1., 0., 0.])/L
@@ -594,17 +1258,20 @@ class Forces3D(Element_parameters3D):
         N = EA*np.matmul(B, qeloc)
         return N
 
-    def bar3d_Ne_lin(self, ex, ey, ez, EA, qe):
+    def bar3d_Ne_lin(self, ex, ey, ez, EA, qe, L=None, G=None):
         """
         Compute the normal force for two dimensional bar element. (10-33)
 
         :param list ex: element x coordinates [x1, x2]
         :param list ey: element y coordinates [y1, y2]
         :param list ep: [E, A]: E - Young's modulus, A - Cross section area
+        :param float L, mat G: cached element length and transformation matrix
         :return normal force
         """
-        L = self.length(ex, ey, ez)
-        G = self.transfromation_matrix(ex, ey, ez)
+        if L is None:
+            L = self.length(ex, ey, ez)
+        if G is None:
+            G = self.transfromation_matrix(ex, ey, ez)
         qeloc = np.matmul(G, qe.reshape(6, 1))
 
         B = np.array([-1., 0., 0., 1., 0., 0.])/L
@@ -612,7 +1279,7 @@ class Forces3D(Element_parameters3D):
         N = EA*np.matmul(B, qeloc)
         return N
 
-    def bar3d_Fe(self, ex, ey, ez, qe, Ne):
+    def bar3d_Fe(self, ex, ey, ez, qe, Ne, L=None, G=None):
         """
         Compute the Fe matrix for two dimensional bar element. (10-43c)
 
@@ -620,10 +1287,13 @@ class Forces3D(Element_parameters3D):
         :param list ey: element y coordinates [y1, y2]
         :param list qe: element global displacements [q1, q2, q3, q4]
         :param list Ne: element normal force [Ne]
+        :param float L, mat G: cached element length and transformation matrix
         :return mat Fe: [4 x 1]
         """
-        L = self.length(ex, ey, ez)
-        G = self.transfromation_matrix(ex, ey, ez)
+        if L is None:
+            L = self.length(ex, ey, ez)
+        if G is None:
+            G = self.transfromation_matrix(ex, ey, ez)
         qeloc = np.matmul(G, qe.reshape(6, 1))
 
         du = qeloc[3, 0] - qeloc[0, 0]
@@ -641,6 +1311,61 @@ class Forces3D(Element_parameters3D):
 
         return np.matmul(G.T, Ne.item()*Fe)
 
+    def assem_F_batch(self, edof, Fe):
+        """
+        Assemble element force vectors Fe of all elements into the global
+        force vector F with one unbuffered scatter-add (bincount).
+
+        Parameters:
+            edof        dof topology array [e_num x 6]
+            Fe          element force vectors [e_num x 6]
+
+        Output parameters:
+            F           the global force vector [max_edof x 1]
+        """
+        F = np.bincount((edof-1).ravel(), weights=np.ravel(Fe),
+                        minlength=self._max_edof)
+        return F.reshape(self._max_edof, 1)
+
+    def batch_elongation(self):
+        """Differences of local end displacements of all elements, [e_num x 3]"""
+        qeloc = np.einsum('eij,ej->ei', self.batch_transformation_matrix(),
+                          self._qe)
+        return qeloc[:, 3:] - qeloc[:, :3]
+
+    def batch_Ne(self):
+        """
+        Compute normal forces of all elements at once. (10-33)
+        Batched counterpart of bar3d_Ne.
+        Return array Ne: normal forces [e_num]
+        """
+        L = self.batch_length()
+        d = self.batch_elongation()
+        return self._EA*(d[:, 0]/L + 0.5*np.sum(d**2, axis=1)/L**2)
+
+    def batch_Ne_lin(self):
+        """
+        Compute linear normal forces of all elements at once. (10-33)
+        Batched counterpart of bar3d_Ne_lin.
+        Return array Ne: normal forces [e_num]
+        """
+        L = self.batch_length()
+        d = self.batch_elongation()
+        return self._EA*d[:, 0]/L
+
+    def batch_Fe(self, Ne):
+        """
+        Compute internal force vectors of all elements at once in global coord. system. (10-43c)
+        Batched counterpart of bar3d_Fe.
+        :param array Ne: element normal forces [e_num]
+        Return array Fe: [e_num x 6]
+        """
+        L = self.batch_length()
+        b = self.batch_elongation()/L[:, None]
+        b[:, 0] += 1
+        Fe = np.ravel(Ne)[:, None]*np.hstack((-b, b))
+        return np.einsum('eji,ej->ei', self.batch_transformation_matrix(), Fe)
+
     def assem_F(self, edof, F, Fe):
         """
         Assemble element matrices and fe into the global force vector F
@@ -667,45 +1392,68 @@ class Forces3D(Element_parameters3D):
 
         return F
 
-    def compute_Ne(self):
+    def compute_Ne(self, batched=True):
         """
-        Compute global normal force for two dimensional bar elements.
-        Return mat K_0: tangent matrix [4 x 4]
+        Compute global normal force for three dimensional bar elements.
+        :param bool batched: evaluate all elements at once,
+            False uses per-element bar3d_Ne (reference implementation)
+        Return array Ne: normal forces [e_num x 1]
         """
+        if batched:
+            self.Ne = self.batch_Ne().reshape(self._e_num, 1)
+            return self.Ne
+
         Ne = np.zeros((self._e_num, 1))
+        L = self.batch_length()
+        G = self.batch_transformation_matrix()
 
         for i in range(0, self._e_num):
             Ne[i] = self.bar3d_Ne(self._ex[i], self._ey[i],
-                                  self._ez[i], self._EA[i], self._qe[i])
+                                  self._ez[i], self._EA[i], self._qe[i], L[i], G[i])
         self.Ne = Ne
 
         return Ne
 
-    def compute_Ne_lin(self):
+    def compute_Ne_lin(self, batched=True):
         """
-        Compute global normal force for two dimensional bar elements.
-        Return mat K_0: tangent matrix [4 x 4]
+        Compute global linear normal force for three dimensional bar elements.
+        :param bool batched: evaluate all elements at once,
+            False uses per-element bar3d_Ne_lin (reference implementation)
+        Return array Ne: normal forces [e_num x 1]
         """
+        if batched:
+            self.Ne = self.batch_Ne_lin().reshape(self._e_num, 1)
+            return self.Ne
+
         Ne = np.zeros((self._e_num, 1))
+        L = self.batch_length()
+        G = self.batch_transformation_matrix()
 
         for i in range(0, self._e_num):
             Ne[i] = self.bar3d_Ne_lin(self._ex[i], self._ey[i],
-                                      self._ez[i], self._EA[i], self._qe[i])
+                                      self._ez[i], self._EA[i], self._qe[i], L[i], G[i])
         self.Ne = Ne
 
         return Ne
 
-    def compute_F(self):
+    def compute_F(self, batched=True):
         """
-        Compute global internal forces for two dimensional bar elements.
-        Return mat K_0: tangent matrix [4 x 4]
+        Compute global internal forces for three dimensional bar elements.
+        :param bool batched: evaluate and scatter all elements at once,
+            False uses per-element bar3d_Fe and assem_F (reference implementation)
+        Return array F: internal forces [max_edof x 1]
         """
+        if batched:
+            return self.assem_F_batch(self._edof, self.batch_Fe(self.Ne))
+
         Fe = np.zeros((self._e_num, 6, 1))
         F = np.zeros((self._max_edof, 1))
+        L = self.batch_length()
+        G = self.batch_transformation_matrix()
 
         for i in range(0, self._e_num):
             Fe[i] = self.bar3d_Fe(
-                self._ex[i], self._ey[i], self._ez[i], self._qe[i], self.Ne[i])
+                self._ex[i], self._ey[i], self._ez[i], self._qe[i], self.Ne[i], L[i], G[i])
             F = self.assem_F(self._edof[i, :], F, Fe[i])
 
         return F
@@ -713,3 +1461,86 @@ class Forces3D(Element_parameters3D):
     def compute_Res(self, Q, R):
 
         return Q+R-self.compute_F()
+
+
+class InternalState3D(Stiffness3D):
+    """Class that computes normal forces, internal forces and tangent matrix in one pass"""
+
+    def __init__(self, edof, e_num, ex_global, ey_global, ez_global, ep, qe, plan=None, geometry=None):
+        """
+        :param list ex: element x coordinates [x1, x2]
+        :param list ey: element y coordinates [y1, y2]
+        :param list ez: element z coordinates [z1, z2]
+        :param list ep: [E, A]: E - Young's modulus, A - Cross section area
+        :param list qe: element global displacements [q1, ..., q6]
+        :param AssemblyPlan plan: cached sparsity pattern
+        :param ElementGeometry3D geometry: precomputed element geometry
+        """
+        Stiffness3D.__init__(self, edof, e_num, ex_global, ey_global, ez_global,
+                             ep, qe, None, plan, geometry)
+
+    def compute(self, sparse=False, tangent=True):
+        """
+        Transform element displacements to local coord. system once and evaluate
+        normal forces (10-33), internal forces (10-43c) and tangent matrices (10-36)
+        of all elements from them.
+        :param bool sparse: assemble K_T into a scipy.sparse CSR matrix
+        :param bool tangent: False skips the tangent matrix, K_T is then None
+        Return (Ne [e_num x 1], F [max_edof x 1], K_T [max_edof x max_edof])
+        """
+        geometry = self.geometry
+        L = geometry.L
+        EA = geometry.EA
+        G = geometry.G
+        qeloc = np.einsum('eij,ej->ei', G, self._qe)
+
+        du = qeloc[:, 3] - qeloc[:, 0]
+        dv = qeloc[:, 4] - qeloc[:, 1]
+        dw = qeloc[:, 5] - qeloc[:, 2]
+        z = np.zeros(self._e_num)
+
+        Ne = EA*(du/L + 0.5*(du**2 + dv**2 + dw**2)/L**2)
+
+        Fe = Ne*np.array([-1-du/L, -dv/L, -dw/L, 1+du/L, dv/L, dw/L])
+        Fe = np.einsum('eji,je->ei', G, Fe)
+        F = np.bincount((self._edof-1).ravel(), weights=Fe.ravel(),
+                        minlength=self._max_edof).reshape(self._max_edof, 1)
+
+        if not tangent:
+            return Ne.reshape(self._e_num, 1), F, None
+
+        Ke_0 = np.array([[1., 0., 0., -1., 0., 0.],
+                         [0., 0., 0.,  0., 0., 0.],
+                         [0., 0., 0.,  0., 0., 0.],
+                         [-1., 0., 0., 1., 0., 0.],
+                         [0.,  0., 0.,  0., 0., 0.],
+                         [0., 0., 0.,  0., 0., 0.]
+                         ])
+        Ke_sigma = np.array([
+            [1, 0, 0, -1, 0, 0],
+            [0, 1, 0, 0, -1, 0],
+            [0, 0, 1, 0, 0, -1],
+            [-1, 0, 0, 1, 0, 0],
+            [0, -1, 0, 0, 1, 0],
+            [0, 0, -1, 0, 0, 1]
+        ])
+        Ke_1 = np.array([[2*du, dv, dw, -2*du, -dv, -dw],
+                         [dv,    z,  z,  -dv,    z,  z],
+                         [dw,    z,  z,  -dw,    z,  z],
+                         [-2*du, -dv, -dw, 2*du, dv, dw],
+                         [-dv,   z,  z,   dv,    z,  z],
+                         [-dw,   z,  z,   dw,    z,  z]
+                         ]).transpose(2, 0, 1)
+        Ke_2 = np.array([[du**2, du*dv, du*dw, -du**2, -du*dv, -du*dw],
+                         [du*dv, dv**2, dv*dw, -du*dv, -dv**2, -dv*dw],
+                         [dw*du, dw*dv, dw**2, -dw*du, -dw*dv, -dw**2],
+                         [-du**2, -du*dv, -du*dw, du**2, du*dv, du*dw],
+                         [-du*dv, -dv**2, -dv*dw, du*dv, dv**2, dv*dw],
+                         [-dw*du, -dw*dv, -dw**2, dw*du, dw*dv, dw**2]
+                         ]).transpose(2, 0, 1)
+
+        Ke_T = (EA/L)[:, None, None]*Ke_0 + (Ne/L)[:, None, None]*Ke_sigma + \
+            (EA/L**2)[:, None, None]*Ke_1 + (EA/L**3)[:, None, None]*Ke_2
+        Ke_T = np.einsum('eji,ejk,ekl->eil', G, Ke_T, G)
+
+        return Ne.reshape(self._e_num, 1), F, self.assemble(Ke_T, sparse)
@@ -0,0 +1,24 @@
+import glob
+import os
+import sys
+
+import matplotlib
+import pytest
+
+matplotlib.use("Agg")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+sys.path.insert(0, SRC)
+
+# Bundled models, the general 2D/3D ones and the examples
+DATA_MODELS = sorted(glob.glob(os.path.join(SRC, "data", "*.json")))
+EXAMPLE_MODELS = sorted(glob.glob(os.path.join(SRC, "examples", "*.json")))
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    """Model caches written by the tests go to a temporary folder, not the user's cache"""
+    folder = tmp_path_factory.getbasetemp()/"cache"
+    monkeypatch.setenv("HERMES_CACHE_DIR", str(folder))
+    return folder
@@ -0,0 +1,54 @@
+import json
+import os
+
+import numpy as np
+
+from batch import main, model_paths
+from conftest import DATA_MODELS, SRC
+from data_exchange.model_import import ModelImport
+from structure.build_model import Truss2D, Truss3D
+from structure.solver import LinearSolver2D, LinearSolver3D
+
+
+def results(output, path, analysis):
+    name = os.path.splitext(os.path.basename(path))[0]
+    with open(os.path.join(output, f"{name}_{analysis}_results.json")) as file:
+        return json.load(file)
+
+
+def test_model_paths_expands_directories():
+    paths = model_paths([os.path.join(SRC, "data"), DATA_MODELS[0]])
+    assert paths == DATA_MODELS+DATA_MODELS[:1]
+
+
+def test_linear_batch_matches_single_solves(tmp_path):
+    output = str(tmp_path)
+    assert main([os.path.join(SRC, "data"), "-o", output, "-j", "2"]) == 0
+
+    for path in DATA_MODELS:
+        data = ModelImport(path)
+        if data.structure_type == "2D":
+            truss = Truss2D(data)
+            truss.build_model()
+            solve = LinearSolver2D(truss.edof, truss.max_edof, truss.ex, truss.ey, data.ep,
+                                   truss.e_num, truss.supports, truss.forces)
+        else:
+            truss = Truss3D(data)
+            truss.build_model()
+            solve = LinearSolver3D(truss.edof, truss.max_edof, truss.ex, truss.ey, truss.ez,
+                                   data.ep, truss.e_num, truss.supports, truss.forces)
+        # The batch solves the RCM-reordered model and exports the original numbering
+        batch = results(output, path, "linear")
+        np.testing.assert_allclose(batch["nodal_q"], solve.nodal_q, atol=1e-5)
+        np.testing.assert_allclose(batch["nodal_R"], solve.nodal_R, atol=1e-5)
+
+
+def test_nonlinear_batch_reports_failures(tmp_path):
+    output = str(tmp_path)
+    truss2D = os.path.join(SRC, "data", "truss2D.json")
+    assert main([truss2D, "-a", "nonlinear", "-o", output, "-j", "1"]) == 0
+    assert os.path.exists(os.path.join(output, "truss2D_nonlinear_results.json"))
+
+    # Initial stiffness iterations stall on this model, the batch exits with an error
+    assert main([truss2D, "-a", "nonlinear", "--strategy", "initial", "-o", output,
+                 "-j", "1"]) == 1
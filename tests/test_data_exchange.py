@@ -0,0 +1,218 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from conftest import DATA_MODELS, EXAMPLE_MODELS, SRC
+from data_exchange import cache
+from data_exchange.cache import cache_path, file_hash, load_cached
+from data_exchange.container import is_container, read_container, write_container
+from data_exchange.export import ModelExport, StepResultsWriter
+from data_exchange.json_stream import stream_load
+from data_exchange.model_import import ModelImport, StepResultsImport
+from structure.build_model import Truss2D
+from structure.solver import NonlinearForceSolver2D
+
+MODELS = DATA_MODELS+EXAMPLE_MODELS
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def assert_model_equal(data, reference):
+    """ModelImport data against the decoded JSON document"""
+    assert data.example == reference["example"]
+    assert data.structure_type == reference["structure_type"]
+    for key in ("E", "A"):
+        np.testing.assert_array_equal(getattr(data, key), reference[key])
+    for key in ("coords", "elems", "supports", "forces", "displacements"):
+        if key in reference:
+            expected = np.array(reference[key])
+            assert getattr(data, key).dtype == expected.dtype
+            np.testing.assert_array_equal(getattr(data, key), expected)
+
+
+@pytest.fixture
+def copy(tmp_path):
+    """Copy a bundled model to a temporary folder"""
+    def copy(path):
+        target = tmp_path/os.path.basename(path)
+        shutil.copy(path, target)
+        return str(target)
+    return copy
+
+
+@pytest.mark.parametrize("path", MODELS, ids=os.path.basename)
+def test_import_matches_json(path):
+    assert_model_equal(ModelImport(path), load(path))
+
+
+@pytest.mark.parametrize("path", MODELS, ids=os.path.basename)
+@pytest.mark.parametrize("chunk_size", [7, 64, 1 << 20])
+def test_stream_load_matches_json(path, chunk_size):
+    reference = load(path)
+    data = stream_load(path, chunk_size)
+    assert list(data) == list(reference)
+    for key, value in reference.items():
+        if isinstance(value, list):
+            expected = np.array(value)
+            assert data[key].dtype == expected.dtype
+            np.testing.assert_array_equal(data[key], expected)
+        else:
+            assert data[key] == value
+
+
+@pytest.mark.parametrize("path", MODELS, ids=os.path.basename)
+def test_streamed_import_matches_json(path):
+    data = ModelImport(path, stream=True, cache=False)
+    assert_model_equal(data, load(path))
+    # The streamed arrays are used as parsed, not converted to lists
+    assert isinstance(data.E, np.ndarray) and isinstance(data.A, np.ndarray)
+
+
+@pytest.mark.parametrize("text, error", [
+    ('{"a": [[1, 2], [3]]}', "equal length"),
+    ('{"a": [[[1]]]}', "nested"),
+    ('{"a": [true]}', "numbers"),
+    ('{"a": [1,, 2]}', "numbers"),
+    ('{"a": [1, 2, ]}', "numbers"),
+    ('{"a": [1, 2]', "Expected"),
+])
+def test_stream_load_rejects_unsupported_arrays(tmp_path, text, error):
+    path = tmp_path/"model.json"
+    path.write_text(text)
+    with pytest.raises(ValueError, match=error):
+        stream_load(str(path), 3)
+
+
+def test_stream_load_keeps_strings_and_scalars(tmp_path):
+    path = tmp_path/"model.json"
+    path.write_text('{ "s": "x,[]}y", "n": null, "f": 2.5, "e": [], "a": [1, -2e1] }')
+    data = stream_load(str(path), 3)
+    assert data["s"] == "x,[]}y" and data["n"] is None and data["f"] == 2.5
+    assert data["e"].size == 0
+    np.testing.assert_array_equal(data["a"], [1., -20.])
+
+
+@pytest.mark.parametrize("path", MODELS, ids=os.path.basename)
+def test_binary_round_trip(path, tmp_path):
+    binary = str(tmp_path/"model.hmb")
+    ModelExport(ModelImport(path), binary).toBinary()
+    assert is_container(binary)
+    for mmap in (True, False):
+        assert_model_equal(ModelImport(binary, mmap=mmap), load(path))
+
+    exported = str(tmp_path/"model.json")
+    ModelExport(ModelImport(binary), exported).toJSON()
+    assert load(exported) == load(path)
+
+
+def test_container_alignment(tmp_path):
+    path = str(tmp_path/"arrays.hmb")
+    arrays = {"coords": np.arange(15.).reshape(5, 3), "elems": np.arange(7)}
+    write_container(path, {"example": None}, arrays)
+    header, read = read_container(path)
+    assert header == {"example": None}
+    for key, value in arrays.items():
+        assert read[key].ctypes.data % 64 == 0
+        np.testing.assert_array_equal(read[key], value)
+
+
+def test_cache_is_kept_out_of_the_model_folder(copy, cache_dir):
+    path = copy(DATA_MODELS[0])
+    ModelImport(path)
+    assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
+    assert os.path.dirname(cache_path(path)) == str(cache_dir)
+    assert os.path.exists(cache_path(path))
+
+
+def test_import_without_cache_writes_nothing(copy):
+    path = copy(DATA_MODELS[0])
+    ModelImport(path, cache=False)
+    assert not os.path.exists(cache_path(path))
+
+
+def test_cache_is_keyed_by_the_absolute_path(copy, tmp_path, monkeypatch):
+    path = copy(DATA_MODELS[0])
+    monkeypatch.chdir(tmp_path)
+    assert cache_path(os.path.basename(path)) == cache_path(path)
+    assert cache_path(path) != cache_path(DATA_MODELS[0])
+
+
+def test_cache_is_used_until_the_model_changes(copy, monkeypatch):
+    hashed = []
+    monkeypatch.setattr(cache, "file_hash",
+                        lambda path: hashed.append(path) or file_hash(path))
+    path = copy(DATA_MODELS[0])
+    reference = load(path)
+    assert_model_equal(ModelImport(path), reference)
+    assert load_cached(path) is not None
+    assert_model_equal(ModelImport(path), reference)
+
+    # Same content with a new modification time is still valid
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns+10**9))
+    del hashed[:]
+    assert load_cached(path) is not None
+    assert len(hashed) == 1
+    # The key was updated to the new time, the next load does not hash the file
+    assert load_cached(path) is not None
+    assert len(hashed) == 1
+
+    reference["E"] = [2*E for E in reference["E"]]
+    with open(path, "w") as file:
+        json.dump(reference, file)
+    assert load_cached(path) is None
+    assert_model_equal(ModelImport(path), reference)
+
+
+def solve_with_steps(path, reorder):
+    data = ModelImport(os.path.join(SRC, "data", "truss2D.json"))
+    truss = Truss2D(data)
+    truss.build_model(reorder)
+    writer = StepResultsWriter(data, path, truss.dof_order)
+    solve = NonlinearForceSolver2D(truss.edof, truss.max_edof, truss.ex, truss.ey, data.ep,
+                                   truss.e_num, truss.supports, truss.forces, 10, 50,
+                                   1e-6, 1e-6, 1, plan=truss.partition,
+                                   geometry=truss.geometry, observers=[writer])
+    return truss.original_numbering(solve)
+
+
+@pytest.mark.parametrize("reorder", [False, True])
+def test_step_results_round_trip(tmp_path, reorder):
+    path = str(tmp_path/"steps.jsonl")
+    solve = solve_with_steps(path, reorder)
+    history = StepResultsImport(path)
+    assert history.header["solver"] == "NonlinearForceSolver2D"
+    assert history.structure_type == "2D"
+    assert history.complete and history.converged
+    assert history.steps_num == len(solve.iterations)
+
+    steps = list(history.steps())
+    assert [step["iterations"] for step in steps] == solve.iterations
+    np.testing.assert_allclose([step["load_factor"] for step in steps],
+                               np.arange(1, 11)/10)
+    # Results of the last step in the original numbering
+    np.testing.assert_allclose(steps[-1]["nodal_q"], solve.nodal_q, atol=1e-5)
+    np.testing.assert_allclose(steps[-1]["nodal_R"], solve.nodal_R, atol=1e-5)
+    np.testing.assert_allclose(steps[-1]["element_Ne"], np.ravel(solve.Ne), atol=1e-5)
+
+
+def test_interrupted_step_results_keep_the_complete_steps(tmp_path):
+    path = str(tmp_path/"steps.jsonl")
+    solve = solve_with_steps(path, False)
+    with open(path) as file:
+        lines = file.readlines()
+    # Drop the finish record and cut the last step record in half
+    with open(path, "w") as file:
+        file.writelines(lines[:-2])
+        file.write(lines[-2][:len(lines[-2])//2])
+
+    history = StepResultsImport(path)
+    assert not history.complete and history.converged is None
+    assert history.steps_num == len(solve.iterations)-1
+    assert len(list(history.steps())) == history.steps_num
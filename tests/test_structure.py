@@ -0,0 +1,495 @@
+import os
+import subprocess
+import sys
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from conftest import DATA_MODELS, EXAMPLE_MODELS, SRC
+from data_exchange.model_import import ModelImport
+from structure.build_model import Truss2D, Truss3D
+from structure.plotter import EquilibriumPathPlot
+from structure.solver import (ArcLengthSolver2D, ArcLengthSolver3D, BFGSUpdate, Factorization,
+                              LinearSolver2D, LinearSolver3D, LoadCasesSolver2D,
+                              LoadCasesSolver3D, NonlinearForceSolver2D, NonlinearForceSolver3D,
+                              extractElext, line_search, solveq)
+from structure.truss_classes import (Forces2D, Forces3D, InternalState2D, InternalState3D,
+                                     Stiffness2D, Stiffness3D)
+
+# 2D models the force-controlled Newton solver follows to the full load
+NONLINEAR_MODELS = [os.path.join(SRC, "data", name)
+                    for name in ("truss2D.json", "data2D_diff_EA.json")]
+
+
+def build(path, reorder=False):
+    data = ModelImport(path)
+    truss = Truss2D(data) if data.structure_type == "2D" else Truss3D(data)
+    truss.build_model(reorder)
+    return data, truss
+
+
+def coords(truss):
+    if isinstance(truss, Truss2D):
+        return (truss.ex, truss.ey)
+    return (truss.ex, truss.ey, truss.ez)
+
+
+def linear(data, truss, **options):
+    solver = LinearSolver2D if isinstance(truss, Truss2D) else LinearSolver3D
+    return solver(truss.edof, truss.max_edof, *coords(truss), data.ep, truss.e_num,
+                  truss.supports, truss.forces, plan=truss.partition,
+                  geometry=truss.geometry, **options)
+
+
+def nonlinear(data, truss, **options):
+    """Force-controlled Newton solve in 10 steps, tracking the first dof"""
+    return NonlinearForceSolver2D(truss.edof, truss.max_edof, truss.ex, truss.ey, data.ep,
+                                  truss.e_num, truss.supports, truss.forces, 10, 50,
+                                  1e-6, 1e-6, 1, plan=truss.partition,
+                                  geometry=truss.geometry, **options)
+
+
+class Recorder:
+    """Observer keeping the solver events with the load factor at the time of the event"""
+
+    def __init__(self):
+        self.events = []
+
+    def count(self, name):
+        return sum(1 for event in self.events if event[0] == name)
+
+    def start(self, solver):
+        self.events.append(("start", solver.load_factor))
+
+    def path(self, solver, x, y):
+        self.events.append(("path", x, y))
+
+    def iteration(self, solver, step, itr, res_norm, dq_norm):
+        self.events.append(("iteration", step, itr, res_norm, dq_norm))
+
+    def step(self, solver, step, itr, converged):
+        self.events.append(("step", step, itr, converged, solver.load_factor))
+
+    def cutback(self, solver, step):
+        self.events.append(("cutback", step))
+
+    def finish(self, solver):
+        self.events.append(("finish", solver.load_factor))
+
+
+@pytest.fixture(params=DATA_MODELS, ids=os.path.basename)
+def model(request):
+    return build(request.param)
+
+
+@pytest.fixture
+def deformed(model):
+    """Model with element displacements of a realistic size"""
+    data, truss = model
+    size = np.abs(truss.ex).max()*1e-2
+    q = np.random.default_rng(0).uniform(-size, size, (truss.max_edof, 1))
+    return data, truss, extractElext(truss.edof, q)
+
+
+def test_batched_forces_match_reference(deformed):
+    data, truss, qe = deformed
+    forces = Forces2D if isinstance(truss, Truss2D) else Forces3D
+    batched = forces(truss.edof, truss.e_num, *coords(truss), data.ep, qe)
+    reference = forces(truss.edof, truss.e_num, *coords(truss), data.ep, qe)
+
+    np.testing.assert_allclose(batched.compute_Ne_lin(),
+                               reference.compute_Ne_lin(batched=False), rtol=1e-10)
+    np.testing.assert_allclose(batched.compute_Ne(),
+                               reference.compute_Ne(batched=False), rtol=1e-10)
+    np.testing.assert_allclose(batched.compute_F(), reference.compute_F(batched=False),
+                               rtol=1e-10, atol=1e-8*np.abs(batched.Ne).max())
+
+
+def test_batched_stiffness_matches_reference(deformed):
+    data, truss, qe = deformed
+    forces = Forces2D if isinstance(truss, Truss2D) else Forces3D
+    stiffness = Stiffness2D if isinstance(truss, Truss2D) else Stiffness3D
+    Ne = forces(truss.edof, truss.e_num, *coords(truss), data.ep, qe).compute_Ne()
+    K = stiffness(truss.edof, truss.e_num, *coords(truss), data.ep, qe, Ne)
+
+    K_0 = K.compute_ke_0(batched=False)
+    K_T = K.compute_ke_T(batched=False)
+    scale = np.abs(K_0).max()
+    np.testing.assert_allclose(K.compute_ke_0(), K_0, atol=1e-12*scale)
+    np.testing.assert_allclose(K.compute_ke_T(), K_T, atol=1e-12*scale)
+    np.testing.assert_allclose(K.compute_ke_T(sparse=True).toarray(), K_T, atol=1e-12*scale)
+
+
+def test_internal_state_matches_separate_kernels(deformed):
+    data, truss, qe = deformed
+    forces = Forces2D if isinstance(truss, Truss2D) else Forces3D
+    stiffness = Stiffness2D if isinstance(truss, Truss2D) else Stiffness3D
+    state = InternalState2D if isinstance(truss, Truss2D) else InternalState3D
+    Fe = forces(truss.edof, truss.e_num, *coords(truss), data.ep, qe)
+    Ne_ref = Fe.compute_Ne(batched=False)
+    F_ref = Fe.compute_F(batched=False)
+    K_ref = stiffness(truss.edof, truss.e_num, *coords(truss), data.ep, qe,
+                      Ne_ref).compute_ke_T(batched=False)
+
+    Ne, F, K_T = state(truss.edof, truss.e_num, *coords(truss), data.ep, qe,
+                       truss.plan, truss.geometry).compute(sparse=True)
+    np.testing.assert_allclose(Ne, Ne_ref, rtol=1e-10)
+    np.testing.assert_allclose(F, F_ref, rtol=1e-10, atol=1e-8*np.abs(Ne).max())
+    np.testing.assert_allclose(K_T.toarray(), K_ref, atol=1e-12*np.abs(K_ref).max())
+
+
+def test_tangent_matches_finite_differences(model):
+    data, truss = model
+    state = InternalState2D if isinstance(truss, Truss2D) else InternalState3D
+    size = np.abs(truss.ex).max()*1e-2
+    q = np.random.default_rng(0).uniform(-size, size, (truss.max_edof, 1))
+
+    def internal(q):
+        return state(truss.edof, truss.e_num, *coords(truss), data.ep,
+                     extractElext(truss.edof, q)).compute()
+
+    K_T = internal(q)[2]
+    h = size*1e-4
+    K_fd = np.zeros(K_T.shape)
+    for j in range(truss.max_edof):
+        dq = np.zeros((truss.max_edof, 1))
+        dq[j] = h
+        K_fd[:, j] = (internal(q+dq)[1]-internal(q-dq)[1]).ravel()/(2*h)
+    np.testing.assert_allclose(K_T, K_fd, atol=1e-6*np.abs(K_T).max())
+
+
+def test_partition_assembles_the_global_matrix(model):
+    data, truss = model
+    stiffness = Stiffness2D if isinstance(truss, Truss2D) else Stiffness3D
+    dense = stiffness(truss.edof, truss.e_num, *coords(truss), data.ep).compute_ke_0()
+    K = stiffness(truss.edof, truss.e_num, *coords(truss), data.ep, plan=truss.partition,
+                  geometry=truss.geometry)
+    np.testing.assert_allclose(K.compute_ke_0().tocsr().toarray(), dense,
+                               atol=1e-12*np.abs(dense).max())
+    # Buffers are reused, a second assembly gives the same matrix
+    np.testing.assert_allclose(K.compute_ke_0().tocsr().toarray(), dense,
+                               atol=1e-12*np.abs(dense).max())
+
+
+@pytest.mark.parametrize("backend", ["sparse", "pcg", "skyline"])
+def test_backends_match_dense(model, backend):
+    data, truss = model
+    dense = linear(data, truss)
+    solve = linear(data, truss, backend=backend)
+    np.testing.assert_allclose(np.asarray(solve.q), np.asarray(dense.q), atol=1e-5)
+    np.testing.assert_allclose(np.asarray(solve.R), np.asarray(dense.R),
+                               atol=1e-6*np.abs(dense.R).max())
+
+
+def test_pcg_raises_when_not_converged(model):
+    data, truss = model
+    K = Stiffness2D if isinstance(truss, Truss2D) else Stiffness3D
+    K = K(truss.edof, truss.e_num, *coords(truss), data.ep,
+          plan=truss.partition).compute_ke_0()
+    # Random loads excite every eigenvector of the free-dof block, the bundled loads may
+    # excite only one and then plain CG converges in a single iteration
+    f = np.random.default_rng(0).uniform(-1, 1, (truss.max_edof, 1))
+    K = Factorization(K, truss.supports, "pcg", preconditioner=None, maxiter=1)
+    with pytest.raises(RuntimeError):
+        K.solve(f)
+
+
+@pytest.mark.parametrize("path", NONLINEAR_MODELS, ids=os.path.basename)
+def test_nonlinear_pcg_matches_dense(path):
+    data, truss = build(path)
+    dense = nonlinear(data, truss)
+    solve = nonlinear(data, truss, backend="pcg")
+    assert solve.converged
+    assert solve.iterations == dense.iterations
+    np.testing.assert_allclose(np.asarray(solve.q), np.asarray(dense.q), atol=1e-5)
+
+
+def test_factorization_solves_many_load_cases(model):
+    data, truss = model
+    K = Stiffness2D if isinstance(truss, Truss2D) else Stiffness3D
+    K = K(truss.edof, truss.e_num, *coords(truss), data.ep,
+          plan=truss.partition).compute_ke_0()
+    f = np.hstack([truss.forces, 2*truss.forces])
+    q, R = Factorization(K, truss.supports).solve(f)
+    np.testing.assert_allclose(q[:, 1], 2*q[:, 0], rtol=1e-12, atol=1e-15)
+
+
+def test_load_cases_match_separate_solves(model):
+    data, truss = model
+    rng = np.random.default_rng(0)
+    forces = np.hstack([truss.forces, -0.5*truss.forces,
+                        rng.uniform(-1, 1, truss.forces.shape), truss.forces])
+    # The last case adds support settlements to the model load
+    bcVal = np.zeros((len(truss.supports), forces.shape[1]))
+    bcVal[:, -1] = rng.uniform(-1e-2, 1e-2, len(truss.supports))
+
+    is2D = isinstance(truss, Truss2D)
+    solver = LoadCasesSolver2D if is2D else LoadCasesSolver3D
+    cases = solver(truss.edof, truss.max_edof, *coords(truss), data.ep, truss.e_num,
+                   truss.supports, forces, plan=truss.partition, geometry=truss.geometry,
+                   bcVal=bcVal)
+
+    for c in range(0, forces.shape[1]-1):
+        solver = LinearSolver2D if is2D else LinearSolver3D
+        single = solver(truss.edof, truss.max_edof, *coords(truss), data.ep, truss.e_num,
+                        truss.supports, forces[:, [c]], plan=truss.partition,
+                        geometry=truss.geometry)
+        # LinearSolver rounds its results to 5 decimals
+        np.testing.assert_allclose(cases.q[:, c], single.q, atol=1e-5)
+        np.testing.assert_allclose(cases.R[:, c], single.R, atol=1e-5)
+        np.testing.assert_allclose(cases.Ne[:, [c]], single.Ne, atol=1e-5)
+
+    K = Stiffness2D if is2D else Stiffness3D
+    K = K(truss.edof, truss.e_num, *coords(truss), data.ep,
+          plan=truss.partition).compute_ke_0()
+    q, R = solveq(K, forces[:, [-1]], truss.supports, bcVal[:, [-1]])
+    Fe = Forces2D if is2D else Forces3D
+    Ne = Fe(truss.edof, truss.e_num, *coords(truss), data.ep, extractElext(truss.edof, q),
+            geometry=truss.geometry).compute_Ne_lin()
+    np.testing.assert_allclose(cases.q[:, -1], q, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(cases.R[:, -1], R, rtol=1e-10, atol=1e-10)
+    np.testing.assert_allclose(cases.Ne[:, [-1]], Ne, rtol=1e-10, atol=1e-10)
+    np.testing.assert_allclose(np.asarray(cases.q)[truss.supports-1, -1], bcVal[:, -1])
+
+
+@pytest.mark.parametrize("path", DATA_MODELS, ids=os.path.basename)
+def test_reordered_results_in_original_numbering(path):
+    data, truss = build(path)
+    data, reordered = build(path, reorder=True)
+    plain = linear(data, truss)
+    solve = reordered.original_numbering(linear(data, reordered))
+
+    for name in ("q", "R", "nodal_q", "nodal_R"):
+        assert type(getattr(solve, name)) is type(getattr(plain, name))
+    np.testing.assert_allclose(solve.nodal_q, plain.nodal_q, atol=1e-5)
+    np.testing.assert_allclose(solve.nodal_R, plain.nodal_R, atol=1e-5)
+
+
+def test_adaptive_stepping_stops_when_the_step_collapses():
+    data, truss = build(os.path.join(SRC, "data", "truss2D.json"))
+    events = Recorder()
+    solve = nonlinear(data, truss, strategy="initial", adaptive=True, observers=[events])
+    assert not solve.converged
+    assert solve.load_factor < 1
+    assert 0 < events.count("cutback") <= NonlinearForceSolver2D.max_total_cutbacks
+
+
+def test_adaptive_stepping_holds_the_step_after_a_cutback():
+    data, truss = build(os.path.join(SRC, "data", "truss2D.json"))
+    events = Recorder()
+    nonlinear(data, truss, strategy="initial", adaptive=True, line_search=True,
+              observers=[events])
+    steps = [event for event in events.events if event[0] in ("step", "cutback")]
+    load, last, held = 0., None, 0
+    for event in steps:
+        if event[0] == "cutback":
+            last, held = None, NonlinearForceSolver2D.hold_steps+1
+            continue
+        step = event[4]-load
+        load = event[4]
+        if held and last is not None:
+            assert step <= last*(1+1e-12)
+        held = max(held-1, 0)
+        last = step
+    # Bounded work even though the initial stiffness iterations stall
+    assert events.count("iteration") <= 2000
+
+
+def test_adaptive_stepping_reaches_the_fixed_step_solution():
+    # data2D_diff_EA.json has several equilibrium states at the full load,
+    # larger steps may end on another one
+    data, truss = build(NONLINEAR_MODELS[0])
+    fixed = nonlinear(data, truss)
+    solve = nonlinear(data, truss, adaptive=True)
+    assert solve.converged and solve.load_factor == 1
+    assert sum(solve.iterations) <= sum(fixed.iterations)
+    np.testing.assert_allclose(np.asarray(solve.q), np.asarray(fixed.q), atol=1e-5)
+
+
+def von_mises(maxLoad):
+    """Arc-length trace of the snap-through of the von Mises truss example"""
+    path = next(path for path in EXAMPLE_MODELS if "von_mises" in path)
+    data, truss = build(path)
+    solve = ArcLengthSolver2D(truss.edof, truss.max_edof, truss.ex, truss.ey, data.ep,
+                              truss.e_num, truss.supports, truss.forces, 0.05, 200, 30,
+                              1e-6, 1e-6, 3, maxLoad, plan=truss.partition,
+                              geometry=truss.geometry)
+    return data, truss, solve
+
+
+def test_arc_length_passes_the_limit_point():
+    data, truss, solve = von_mises(1.)
+    assert solve.converged
+    # The load factor falls after the limit point and rises again on the inverted
+    # branch, load control cannot follow that
+    assert np.any(np.diff(solve.path_load) < 0)
+    assert min(solve.path_load) < 0
+
+
+@pytest.mark.parametrize("maxLoad", [0.2, 1.])
+def test_arc_length_ends_at_the_maximum_load(maxLoad):
+    data, truss, solve = von_mises(maxLoad)
+    assert solve.converged
+    assert solve.load_factor == maxLoad == solve.path_load[-1]
+    assert max(solve.path_load) == maxLoad
+
+    # The final state is the equilibrium state reached by load control
+    forces = truss.forces
+    truss.forces = maxLoad*forces
+    fixed = nonlinear(data, truss)
+    truss.forces = forces
+    np.testing.assert_allclose(np.asarray(solve.q), np.asarray(fixed.q), atol=1e-5)
+    np.testing.assert_allclose(np.asarray(solve.R), np.asarray(fixed.R), atol=1e-5)
+
+
+def test_arc_length_traces_the_dome_to_the_full_load():
+    data, truss = build(next(path for path in EXAMPLE_MODELS if "dome" in path))
+    solve = ArcLengthSolver3D(truss.edof, truss.max_edof, truss.ex, truss.ey, truss.ez,
+                              data.ep, truss.e_num, truss.supports, truss.forces, 0.2, 400,
+                              30, 1e-6, 1e-6, 2, 1., plan=truss.partition,
+                              geometry=truss.geometry)
+    assert solve.converged
+    assert solve.load_factor == 1 == solve.path_load[-1]
+    # The crown snaps through, the load factor turns back twice on the way
+    assert np.any(np.diff(solve.path_load) < 0)
+    assert min(solve.path_load) < 0
+
+    fixed = NonlinearForceSolver3D(truss.edof, truss.max_edof, truss.ex, truss.ey, truss.ez,
+                                   data.ep, truss.e_num, truss.supports, truss.forces, 10,
+                                   50, 1e-6, 1e-6, 2, plan=truss.partition,
+                                   geometry=truss.geometry)
+    assert fixed.converged
+    np.testing.assert_allclose(np.asarray(solve.q), np.asarray(fixed.q), atol=1e-5)
+
+
+@pytest.mark.parametrize("path", ["data2D_same_EA.json", "truss2D.json"])
+def test_modified_newton_reproduces_full_newton(path):
+    data, truss = build(os.path.join(SRC, "data", path))
+    full = nonlinear(data, truss)
+    solve = nonlinear(data, truss, strategy="modified")
+    assert solve.converged
+    # One factorization per increment instead of one per iteration
+    assert solve.factorizations == len(solve.iterations) == 10
+    np.testing.assert_allclose(np.asarray(solve.q), np.asarray(full.q), atol=1e-5)
+
+
+def test_initial_stiffness_reproduces_full_newton():
+    data, truss = build(os.path.join(SRC, "data", "data2D_same_EA.json"))
+    full = nonlinear(data, truss)
+    solve = nonlinear(data, truss, strategy="initial")
+    assert solve.converged
+    assert solve.factorizations == 1
+    np.testing.assert_allclose(np.asarray(solve.q), np.asarray(full.q), atol=1e-5)
+
+
+def test_unknown_strategy_is_rejected():
+    data, truss = build(NONLINEAR_MODELS[0])
+    with pytest.raises(ValueError, match="strategy"):
+        nonlinear(data, truss, strategy="secant")
+
+
+@pytest.mark.parametrize("path", ["data2D_same_EA.json", "truss2D.json"])
+def test_bfgs_reproduces_full_newton(path):
+    data, truss = build(os.path.join(SRC, "data", path))
+    full = nonlinear(data, truss)
+    modified = nonlinear(data, truss, strategy="modified")
+    solve = nonlinear(data, truss, strategy="bfgs")
+    assert solve.converged
+    assert solve.factorizations == 10
+    # The updates recover most of the convergence rate lost by keeping the tangent
+    assert sum(solve.iterations) < sum(modified.iterations)
+    np.testing.assert_allclose(np.asarray(solve.q), np.asarray(full.q), atol=1e-5)
+
+
+def test_bfgs_update_without_pairs_is_the_factorization(model):
+    data, truss = model
+    K = Stiffness2D if isinstance(truss, Truss2D) else Stiffness3D
+    K = Factorization(K(truss.edof, truss.e_num, *coords(truss), data.ep,
+                        plan=truss.partition).compute_ke_0(), truss.supports)
+    dq, dR = BFGSUpdate(K).solve(truss.forces)
+    q, R = K.solve(truss.forces)
+    np.testing.assert_allclose(np.asarray(dq), np.asarray(q), rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(np.asarray(dR), np.asarray(R), rtol=1e-12,
+                               atol=1e-12*np.abs(R).max())
+
+
+def test_line_search_finds_the_energy_minimum():
+    Res = np.array([[1.], [-2.], [0.5]])
+    # Twice the Newton step of a linear problem overshoots, the minimum is at s = 0.5
+    assert line_search(lambda s: (1-2*s)*Res, 2*Res, Res) == pytest.approx(0.5)
+    # The Newton step itself is accepted as it is
+    assert line_search(lambda s: (1-s)*Res, Res, Res) == 1.
+    # No descent direction, no search
+    assert line_search(lambda s: (1+s)*Res, -Res, Res) == 1.
+
+
+def test_line_search_makes_initial_stiffness_converge():
+    data, truss = build(next(path for path in EXAMPLE_MODELS if "von_mises" in path))
+    full = nonlinear(data, truss)
+    assert not nonlinear(data, truss, strategy="initial").converged
+    solve = nonlinear(data, truss, strategy="initial", line_search=True)
+    assert solve.converged
+    np.testing.assert_allclose(np.asarray(solve.q), np.asarray(full.q), atol=1e-5)
+
+
+@pytest.mark.parametrize("path", ["data2D_same_EA.json", "truss2D.json"])
+def test_secant_predictor_reproduces_the_tangent_predictor(path):
+    data, truss = build(os.path.join(SRC, "data", path))
+    tangent = nonlinear(data, truss)
+    solve = nonlinear(data, truss, predictor="secant")
+    assert solve.converged
+    # Full Newton factorizes in every iteration, the tangent predictor in every step too,
+    # the secant predictor only in the first step
+    assert tangent.factorizations == len(tangent.iterations)+sum(tangent.iterations)
+    assert solve.factorizations == 1+sum(solve.iterations)
+    np.testing.assert_allclose(np.asarray(solve.q), np.asarray(tangent.q), atol=1e-5)
+
+
+def test_secant_predictor_extrapolates_the_last_step():
+    data, truss = build(os.path.join(SRC, "data", "data2D_same_EA.json"))
+    solve = nonlinear(data, truss, predictor="secant")
+    (lf0, q0, R0), (lf1, q1, R1) = solve._history
+    dq, dR = solve.extrapolate(2*(lf1-lf0))
+    np.testing.assert_allclose(dq, 2*(q1-q0))
+    np.testing.assert_allclose(dR, 2*(R1-R0))
+
+
+def test_solver_core_does_not_import_matplotlib():
+    code = "import sys, structure.solver; print('matplotlib' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=SRC, check=True,
+                         capture_output=True, text=True).stdout
+    assert out.strip() == "False"
+
+
+def test_observers_receive_the_solver_events():
+    data, truss = build(NONLINEAR_MODELS[0])
+    events = Recorder()
+    solve = nonlinear(data, truss, observers=[events])
+    names = [event[0] for event in events.events]
+    assert names[0] == "start" and names[-1] == "finish"
+    assert "cutback" not in names
+
+    steps = [event for event in events.events if event[0] == "step"]
+    assert [event[2] for event in steps] == solve.iterations
+    assert [event[1] for event in steps] == list(range(1, len(solve.iterations)+1))
+    assert all(event[3] for event in steps)
+    # Iterations of every step are numbered from 1 up to the iterations of the step
+    for step, itr in enumerate(solve.iterations, start=1):
+        numbers = [event[2] for event in events.events
+                   if event[0] == "iteration" and event[1] == step]
+        assert numbers == list(range(1, itr+1))
+
+
+def test_equilibrium_path_plot_is_a_solver_observer():
+    data, truss = build(next(path for path in EXAMPLE_MODELS if "von_mises" in path))
+    events = Recorder()
+    chart = EquilibriumPathPlot(pause=None)
+    # Agg renders on every draw_idle, the points are checked instead of the drawing
+    chart.redraw = lambda: None
+    try:
+        nonlinear(data, truss, observers=[events, chart])
+    finally:
+        plt.close("all")
+    path = [event[1:] for event in events.events if event[0] == "path"]
+    assert list(zip(chart.x, chart.y)) == [(0, 0)]+path